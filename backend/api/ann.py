@@ -0,0 +1,188 @@
+import logging
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+rag_logger = logging.getLogger('rag_debug')
+
+# Collection that stores trained ANN state next to product_embeddings
+ANN_COLLECTION = "product_embeddings_ann"
+
+# Rows scored per matmul when assigning vectors to centroids
+_ASSIGN_CHUNK = 65536
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the top_k highest scores, best first.
+
+    argpartition selects the k best in linear time; only those k are sorted.
+    """
+    n = scores.shape[0]
+    if top_k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if top_k >= n:
+        return np.argsort(-scores)
+    part = np.argpartition(-scores, top_k - 1)[:top_k]
+    return part[np.argsort(-scores[part])]
+
+
+def top_k_indices_2d(scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Column-wise top_k of an (n_rows, n_queries) score matrix.
+
+    Returns (indices, scores), each shaped (n_queries, k) and sorted best first.
+    """
+    n, m = scores.shape
+    k = min(max(top_k, 0), n)
+    if k == 0:
+        return np.zeros((m, 0), dtype=np.int64), np.zeros((m, 0), dtype=scores.dtype)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=0)[:k]
+    else:
+        part = np.broadcast_to(np.arange(n)[:, None], (n, m))
+    part_scores = np.take_along_axis(scores, part, axis=0)
+    order = np.argsort(-part_scores, axis=0)
+    idxs = np.take_along_axis(part, order, axis=0)
+    return idxs.T, np.take_along_axis(part_scores, order, axis=0).T
+
+
+def _assign(X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid (by inner product) for every row of X."""
+    labels = np.empty(X.shape[0], dtype=np.int32)
+    for start in range(0, X.shape[0], _ASSIGN_CHUNK):
+        block = X[start:start + _ASSIGN_CHUNK]
+        labels[start:start + block.shape[0]] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def _spherical_kmeans(X: np.ndarray, k: int, n_iter: int = 10, seed: int = 0) -> np.ndarray:
+    """k-means on the unit sphere; X must already be L2-normalized."""
+    rng = np.random.default_rng(seed)
+    centroids = X[rng.choice(X.shape[0], k, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _assign(X, centroids)
+        counts = np.bincount(labels, minlength=k)
+        nonempty = counts > 0
+        order = np.argsort(labels, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        centroids[nonempty] = np.add.reduceat(X[order], starts, axis=0)
+        # Re-seed empty clusters from random points so every list stays usable
+        n_empty = int((~nonempty).sum())
+        if n_empty:
+            centroids[~nonempty] = X[rng.choice(X.shape[0], n_empty, replace=False)]
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-8
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Inverted-file ANN index over an L2-normalized embedding matrix.
+
+    Coarse centroids are trained with spherical k-means; each row lives in the
+    inverted list of its nearest centroid. A query scores the centroids, then
+    only the rows in the ``nprobe`` closest lists. Only the centroids are
+    persisted; list membership is recomputed from the matrix on load.
+    """
+
+    def __init__(self, centroids: np.ndarray, trained_rows: int):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.trained_rows = trained_rows
+        self._labels = np.zeros(0, dtype=np.int32)
+        self._order = np.zeros(0, dtype=np.int64)
+        self._offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    @property
+    def dim(self) -> int:
+        return int(self.centroids.shape[1])
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the centroids and inverted lists."""
+        return self.centroids.nbytes + self._labels.nbytes + self._order.nbytes + self._offsets.nbytes
+
+    @classmethod
+    def train(cls, matrix: np.ndarray, nlist: int = 0, n_iter: int = 10, seed: int = 0) -> "IVFIndex":
+        n = matrix.shape[0]
+        if nlist <= 0:
+            nlist = int(np.sqrt(n))
+        # Keep the centroid blob comfortably under Mongo's 16 MB document limit
+        nlist = max(1, min(nlist, n, 1024))
+        # ~64 points per centroid is plenty for coarse quantization
+        sample_size = min(n, nlist * 64)
+        rng = np.random.default_rng(seed)
+        sample = matrix[rng.choice(n, sample_size, replace=False)] if sample_size < n else matrix
+        rag_logger.info(f"Training IVF index: rows={n}, nlist={nlist}, sample={sample_size}")
+        return cls(_spherical_kmeans(np.asarray(sample, dtype=np.float32), nlist, n_iter, seed), trained_rows=n)
+
+    def needs_retrain(self, n_rows: int) -> bool:
+        """Centroids trained on a much smaller catalog give unbalanced lists."""
+        return n_rows > 4 * max(self.trained_rows, 1)
+
+    def add(self, matrix: np.ndarray, rows: Optional[Iterable[int]] = None) -> None:
+        """(Re)assign ``rows`` of ``matrix`` (all rows when None) to inverted lists."""
+        n = matrix.shape[0]
+        if rows is None or self._labels.shape[0] == 0:
+            labels = _assign(matrix, self.centroids)
+        else:
+            labels = np.empty(n, dtype=np.int32)
+            known = min(self._labels.shape[0], n)
+            labels[:known] = self._labels[:known]
+            rows = np.fromiter(rows, dtype=np.int64)
+            # Rows appended since the last call must be assigned as well
+            rows = np.union1d(rows, np.arange(known, n))
+            if rows.size:
+                labels[rows] = _assign(matrix[rows], self.centroids)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=self.nlist))])
+        self._labels, self._order, self._offsets = labels, order, offsets
+
+    def search(self, matrix: np.ndarray, q: np.ndarray, top_k: int, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row indices, scores) of approximate top_k rows for unit query q."""
+        order, offsets = self._order, self._offsets
+        centroid_scores = self.centroids @ q
+        probe_order = np.argsort(-centroid_scores)
+
+        # Probe at least nprobe lists, and keep going until top_k candidates exist
+        lists = []
+        n_candidates = 0
+        for probed, lst in enumerate(probe_order):
+            if probed >= nprobe and n_candidates >= top_k:
+                break
+            size = offsets[lst + 1] - offsets[lst]
+            if size:
+                lists.append(order[offsets[lst]:offsets[lst + 1]])
+                n_candidates += size
+
+        if not lists:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        candidates = np.concatenate(lists)
+        scores = matrix[candidates] @ q
+        top = top_k_indices(scores, top_k)
+        return candidates[top], scores[top]
+
+    def save(self, coll) -> None:
+        coll.replace_one(
+            {"_id": "ivf"},
+            {
+                "_id": "ivf",
+                "nlist": self.nlist,
+                "dim": self.dim,
+                "trained_rows": self.trained_rows,
+                "centroids": self.centroids.astype("<f4").tobytes(),
+                "updated_at": datetime.utcnow(),
+            },
+            upsert=True,
+        )
+        rag_logger.info(f"Saved IVF centroids to {coll.name}: nlist={self.nlist}, dim={self.dim}")
+
+    @classmethod
+    def load(cls, coll, dim: int) -> Optional["IVFIndex"]:
+        doc = coll.find_one({"_id": "ivf"})
+        if not doc or doc.get("dim") != dim:
+            return None
+        centroids = np.frombuffer(doc["centroids"], dtype="<f4").reshape(doc["nlist"], dim)
+        rag_logger.info(f"Loaded IVF centroids from {coll.name}: nlist={doc['nlist']}, dim={dim}")
+        return cls(centroids, trained_rows=doc.get("trained_rows", 0))
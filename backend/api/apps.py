@@ -0,0 +1,43 @@
+import os
+import threading
+
+from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
+
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def _start_background_threads(**kwargs) -> None:
+    """Start the health monitor and indexer threads on a process's first request.
+
+    Only processes that serve requests reach this, and a forked worker
+    (gunicorn ``--preload``) starts its own rather than inheriting the master's.
+    """
+    global _started_pid
+    pid = os.getpid()
+    if _started_pid == pid:
+        return
+    with _start_lock:
+        if _started_pid == pid:
+            return
+        _started_pid = pid
+
+        from .openrouter_health import get_health_monitor
+        get_health_monitor()
+
+        if getattr(settings, 'RAG_INDEXER_MODE', 'thread') == 'thread':
+            from .indexer import start_background_indexer
+            start_background_indexer()
+
+
+class ApiConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'api'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        if getattr(settings, 'RAG_BACKGROUND_THREADS', True):
+            request_started.connect(_start_background_threads, dispatch_uid='api_background_threads')
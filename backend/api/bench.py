@@ -0,0 +1,287 @@
+import logging
+import re
+import resource
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+
+from .ann import ANN_COLLECTION, top_k_indices, top_k_indices_2d
+from .rag import (
+    _cosine_sim_matrix,
+    _embed_and_store,
+    get_query_embedding_cache,
+    get_search_result_cache,
+    invalidate_search_results,
+    reset_search_degraded,
+    search_backend,
+    search_cache_key,
+    search_degraded,
+    semantic_search,
+)
+from .vector_index import EmbeddingIndex
+
+rag_logger = logging.getLogger('rag_debug')
+
+# Index configurations the benchmark knows how to build, as EmbeddingIndex kwargs
+BENCH_CONFIGS: Dict[str, dict] = {
+    "exact": {},
+    "ivf": {"engine": "ivf", "ann_min_rows": 0},
+    "int8": {"quantization": "int8"},
+    "pq": {"quantization": "pq"},
+    "truncate": {"quantization": "truncate"},
+    "pca": {"quantization": "pca"},
+}
+
+_SKU_RE = re.compile(r"SKU-(\d+)")
+# Query texts are normalized (lowercased) before they reach the embedder
+_QUERY_RE = re.compile(r"query-(\d+)")
+_CATEGORIES = [f"category-{i}" for i in range(20)]
+_TAGS = [f"tag-{i}" for i in range(50)]
+
+# Rows generated per block, bounding the temporaries for large catalogs
+_GEN_CHUNK = 65536
+
+
+class SyntheticCatalog:
+    """Deterministic fake catalog: clustered unit embeddings plus text and facets.
+
+    Rows are drawn around ``sqrt(n)`` random centers so ANN and quantization
+    recall look like a real catalog's rather than uniform noise. Each product
+    text carries ``SKU-<row>``, which the stub embedder maps back to its row.
+    """
+
+    def __init__(self, n: int, dim: int = 384, spread: float = 0.6, seed: int = 0):
+        self.n = n
+        self.dim = dim
+        rng = np.random.default_rng(seed)
+        n_centers = max(8, int(np.sqrt(n)))
+        centers = rng.standard_normal((n_centers, dim), dtype=np.float32)
+        self.matrix = np.empty((n, dim), dtype=np.float32)
+        for start in range(0, n, _GEN_CHUNK):
+            stop = min(n, start + _GEN_CHUNK)
+            block = centers[rng.integers(0, n_centers, stop - start)]
+            block += spread * rng.standard_normal(block.shape, dtype=np.float32)
+            self.matrix[start:stop] = block / np.linalg.norm(block, axis=1, keepdims=True)
+        self.categories = rng.integers(0, len(_CATEGORIES), n)
+        self.prices = np.round(rng.lognormal(3.5, 1.0, n), 2)
+        self.tags = rng.integers(0, len(_TAGS), (n, 3))
+
+    def pk(self, row: int) -> str:
+        return f"{row:024x}"
+
+    def text(self, row: int) -> str:
+        return f"Synthetic product {row} SKU-{row} {_CATEGORIES[self.categories[row]]}"
+
+    def metadata(self, row: int) -> dict:
+        return {
+            "category": _CATEGORIES[self.categories[row]],
+            "price": float(self.prices[row]),
+            "tags": sorted({_TAGS[t] for t in self.tags[row]}),
+        }
+
+    def missing(self) -> List[tuple]:
+        """Every product as the (pk, text, content_hash, metadata) tuples the backfill takes."""
+        return [(self.pk(i), self.text(i), f"bench-{i}", self.metadata(i)) for i in range(self.n)]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Stub embedder: no network, same vector for the same product every run."""
+        return [self.matrix[int(_SKU_RE.search(t).group(1))].tolist() for t in texts]
+
+    def queries(self, n_queries: int, noise: float = 0.1, seed: int = 1) -> np.ndarray:
+        """Unit queries near random catalog rows."""
+        rng = np.random.default_rng(seed)
+        Q = self.matrix[rng.choice(self.n, min(n_queries, self.n), replace=False)]
+        Q = Q + noise * rng.standard_normal(Q.shape, dtype=np.float32) / np.sqrt(self.dim)
+        return Q / np.linalg.norm(Q, axis=1, keepdims=True)
+
+    def query_filter(self, i: int) -> dict:
+        """Category filter used for query ``i`` in the filtered pass."""
+        return {"category": _CATEGORIES[i % len(_CATEGORIES)]}
+
+
+def query_texts(n_queries: int) -> List[str]:
+    return [f"Benchmark query-{i}" for i in range(n_queries)]
+
+
+def stub_embedder(catalog: SyntheticCatalog, Q: np.ndarray):
+    """Embeds benchmark query texts as rows of ``Q`` and product texts as catalog rows."""
+    def embed(texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for text in texts:
+            match = _QUERY_RE.search(text)
+            vectors.append(Q[int(match.group(1))].tolist() if match else catalog.embed([text])[0])
+        return vectors
+    return embed
+
+
+def exact_top_k(matrix: np.ndarray, Q: np.ndarray, top_k: int, chunk: int = 16) -> np.ndarray:
+    """Ground-truth row indices (n_queries, k), scoring a few queries at a time."""
+    parts = [top_k_indices_2d(matrix @ Q[i:i + chunk].T, top_k)[0] for i in range(0, Q.shape[0], chunk)]
+    return np.vstack(parts)
+
+
+def filtered_top_k(catalog: SyntheticCatalog, Q: np.ndarray, top_k: int) -> List[np.ndarray]:
+    """Ground truth for the filtered pass: exact top_k among the rows in each query's category."""
+    truth = []
+    for i, q in enumerate(Q):
+        rows = np.flatnonzero(catalog.categories == _CATEGORIES.index(catalog.query_filter(i)["category"]))
+        truth.append(rows[top_k_indices(catalog.matrix[rows] @ q, top_k)])
+    return truth
+
+
+def latency_summary(seconds: List[float]) -> dict:
+    ms = np.asarray(seconds) * 1000.0
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p95": round(float(np.percentile(ms, 95)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+        "mean": round(float(ms.mean()), 3),
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _recall(found: List[List[str]], truth, catalog: SyntheticCatalog) -> float:
+    hits = sum(len(set(f) & {catalog.pk(int(r)) for r in t}) for f, t in zip(found, truth))
+    total = sum(len(t) for t in truth)
+    return round(hits / total, 4) if total else 1.0
+
+
+def cached_semantic_search(query: str, top_k: int, filters: Optional[dict] = None) -> List[str]:
+    """``semantic_search`` behind the result cache, as the semantic_search endpoint serves it."""
+    filters = filters or {}
+    cache = get_search_result_cache()
+    key = search_cache_key("semantic", query, top_k, filters)
+    entry = cache.get(key)
+    if entry is not None:
+        return entry["pks"]
+    reset_search_degraded()
+    pks = semantic_search(query, top_k=top_k, **filters)
+    if pks and not search_degraded():
+        cache.set(key, pks, None)
+    return pks
+
+
+def _timed_pass(texts: List[str], top_k: int, filters=None) -> tuple:
+    found, latencies = [], []
+    for i, text in enumerate(texts):
+        start = time.perf_counter()
+        found.append(cached_semantic_search(text, top_k, filters(i) if filters else None))
+        latencies.append(time.perf_counter() - start)
+    return found, latency_summary(latencies)
+
+
+def bench_index(coll, catalog: SyntheticCatalog, name: str, Q: np.ndarray, truth: np.ndarray,
+                top_k: int, filtered_truth: Optional[List[np.ndarray]] = None, **index_kwargs) -> dict:
+    """Build one index config from ``coll`` and time queries through the public search path.
+
+    Each query text goes through the query embedding cache, the filters and
+    the result cache like a semantic_search request, in passes: ``embed_miss``
+    (query embeddings not cached yet), ``search`` (embeddings cached, results
+    not), ``cached`` (result cache hits) and ``filtered`` (a category filter).
+    """
+    if name == "ivf":
+        # Train centroids for this catalog instead of reusing a smaller run's
+        coll.database[ANN_COLLECTION].drop()
+    # Every config starts with a cold shared query cache
+    coll.database["query_embedding_cache"].drop()
+    index = EmbeddingIndex(
+        refresh_interval=getattr(settings, 'RAG_INDEX_REFRESH_SECONDS', 5.0),
+        **{**BENCH_CONFIGS[name], **index_kwargs},
+    )
+    start = time.perf_counter()
+    index.refresh(coll, force=True)
+    build_seconds = time.perf_counter() - start
+
+    texts = query_texts(Q.shape[0])
+    latency = {}
+    with search_backend(coll.database, index=index, embed=stub_embedder(catalog, Q)):
+        _, latency["embed_miss"] = _timed_pass(texts, top_k)
+        invalidate_search_results()
+        found, latency["search"] = _timed_pass(texts, top_k)
+        _, latency["cached"] = _timed_pass(texts, top_k)
+        filtered = None
+        if filtered_truth is not None:
+            filtered, latency["filtered"] = _timed_pass(texts, top_k, catalog.query_filter)
+        query_cache, result_cache = get_query_embedding_cache().stats(), get_search_result_cache().stats()
+
+    stats = index.stats()
+    return {
+        "config": name,
+        "build_seconds": round(build_seconds, 3),
+        "index_mb": round(stats["resident_bytes"] / 2 ** 20, 2),
+        "index": stats,
+        "latency_ms": latency,
+        "recall_at_k": _recall(found, truth, catalog),
+        "filtered_recall_at_k": _recall(filtered, filtered_truth, catalog) if filtered is not None else None,
+        "query_cache": query_cache,
+        "result_cache": result_cache,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_cosine_matrix(catalog: SyntheticCatalog, Q: np.ndarray, truth: np.ndarray, top_k: int) -> dict:
+    """The unindexed path: normalize the raw matrix and score it on every query."""
+    found, latencies = [], []
+    for q in Q:
+        start = time.perf_counter()
+        scores = _cosine_sim_matrix(catalog.matrix, q)
+        idxs = top_k_indices(scores, top_k)
+        latencies.append(time.perf_counter() - start)
+        found.append([catalog.pk(int(i)) for i in idxs])
+    return {
+        "config": "cosine_matrix",
+        "build_seconds": 0.0,
+        "index_mb": round(catalog.matrix.nbytes / 2 ** 20, 2),
+        "latency_ms": {"search": latency_summary(latencies)},
+        "recall_at_k": _recall(found, truth, catalog),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_benchmark(db, size: int, dim: int = 384, configs: Optional[List[str]] = None, n_queries: int = 200,
+                  top_k: int = 10, seed: int = 0, index_kwargs: Optional[dict] = None) -> dict:
+    """Backfill a synthetic catalog of ``size`` products into ``db`` and benchmark each config.
+
+    The backfill goes through the production batching, concurrency and bulk
+    write path, and queries through ``semantic_search`` and its caches, with
+    the stub embedder in place of OpenRouter.
+    """
+    configs = configs or list(BENCH_CONFIGS) + ["cosine_matrix"]
+    coll = db["product_embeddings"]
+    coll.drop()
+
+    start = time.perf_counter()
+    catalog = SyntheticCatalog(size, dim, seed=seed)
+    generate_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    saved = _embed_and_store(coll, catalog.missing(), model="bench-stub", embed=catalog.embed)
+    backfill_seconds = time.perf_counter() - start
+    rag_logger.info(f"Benchmark backfill: {saved}/{size} embeddings in {backfill_seconds:.1f}s")
+
+    Q = catalog.queries(n_queries)
+    truth = exact_top_k(catalog.matrix, Q, top_k)
+    truth_filtered = filtered_top_k(catalog, Q, top_k)
+    results = []
+    for name in configs:
+        if name == "cosine_matrix":
+            results.append(bench_cosine_matrix(catalog, Q, truth, top_k))
+        else:
+            results.append(bench_index(coll, catalog, name, Q, truth, top_k, truth_filtered, **(index_kwargs or {})))
+    return {
+        "catalog_size": size,
+        "dim": dim,
+        "queries": int(Q.shape[0]),
+        "top_k": top_k,
+        "generate_seconds": round(generate_seconds, 3),
+        "backfill_seconds": round(backfill_seconds, 3),
+        "backfill_per_second": round(saved / backfill_seconds, 1) if backfill_seconds else None,
+        "backfill_saved": saved,
+        "results": results,
+    }
@@ -0,0 +1,361 @@
+import copy
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from .vector_index import decode_embedding, encode_embedding
+
+rag_logger = logging.getLogger('rag_debug')
+
+_MISSING = object()
+
+
+def normalize_query(text: str) -> str:
+    """Case- and whitespace-insensitive form of a search query."""
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+
+class LRUCache:
+    """Thread-safe LRU cache with optional TTL and byte budget.
+
+    ``sizeof`` estimates the byte size of a value; when ``max_bytes`` is set,
+    least recently used entries are evicted until the total fits.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None, sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[1] is not None and entry[1] < time.monotonic():
+                self._remove(key)
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value) -> None:
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def pop(self, key) -> None:
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _remove(self, key) -> None:
+        self._bytes -= self._data.pop(key)[2]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class QueryEmbeddingCache:
+    """Two-tier cache of query embeddings keyed by normalized query and model.
+
+    Tier 1 is a per-process LRU bounded by ``max_entries`` and ``max_bytes``
+    (a vector takes dim * 4 bytes, 6 KB at 1536 dims); tier 2 is a Mongo
+    collection with a TTL index shared by every worker. Mongo errors degrade
+    to a miss, never to a failure.
+    """
+
+    def __init__(self, get_collection: Callable, max_entries: int = 2048, ttl: float = 7 * 24 * 3600,
+                 max_bytes: Optional[int] = 16 * 2 ** 20):
+        self.ttl = ttl
+        self._get_collection = get_collection
+        self._memory = LRUCache(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes, sizeof=lambda vec: vec.nbytes)
+        self._ttl_index_ready = False
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    @staticmethod
+    def key(query: str, model: str) -> str:
+        return hashlib.sha1(f"{model}\n{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def _collection(self):
+        coll = self._get_collection()
+        if not self._ttl_index_ready:
+            try:
+                coll.create_index("created_at", expireAfterSeconds=int(self.ttl))
+            except Exception as e:
+                rag_logger.warning(f"Could not create TTL index on {coll.name}: {e}")
+            self._ttl_index_ready = True
+        return coll
+
+    def get(self, query: str, model: str) -> Optional[np.ndarray]:
+        key = self.key(query, model)
+        vec = self._memory.get(key)
+        if vec is not None:
+            return vec
+
+        try:
+            # Mongo's TTL monitor only runs once a minute, so check expiry here too
+            doc = self._collection().find_one(
+                {"_id": key, "created_at": {"$gt": datetime.utcnow() - timedelta(seconds=self.ttl)}}
+            )
+        except Exception as e:
+            rag_logger.warning(f"Query embedding cache lookup failed: {e}")
+            doc = None
+        if doc is None:
+            self.shared_misses += 1
+            return None
+
+        self.shared_hits += 1
+        vec = decode_embedding(doc)
+        self._memory.set(key, vec)
+        return vec
+
+    def set(self, query: str, model: str, vec) -> None:
+        key = self.key(query, model)
+        vec = np.asarray(vec, dtype=np.float32)
+        self._memory.set(key, vec)
+        try:
+            self._collection().replace_one(
+                {"_id": key},
+                {"_id": key, **encode_embedding(vec), "model": model, "created_at": datetime.utcnow()},
+                upsert=True,
+            )
+        except Exception as e:
+            rag_logger.warning(f"Query embedding cache write failed: {e}")
+
+    def stats(self) -> dict:
+        memory = self._memory.stats()
+        lookups = memory["hits"] + memory["misses"]
+        hits = memory["hits"] + self.shared_hits
+        return {
+            "memory": memory,
+            "shared_hits": self.shared_hits,
+            "shared_misses": self.shared_misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _json_size(value) -> int:
+    return len(json.dumps(value, default=str))
+
+
+class SearchResultCache:
+    """Per-process cache of ranked search results.
+
+    Keys combine the search kind, normalized query, filters, top_k and the
+    embedding index version, so entries computed against an older index are
+    never served. Values hold the ranked pks and, optionally, the serialized
+    response. Bounded by entry count and approximate JSON bytes.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 32 * 2 ** 20, ttl: Optional[float] = 300.0):
+        self._memory = LRUCache(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes, sizeof=_json_size)
+        self.invalidations = 0
+
+    @staticmethod
+    def key(kind: str, query: str, top_k: int, filters: Optional[dict], version: int) -> str:
+        filters = sorted((k, v) for k, v in (filters or {}).items() if v not in (None, "", []))
+        raw = json.dumps([kind, normalize_query(query), top_k, filters, version], default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._memory.get(key)
+
+    def set(self, key: str, pks: list, payload: Any = None) -> None:
+        self._memory.set(key, {"pks": list(pks), "payload": payload})
+
+    def invalidate(self) -> None:
+        self._memory.clear()
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {**self._memory.stats(), "invalidations": self.invalidations}
+
+
+def price_key(price) -> Optional[str]:
+    """Comparable form of a product price (Decimal, float or string)."""
+    try:
+        return f"{float(str(price)):.2f}"
+    except (ValueError, TypeError):
+        return None
+
+
+class SemanticResponseCache:
+    """Per-process cache of recommendation replies looked up by query similarity.
+
+    A lookup returns the entry whose query embedding is most cosine-similar
+    to the new one, provided the similarity reaches ``threshold``, so
+    paraphrased openers share one LLM answer. Each entry remembers the price
+    of the products it recommends and is dropped when one of them changes
+    price or is deleted. Bounded by entry count (LRU) and TTL.
+    """
+
+    def __init__(self, max_entries: int = 512, threshold: float = 0.92, ttl: Optional[float] = 3600.0):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._next_id = 0
+        # Stacked query vectors of _entries (in _ids order), rebuilt lazily
+        self._matrix: Optional[np.ndarray] = None
+        self._ids: list = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _normalize(vec) -> Optional[np.ndarray]:
+        vec = np.asarray(vec, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else None
+
+    def get(self, vec, is_fresh: Optional[Callable[[dict], bool]] = None) -> Optional[dict]:
+        """Copy of the cached reply for the most similar query, or None.
+
+        ``is_fresh(prices)`` may veto a hit, e.g. after a price change made by
+        another process; the entry is then dropped and the lookup is a miss.
+        """
+        q = self._normalize(vec)
+        with self._lock:
+            entry_id, similarity = self._nearest(q) if q is not None else (None, 0.0)
+            entry = self._entries.get(entry_id)
+        if entry is not None and is_fresh is not None and not is_fresh(entry["prices"]):
+            self._discard([entry_id])
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry_id in self._entries:
+                self._entries.move_to_end(entry_id)
+            self.hits += 1
+        rag_logger.info(f"Response cache hit (similarity {similarity:.3f}): '{entry['query']}'")
+        return copy.deepcopy(entry["result"])
+
+    def _nearest(self, q: np.ndarray):
+        now = time.monotonic()
+        expired = [i for i, e in self._entries.items() if e["expires_at"] is not None and e["expires_at"] < now]
+        for entry_id in expired:
+            del self._entries[entry_id]
+        if expired:
+            self._matrix = None
+        if not self._entries:
+            return None, 0.0
+        if self._matrix is None or self._matrix.shape[1] != q.shape[0]:
+            self._ids = [i for i, e in self._entries.items() if e["vec"].shape == q.shape]
+            if not self._ids:
+                return None, 0.0
+            self._matrix = np.stack([self._entries[i]["vec"] for i in self._ids])
+        sims = self._matrix @ q
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None, float(sims[best])
+        return self._ids[best], float(sims[best])
+
+    def set(self, vec, query: str, result: dict, prices: dict) -> None:
+        """Cache ``result`` for ``query``; ``prices`` maps each recommended pk to its price_key."""
+        q = self._normalize(vec)
+        if q is None:
+            return
+        with self._lock:
+            self._entries[self._next_id] = {
+                "vec": q,
+                "query": query,
+                "result": copy.deepcopy(result),
+                "prices": dict(prices),
+                "expires_at": time.monotonic() + self.ttl if self.ttl else None,
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def invalidate_product(self, pk: str, price=_MISSING) -> int:
+        """Drop entries recommending ``pk``: all of them when it was deleted
+        (no ``price``), otherwise those that cached a different price.
+        """
+        new_price = None if price is _MISSING else price_key(price)
+        with self._lock:
+            stale = [
+                entry_id for entry_id, e in self._entries.items()
+                if pk in e["prices"] and (price is _MISSING or e["prices"][pk] != new_price)
+            ]
+        return self._discard(stale)
+
+    def _discard(self, entry_ids) -> int:
+        with self._lock:
+            removed = 0
+            for entry_id in entry_ids:
+                if self._entries.pop(entry_id, None) is not None:
+                    removed += 1
+            if removed:
+                self.invalidations += removed
+                self._matrix = None
+            return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
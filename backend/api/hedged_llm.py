@@ -0,0 +1,262 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, List, Optional, Tuple
+
+import httpx
+from django.conf import settings
+
+from .key_pool import KeyPool, KeyPoolExhausted, KeyState, _mask, _retry_after_seconds, get_key_pool
+
+rag_logger = logging.getLogger('rag_debug')
+
+
+class InvalidReply(ValueError):
+    """Raised by a ``validate`` callback for a reply that arrived but is unusable.
+
+    The key answered, so it is not penalised and no failover is launched;
+    ``complete`` returns ``value`` unless another attempt wins first.
+    """
+
+    def __init__(self, message: str, value: Any = None):
+        super().__init__(message)
+        self.value = value
+
+
+class HedgeBudget:
+    """Token bucket that caps hedged requests at ``ratio`` of primary requests.
+
+    Every primary request earns ``ratio`` tokens (up to ``burst``); a hedge
+    spends one. With ratio 0.1 hedging adds at most ~10% upstream calls.
+    """
+
+    def __init__(self, ratio: float = 0.1, burst: float = 3.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.requests = 0
+        self.hedges = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def on_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.tokens < 1.0:
+                self.denied += 1
+                return False
+            self.tokens -= 1.0
+            self.hedges += 1
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "denied": self.denied,
+                "tokens": round(self.tokens, 2),
+            }
+
+
+class HedgedChatClient:
+    """Chat completions raced across keys and models on an asyncio loop.
+
+    The first attempt goes to the healthiest key. If it has not answered
+    after the hedge delay (fixed, or the observed p95 latency), a second
+    attempt goes to the next key, or to a fallback model once keys run out,
+    as long as the hedge budget allows. An attempt that fails in transport or
+    with an HTTP error is replaced at once, at most ``max_failovers`` times.
+    The first answer that ``validate`` accepts wins and the rest are
+    cancelled; a reply it rejects with ``InvalidReply`` ends the race too.
+    All attempts share one overall deadline.
+
+    The loop runs in a daemon thread and owns a keep-alive ``httpx.AsyncClient``;
+    ``complete`` is the blocking entry point for request handlers.
+    """
+
+    def __init__(self, pool: KeyPool, fallback_models: Optional[List[str]] = None, hedge_delay: float = 0.0,
+                 budget: Optional[HedgeBudget] = None, timeout: float = 30.0, initial_delay: float = 3.0,
+                 latency_window: int = 200, min_samples: int = 20, max_failovers: int = 2):
+        self.pool = pool
+        self.fallback_models = fallback_models or []
+        self.fixed_delay = hedge_delay
+        self.budget = budget or HedgeBudget()
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.max_failovers = max_failovers
+        self._latencies = deque(maxlen=latency_window)
+        self.wins = {"primary": 0, "hedge": 0, "failover": 0}
+        self.invalid_replies = 0
+        self._loop = asyncio.new_event_loop()
+        self._http: Optional[httpx.AsyncClient] = None
+        self._thread = threading.Thread(target=self._loop.run_forever, name="hedged-llm", daemon=True)
+        self._thread.start()
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for an attempt before hedging it."""
+        if self.fixed_delay > 0:
+            return self.fixed_delay
+        if len(self._latencies) < self.min_samples:
+            return self.initial_delay
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def stats(self) -> dict:
+        return {"hedge_delay_s": round(self.hedge_delay(), 3), "wins": dict(self.wins),
+                "invalid_replies": self.invalid_replies, **self.budget.stats()}
+
+    def complete(self, payload: dict, validate: Callable[[dict], Any]) -> Any:
+        """Run a hedged chat completion and return ``validate(response_json)`` of the winner.
+
+        When the first reply is rejected with ``InvalidReply``, its ``value`` is
+        returned instead. Raises KeyPoolExhausted when no attempt produced a
+        reply in time.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._complete(payload, validate), self._loop)
+        try:
+            return future.result(timeout=self.timeout + 5)
+        except concurrent.futures.TimeoutError:
+            # Cancelling the future cancels the coroutine and its attempts on the loop
+            future.cancel()
+            raise KeyPoolExhausted(f"Hedged chat completion did not finish within {self.timeout + 5:.0f}s")
+
+    def _plan(self, model: str) -> List[Tuple[KeyState, str]]:
+        keys = self.pool.ordered()
+        models = [model] + [m for m in self.fallback_models if m != model]
+        return [(state, m) for m in models for state in keys]
+
+    async def _complete(self, payload: dict, validate: Callable[[dict], Any]) -> Any:
+        if self._http is None:
+            self._http = httpx.AsyncClient()
+        plan = self._plan(payload["model"])
+        if not plan:
+            raise KeyPoolExhausted(f"All {len(self.pool)} API keys are disabled")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        self.budget.on_request()
+        roles = {}
+        errors = []
+        hedging = True
+        failovers = 0
+
+        def launch(role: str) -> asyncio.Task:
+            state, model = plan[len(roles)]
+            task = asyncio.ensure_future(self._attempt(state, {**payload, "model": model}, validate, deadline))
+            roles[task] = role
+            rag_logger.debug(f"LLM {role} attempt {len(roles)}: key {_mask(state.key)}, model {model}")
+            return task
+
+        pending = {launch("primary")}
+        try:
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    errors.append("deadline exceeded")
+                    break
+                can_hedge = hedging and len(roles) < len(plan)
+                done, pending = await asyncio.wait(
+                    pending, timeout=min(remaining, self.hedge_delay()) if can_hedge else remaining,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    if can_hedge and self.budget.try_spend():
+                        pending.add(launch("hedge"))
+                    else:
+                        hedging = False
+                    continue
+                failed = 0
+                for task in done:
+                    status, value = task.result()
+                    if status == "ok":
+                        self.wins[roles[task]] += 1
+                        return value
+                    if status == "invalid":
+                        self.invalid_replies += 1
+                        return value
+                    errors.append(value)
+                    failed += 1
+                for _ in range(failed):
+                    if len(roles) >= len(plan) or failovers >= self.max_failovers:
+                        break
+                    failovers += 1
+                    pending.add(launch("failover"))
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        raise KeyPoolExhausted(f"No valid answer from {len(roles)} attempts: {'; '.join(errors)}")
+
+    async def _attempt(self, state: KeyState, payload: dict, validate: Callable[[dict], Any],
+                       deadline: float) -> Tuple[str, Any]:
+        """("ok", validated result), ("invalid", InvalidReply value) or ("error", message).
+
+        Only transport errors, HTTP errors and malformed bodies count against
+        the key; cancelled attempts are not scored.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        try:
+            resp = await self._http.post(
+                f"{self.pool.base_url}/chat/completions", headers=self.pool.headers(state), json=payload,
+                timeout=max(0.1, deadline - loop.time()),
+            )
+        except httpx.HTTPError as e:
+            self.pool.record_failure(state, f"{type(e).__name__}: {e}", latency=time.monotonic() - start)
+            return "error", f"{_mask(state.key)}: {type(e).__name__}"
+        latency = time.monotonic() - start
+
+        if resp.status_code != 200:
+            self.pool.record_failure(
+                state, f"HTTP {resp.status_code}: {resp.text[:200]}", status=resp.status_code,
+                retry_after=_retry_after_seconds(resp.headers.get("Retry-After")), latency=latency,
+            )
+            return "error", f"{_mask(state.key)}: HTTP {resp.status_code}"
+        try:
+            result = validate(resp.json())
+        except InvalidReply as e:
+            rag_logger.debug(f"LLM reply from key {_mask(state.key)} rejected: {e}")
+            self.pool.record_success(state, latency)
+            self._latencies.append(latency)
+            return "invalid", e.value
+        except Exception as e:
+            self.pool.record_failure(state, f"Unusable response: {e}", latency=latency)
+            return "error", f"{_mask(state.key)}: {e}"
+        self.pool.record_success(state, latency)
+        self._latencies.append(latency)
+        return "ok", result
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_hedged_client() -> HedgedChatClient:
+    """Process-wide hedged client; its loop thread does not survive fork, so children build their own."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                fallback_models = getattr(settings, 'OPENROUTER_HEDGE_MODELS', '')
+                _client = HedgedChatClient(
+                    get_key_pool(),
+                    fallback_models=[m.strip() for m in fallback_models.split(',') if m.strip()],
+                    hedge_delay=getattr(settings, 'OPENROUTER_HEDGE_DELAY_SECONDS', 0.0),
+                    budget=HedgeBudget(ratio=getattr(settings, 'OPENROUTER_HEDGE_BUDGET', 0.1)),
+                    max_failovers=getattr(settings, 'OPENROUTER_HEDGE_MAX_FAILOVERS', 2),
+                )
+                _client_pid = pid
+    return _client
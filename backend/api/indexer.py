@@ -0,0 +1,286 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from django.conf import settings
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from .models import Product
+from .rag import (
+    _embeddings_for_writes,
+    _get_mongo_db,
+    backfill_checkpoint,
+    ensure_embeddings_for_all_products,
+    ensure_embeddings_for_products,
+    get_embedding_index,
+)
+
+rag_logger = logging.getLogger('rag_debug')
+
+# Work queue of pending embedding changes, one document per product pk
+JOBS_COLLECTION = "embedding_jobs"
+# Queue entry that triggers a full missing/stale scan of the catalog
+RECONCILE_JOB = "__reconcile__"
+# Jobs are parked as failed after this many attempts
+MAX_ATTEMPTS = 5
+# Running jobs whose worker has not finished within this window are requeued
+STALE_CLAIM_AFTER = timedelta(minutes=10)
+# Single document naming the process allowed to run the indexer loop
+LEASE_COLLECTION = "embedding_indexer_lease"
+
+
+def enqueue(pk: str, op: str = "upsert") -> None:
+    """Queue an embedding change for ``pk``; ``op`` is upsert, delete or reconcile.
+
+    Jobs are keyed by pk, so repeated saves of a product collapse into one job.
+    Re-enqueueing starts the attempt count over, also for a job parked as failed.
+    """
+    jobs = _get_mongo_db()[JOBS_COLLECTION]
+    jobs.update_one(
+        {"_id": pk},
+        {"$set": {"op": op, "status": "pending", "claim": None, "attempts": 0, "enqueued_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+def enqueue_reconcile() -> None:
+    enqueue(RECONCILE_JOB, "reconcile")
+
+
+def acquire_lease(owner: str, ttl: float) -> bool:
+    """Take or renew the indexer lease for ``owner``; False while another process holds it."""
+    now = datetime.utcnow()
+    try:
+        doc = _get_mongo_db()[LEASE_COLLECTION].find_one_and_update(
+            {"_id": "indexer", "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # The lease exists, is held by someone else and has not expired
+        return False
+    return doc is not None and doc.get("owner") == owner
+
+
+def release_lease(owner: str) -> None:
+    _get_mongo_db()[LEASE_COLLECTION].delete_one({"_id": "indexer", "owner": owner})
+
+
+class LeaseLost(RuntimeError):
+    """Another process took the indexer lease while a batch was running."""
+
+
+class ClaimHeartbeat(threading.Thread):
+    """Keeps a claimed batch alive while it runs.
+
+    Every ``interval`` seconds it refreshes ``locked_at`` on the claimed jobs,
+    so ``requeue_stale_jobs`` leaves a long reconcile alone, and renews the
+    indexer lease when ``owner`` is set. ``check`` is the heartbeat callback
+    handed to the embedding backfill; it raises LeaseLost once renewal failed.
+    """
+
+    def __init__(self, token: str, owner: Optional[str] = None, lease_ttl: float = 30.0):
+        super().__init__(name="embedding-indexer-heartbeat", daemon=True)
+        self.token = token
+        self.owner = owner
+        self.lease_ttl = lease_ttl
+        self.interval = max(1.0, lease_ttl / 3)
+        self.lost = threading.Event()
+        self._stop_event = threading.Event()
+
+    def __enter__(self) -> "ClaimHeartbeat":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def beat(self) -> None:
+        try:
+            _get_mongo_db()[JOBS_COLLECTION].update_many(
+                {"claim": self.token}, {"$set": {"locked_at": datetime.utcnow()}}
+            )
+            if self.owner and not acquire_lease(self.owner, self.lease_ttl):
+                rag_logger.warning(f"Embedding indexer {self.owner} lost its lease mid-batch")
+                self.lost.set()
+        except Exception as e:
+            rag_logger.warning(f"Indexer heartbeat failed: {e}")
+
+    def check(self) -> None:
+        if self.lost.is_set():
+            raise LeaseLost(f"Indexer lease of {self.owner} was taken over")
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval) and not self.lost.is_set():
+            self.beat()
+
+
+def requeue_stale_jobs() -> int:
+    """Return jobs claimed by a worker that died mid-batch to the queue."""
+    jobs = _get_mongo_db()[JOBS_COLLECTION]
+    result = jobs.update_many(
+        {"status": "running", "locked_at": {"$lt": datetime.utcnow() - STALE_CLAIM_AFTER}},
+        {"$set": {"status": "pending", "claim": None}},
+    )
+    if result.modified_count:
+        rag_logger.warning(f"Requeued {result.modified_count} stale embedding jobs")
+    return result.modified_count
+
+
+def process_pending(batch_size: int = 32, lease_owner: Optional[str] = None, lease_ttl: float = 30.0) -> int:
+    """Claim up to ``batch_size`` pending jobs and apply them. Returns jobs handled.
+
+    While they run, a heartbeat keeps the claim fresh and renews the lease of
+    ``lease_owner``; if the lease is lost the work stops and the jobs go
+    back to the queue without counting an attempt.
+    """
+    jobs = _get_mongo_db()[JOBS_COLLECTION]
+    ids = [
+        doc["_id"]
+        for doc in jobs.find({"status": "pending"}, {"_id": 1}).sort("enqueued_at", 1).limit(batch_size)
+    ]
+    if not ids:
+        return 0
+
+    # Claim with a token so concurrent workers never process the same job
+    token = uuid.uuid4().hex
+    jobs.update_many(
+        {"_id": {"$in": ids}, "status": "pending"},
+        {"$set": {"status": "running", "claim": token, "locked_at": datetime.utcnow()}},
+    )
+    claimed = {doc["_id"]: doc["op"] for doc in jobs.find({"claim": token}, {"_id": 1, "op": 1})}
+    if not claimed:
+        return 0
+
+    try:
+        with ClaimHeartbeat(token, lease_owner, lease_ttl) as heartbeat:
+            if RECONCILE_JOB in claimed:
+                created = ensure_embeddings_for_all_products(heartbeat=heartbeat.check)
+                rag_logger.info(f"Indexer reconcile finished: {created} embeddings created")
+
+            heartbeat.check()
+            deletes = [pk for pk, op in claimed.items() if op == "delete"]
+            if deletes:
+                _embeddings_for_writes(_get_mongo_db()["product_embeddings"]).delete_many({"_id": {"$in": deletes}})
+
+            upserts = [pk for pk, op in claimed.items() if op == "upsert"]
+            if upserts:
+                ensure_embeddings_for_products(upserts, heartbeat=heartbeat.check)
+
+        # A job re-enqueued while we worked has had its claim reset and survives this
+        jobs.delete_many({"claim": token})
+    except LeaseLost as e:
+        rag_logger.warning(f"Returning {len(claimed)} jobs to the queue: {e}")
+        jobs.update_many({"claim": token}, {"$set": {"status": "pending", "claim": None}})
+        return 0
+    except Exception as e:
+        rag_logger.error(f"Indexer batch failed, requeueing {len(claimed)} jobs: {e}")
+        jobs.update_many(
+            {"claim": token},
+            {"$set": {"status": "pending", "claim": None, "last_error": str(e)}, "$inc": {"attempts": 1}},
+        )
+        jobs.update_many(
+            {"status": "pending", "attempts": {"$gte": MAX_ATTEMPTS}},
+            {"$set": {"status": "failed"}},
+        )
+        return 0
+
+    return len(claimed)
+
+
+def indexing_progress() -> dict:
+    """Queue depth and coverage figures for the admin endpoint."""
+    db = _get_mongo_db()
+    jobs = db[JOBS_COLLECTION]
+    index = get_embedding_index()
+    return {
+        "pending": jobs.count_documents({"status": "pending"}),
+        "running": jobs.count_documents({"status": "running"}),
+        "failed": jobs.count_documents({"status": "failed"}),
+        "products": Product.objects.count(),
+        "embeddings": db["product_embeddings"].estimated_document_count(),
+        "index_rows": len(index),
+        "index_version": index.version,
+        "backfill": {k: v for k, v in backfill_checkpoint().items() if k != "_id"},
+    }
+
+
+class IndexerWorker(threading.Thread):
+    """Drains the embedding job queue and periodically reconciles the whole catalog.
+
+    Every server process may start one, but only the holder of a Mongo lease
+    (renewed each iteration and by the heartbeat of a running batch, expiring
+    after ``lease_ttl`` seconds) polls the queue; the others stand by and
+    check the lease every half TTL, taking over when its holder dies.
+    """
+
+    def __init__(self, poll_interval: float = 2.0, reconcile_interval: float = 3600.0, batch_size: int = 32,
+                 lease_ttl: float = 30.0):
+        super().__init__(name="embedding-indexer", daemon=True)
+        self.poll_interval = poll_interval
+        self.reconcile_interval = reconcile_interval
+        self.batch_size = batch_size
+        self.lease_ttl = lease_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        rag_logger.info(f"Embedding indexer started (poll={self.poll_interval}s, reconcile={self.reconcile_interval}s)")
+        next_reconcile = 0.0
+        leader = False
+        while not self._stop_event.is_set():
+            processed = 0
+            try:
+                if not acquire_lease(self.owner, self.lease_ttl):
+                    if leader:
+                        rag_logger.warning(f"Embedding indexer {self.owner} lost its lease, standing by")
+                    leader = False
+                    self._stop_event.wait(self.lease_ttl / 2)
+                    continue
+                if not leader:
+                    rag_logger.info(f"Embedding indexer {self.owner} holds the lease")
+                    leader = True
+                if time.monotonic() >= next_reconcile:
+                    enqueue_reconcile()
+                    next_reconcile = time.monotonic() + self.reconcile_interval
+                requeue_stale_jobs()
+                processed = process_pending(self.batch_size, lease_owner=self.owner, lease_ttl=self.lease_ttl)
+            except Exception as e:
+                rag_logger.error(f"Embedding indexer iteration failed: {e}")
+            if not processed:
+                self._stop_event.wait(self.poll_interval)
+        if leader:
+            try:
+                release_lease(self.owner)
+            except Exception as e:
+                rag_logger.warning(f"Could not release the indexer lease: {e}")
+        rag_logger.info("Embedding indexer stopped")
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_background_indexer() -> IndexerWorker:
+    """Start the in-process indexer thread once per process."""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = IndexerWorker(
+                poll_interval=getattr(settings, 'RAG_INDEXER_POLL_SECONDS', 2.0),
+                reconcile_interval=getattr(settings, 'RAG_INDEXER_RECONCILE_SECONDS', 3600.0),
+                lease_ttl=getattr(settings, 'RAG_INDEXER_LEASE_SECONDS', 30.0),
+            )
+            _worker.start()
+    return _worker
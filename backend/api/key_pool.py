@@ -0,0 +1,261 @@
+import logging
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, List, Optional
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+rag_logger = logging.getLogger('rag_debug')
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+
+class KeyPoolExhausted(RuntimeError):
+    """No API key produced a usable response."""
+
+
+def _mask(key: str) -> str:
+    return f"{key[:8]}...{key[-4:]}" if len(key) > 12 else "[INVALID_KEY]"
+
+
+def _retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class KeyState:
+    """Health of one API key plus its keep-alive HTTP session."""
+
+    def __init__(self, key: str, pool_size: int):
+        self.key = key
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency_ewma: Optional[float] = None
+        self.cooldown_until = 0.0
+        self.disabled = False
+        self.last_error: Optional[str] = None
+
+    @property
+    def success_rate(self) -> float:
+        # Laplace smoothing so an untried key starts at 0.5 rather than 0 or 1
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    def score(self, default_latency: float) -> float:
+        """Higher is better: likely to succeed, and quickly."""
+        return self.success_rate / (self.latency_ewma or default_latency)
+
+    def available(self, now: float) -> bool:
+        return not self.disabled and now >= self.cooldown_until
+
+    def stats(self, now: float) -> dict:
+        return {
+            "key": _mask(self.key),
+            "successes": self.successes,
+            "failures": self.failures,
+            "success_rate": round(self.success_rate, 4),
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+            "cooldown_seconds": round(max(0.0, self.cooldown_until - now), 1),
+            "disabled": self.disabled,
+            "last_error": self.last_error,
+        }
+
+
+class KeyPool:
+    """Schedules OpenRouter requests over several API keys by health.
+
+    Keys are tried best first, ranked by smoothed success rate over latency
+    EWMA. A 429 puts a key in cooldown for its ``Retry-After`` period, a 401
+    disables it for the life of the process, and other failures back off
+    exponentially with consecutive errors; when every key is cooling down, the
+    one due back first is probed rather than failing outright. Each key keeps
+    its own pooled ``requests.Session`` so keep-alive connections are reused
+    across calls.
+    """
+
+    def __init__(self, keys: List[str], base_url: str = OPENROUTER_BASE_URL, ewma_alpha: float = 0.3,
+                 default_cooldown: float = 30.0, max_backoff: float = 300.0, pool_size: int = 10):
+        self.base_url = base_url
+        self.ewma_alpha = ewma_alpha
+        self.default_cooldown = default_cooldown
+        self.max_backoff = max_backoff
+        self._states = [KeyState(key, pool_size) for key in keys]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    @property
+    def keys(self) -> List[str]:
+        return [s.key for s in self._states]
+
+    def ordered(self) -> List[KeyState]:
+        """Usable keys, healthiest first; keys cooling down or disabled are left out.
+
+        When every enabled key is cooling down, the one due back first is
+        returned as a probe, so a single transient failure cannot block all
+        calls for the whole backoff. Only keys disabled by a 401 are never tried.
+        """
+        now = time.monotonic()
+        with self._lock:
+            latencies = [s.latency_ewma for s in self._states if s.latency_ewma is not None]
+            default_latency = sum(latencies) / len(latencies) if latencies else 1.0
+            usable = [s for s in self._states if s.available(now)]
+            if not usable:
+                enabled = [s for s in self._states if not s.disabled]
+                return [min(enabled, key=lambda s: s.cooldown_until)] if enabled else []
+            return sorted(usable, key=lambda s: -s.score(default_latency))
+
+    def has_available(self) -> bool:
+        """Whether some key is usable now, without falling back to a probe."""
+        now = time.monotonic()
+        with self._lock:
+            return any(s.available(now) for s in self._states)
+
+    def record_success(self, state: KeyState, latency: float) -> None:
+        with self._lock:
+            state.successes += 1
+            state.consecutive_failures = 0
+            state.last_error = None
+            self._observe_latency(state, latency)
+
+    def record_failure(self, state: KeyState, error: str, status: Optional[int] = None,
+                       retry_after: Optional[float] = None, latency: Optional[float] = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            state.failures += 1
+            state.consecutive_failures += 1
+            state.last_error = error
+            if latency is not None:
+                self._observe_latency(state, latency)
+            if status == 401:
+                state.disabled = True
+                rag_logger.error(f"Disabling API key {_mask(state.key)}: authentication failed")
+            elif status == 429:
+                state.cooldown_until = now + (retry_after if retry_after is not None else self.default_cooldown)
+            else:
+                backoff = min(self.max_backoff, 2.0 ** (state.consecutive_failures - 1))
+                state.cooldown_until = now + backoff
+
+    def _observe_latency(self, state: KeyState, latency: float) -> None:
+        if state.latency_ewma is None:
+            state.latency_ewma = latency
+        else:
+            state.latency_ewma = self.ewma_alpha * latency + (1 - self.ewma_alpha) * state.latency_ewma
+
+    @staticmethod
+    def headers(state: KeyState, extra: Optional[dict] = None) -> dict:
+        return {
+            "Authorization": f"Bearer {state.key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "http://localhost",
+            "X-Title": "SellerAgent E-commerce",
+            **(extra or {}),
+        }
+
+    def post(self, path: str, payload: dict, timeout: float, parse: Callable[[requests.Response], Any] = None,
+             headers: Optional[dict] = None, **kwargs):
+        """POST ``payload`` using the healthiest key, failing over to the next ones.
+
+        ``parse`` turns a 200 response into the result; if it raises, the
+        response counts as a failure of that key. Returns the parsed result
+        (or the response). Raises KeyPoolExhausted when every usable key failed.
+        """
+        candidates = self.ordered()
+        if not candidates:
+            raise KeyPoolExhausted(f"All {len(self._states)} API keys are disabled")
+
+        errors = []
+        for state in candidates:
+            request_headers = self.headers(state, headers)
+            start = time.monotonic()
+            try:
+                resp = state.session.post(f"{self.base_url}{path}", headers=request_headers, json=payload,
+                                          timeout=timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self.record_failure(state, f"{type(e).__name__}: {e}", latency=time.monotonic() - start)
+                errors.append(f"{_mask(state.key)}: {e}")
+                continue
+            latency = time.monotonic() - start
+
+            if resp.status_code != 200:
+                self.record_failure(
+                    state, f"HTTP {resp.status_code}: {resp.text[:200]}", status=resp.status_code,
+                    retry_after=_retry_after_seconds(resp.headers.get("Retry-After")), latency=latency,
+                )
+                errors.append(f"{_mask(state.key)}: HTTP {resp.status_code}")
+                rag_logger.warning(f"OpenRouter {path} failed with key {_mask(state.key)}: HTTP {resp.status_code}")
+                continue
+
+            try:
+                result = parse(resp) if parse else resp
+            except Exception as e:
+                self.record_failure(state, f"Unusable response: {e}", latency=latency)
+                errors.append(f"{_mask(state.key)}: {e}")
+                continue
+            self.record_success(state, latency)
+            return result
+
+        raise KeyPoolExhausted(f"All {len(candidates)} usable API keys failed: {'; '.join(errors)}")
+
+    def stats(self) -> List[dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [s.stats(now) for s in self._states]
+
+
+def configured_api_keys() -> List[str]:
+    """OPENROUTER_API_KEY followed by OPENROUTER_API_KEY_1 .. _10, without duplicates."""
+    keys = []
+    main_key = getattr(settings, 'OPENROUTER_API_KEY', None)
+    if main_key:
+        keys.append(main_key)
+    for i in range(1, 11):
+        key = getattr(settings, f'OPENROUTER_API_KEY_{i}', None)
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_key_pool() -> KeyPool:
+    """Process-wide key pool shared by embedding and chat requests.
+
+    Sessions hold sockets, so a forked child builds its own pool.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                keys = configured_api_keys()
+                rag_logger.info(f"Creating API key pool for pid {pid} with {len(keys)} keys")
+                _pool = KeyPool(
+                    keys,
+                    base_url=getattr(settings, 'OPENROUTER_BASE_URL', OPENROUTER_BASE_URL),
+                    default_cooldown=getattr(settings, 'OPENROUTER_KEY_COOLDOWN_SECONDS', 30.0),
+                    pool_size=getattr(settings, 'OPENROUTER_HTTP_POOL_SIZE', 10),
+                )
+                _pool_pid = pid
+    return _pool
@@ -0,0 +1,164 @@
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .ann import top_k_indices
+from .vector_index import ProductFacets
+
+rag_logger = logging.getLogger('rag_debug')
+
+# Alphanumeric runs; "SKU-1042" yields "sku" and "1042" for both documents and queries
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+class BM25Index:
+    """In-memory inverted index over product text with Okapi BM25 scoring.
+
+    Postings map each term to {slot: term frequency}. Documents can be added,
+    replaced and removed one at a time; slots of removed documents are reused.
+    Category/price/tag filters use the same columnar facets as the vector index.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, refresh_interval: float = 300.0):
+        self.k1 = k1
+        self.b = b
+        self.refresh_interval = refresh_interval
+        self.built_at = 0.0
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._doc_terms: List[Optional[Counter]] = []
+        self._doc_len = np.zeros(0, dtype=np.float32)
+        self._pks: List[Optional[str]] = []
+        self._slots: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._total_len = 0
+        self._facets = ProductFacets()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @property
+    def is_stale(self) -> bool:
+        return not self.built_at or time.monotonic() - self.built_at > self.refresh_interval
+
+    def fit(self, pks: List[str], texts: List[str], metadata: Optional[List[dict]] = None) -> None:
+        """Rebuild the index from scratch."""
+        metadata = metadata or [{} for _ in pks]
+        with self._lock:
+            self._postings = {}
+            self._doc_terms = []
+            self._doc_len = np.zeros(0, dtype=np.float32)
+            self._pks = []
+            self._slots = {}
+            self._free = []
+            self._total_len = 0
+            self._facets = ProductFacets()
+            self._append_many(pks, texts, metadata)
+            self.built_at = time.monotonic()
+        rag_logger.info(f"Built keyword index: {len(pks)} products, {len(self._postings)} terms")
+
+    def _append_many(self, pks: List[str], texts: List[str], metadata: List[dict]) -> None:
+        base = len(self._pks)
+        lengths = []
+        for i, (pk, text) in enumerate(zip(pks, texts)):
+            terms = Counter(tokenize(text))
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[base + i] = tf
+            self._doc_terms.append(terms)
+            self._pks.append(pk)
+            self._slots[pk] = base + i
+            length = sum(terms.values())
+            lengths.append(length)
+            self._total_len += length
+        self._doc_len = np.concatenate([self._doc_len, np.asarray(lengths, dtype=np.float32)])
+        self._facets.extend(metadata)
+
+    def upsert(self, pk: str, text: str, metadata: Optional[dict] = None) -> None:
+        """Add or replace one document."""
+        with self._lock:
+            self._remove(pk)
+            if not self._free:
+                self._append_many([pk], [text], [metadata or {}])
+                return
+            slot = self._free.pop()
+            terms = Counter(tokenize(text))
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[slot] = tf
+            self._doc_terms[slot] = terms
+            self._pks[slot] = pk
+            self._slots[pk] = slot
+            self._doc_len[slot] = sum(terms.values())
+            self._total_len += int(self._doc_len[slot])
+            self._facets.set_row(slot, metadata or {})
+
+    def remove(self, pk: str) -> None:
+        with self._lock:
+            self._remove(pk)
+
+    def _remove(self, pk: str) -> None:
+        slot = self._slots.pop(pk, None)
+        if slot is None:
+            return
+        for term in self._doc_terms[slot]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(slot, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_len -= int(self._doc_len[slot])
+        self._doc_terms[slot] = None
+        self._doc_len[slot] = 0
+        self._pks[slot] = None
+        self._free.append(slot)
+
+    def scores(self, query: str, filters: Optional[dict] = None) -> np.ndarray:
+        """BM25 score of every slot for ``query``; removed and filtered slots score 0."""
+        with self._lock:
+            n_docs = len(self._slots)
+            scores = np.zeros(len(self._pks), dtype=np.float32)
+            if not n_docs:
+                return scores
+            avg_len = self._total_len / n_docs or 1.0
+            norm = self.k1 * (1.0 - self.b + self.b * self._doc_len / avg_len)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1.0 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                slots = np.fromiter(postings.keys(), dtype=np.int64, count=len(postings))
+                tf = np.fromiter(postings.values(), dtype=np.float32, count=len(postings))
+                scores[slots] += idf * tf * (self.k1 + 1.0) / (tf + norm[slots])
+            mask = self._facets.mask(**filters) if filters else None
+        if mask is not None:
+            scores[~mask] = 0.0
+        return scores
+
+    def search(self, query: str, top_k: Optional[int] = 8,
+               filters: Optional[dict] = None) -> Tuple[List[str], List[float]]:
+        """(pks, scores) of the best matches; ``top_k=None`` returns every match."""
+        scores = self.scores(query, filters)
+        matched = int(np.count_nonzero(scores > 0))
+        idxs = top_k_indices(scores, matched if top_k is None else min(top_k, matched))
+        with self._lock:
+            pks = self._pks
+            return [pks[int(i)] for i in idxs], [float(scores[i]) for i in idxs]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60, weights: Optional[List[float]] = None) -> List[str]:
+    """Fuse several ranked pk lists; each list contributes weight / (k + rank)."""
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, pk in enumerate(ranking, 1):
+            fused[pk] = fused.get(pk, 0.0) + weight / (k + rank)
+    return sorted(fused, key=lambda pk: -fused[pk])
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import numpy as np
+
+rag_logger = logging.getLogger('rag_debug')
+
+# Key behaviours: "stub-slow-2.5" answers after 2.5 s, "stub-fail-503" returns
+# that status, "stub-invalid" replies without recommendation JSON; anything
+# else answers after the server's default delay.
+_SLOW_RE = re.compile(r"slow-(\d+(?:\.\d+)?)")
+_FAIL_RE = re.compile(r"fail-(\d{3})")
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server: "StubLLMServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        rag_logger.debug(f"LLM stub: {format % args}")
+
+    def _send_json(self, status: int, body: dict, headers: Optional[dict] = None) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"data": [{"id": m} for m in self.server.models]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        key = self.headers.get("Authorization", "").replace("Bearer ", "")
+        self.server.requests.append({"key": key, "path": self.path, "model": payload.get("model")})
+
+        slow = _SLOW_RE.search(key)
+        time.sleep(float(slow.group(1)) if slow else self.server.delay)
+        fail = _FAIL_RE.search(key)
+        if fail:
+            status = int(fail.group(1))
+            headers = {"Retry-After": "1"} if status == 429 else None
+            self._send_json(status, {"error": {"message": f"stub failure {status}"}}, headers)
+            return
+
+        if self.path.rstrip("/").endswith("/embeddings"):
+            texts = payload.get("input") or []
+            texts = [texts] if isinstance(texts, str) else texts
+            self._send_json(200, {"data": [
+                {"index": i, "embedding": self.server.embed(text)} for i, text in enumerate(texts)
+            ]})
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            content = self.server.reply(payload, invalid="invalid" in key)
+            if payload.get("stream"):
+                self._stream(content, payload.get("model"))
+            else:
+                self._send_json(200, {
+                    "id": "stub", "model": payload.get("model"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(content) // 4, "total_tokens": len(content) // 4},
+                })
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def _stream(self, content: str, model: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for start in range(0, len(content), 8):
+            chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": content[start:start + 8]}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.server.token_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """OpenRouter-compatible stand-in for offline development and tests.
+
+    Serves ``/models``, ``/embeddings`` (deterministic vectors per text) and
+    ``/chat/completions`` (optionally streamed) under ``/api/v1``. Latency and
+    failures are chosen per API key, see the key behaviours above.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, delay: float = 0.05, token_delay: float = 0.02,
+                 models: Optional[List[str]] = None, products: Optional[List[str]] = None, dim: int = 1536):
+        super().__init__((host, port), _StubHandler)
+        self.delay = delay
+        self.token_delay = token_delay
+        self.models = models or ["deepseek/deepseek-r1:free", "openai/text-embedding-3-small"]
+        self.products = products or []
+        self.dim = dim
+        self.requests: List[dict] = []
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def embed(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+        vec = np.random.default_rng(seed).standard_normal(self.dim)
+        return (vec / np.linalg.norm(vec)).tolist()
+
+    def reply(self, payload: dict, invalid: bool = False) -> str:
+        user = next((m.get("content", "") for m in reversed(payload.get("messages", [])) if m.get("role") == "user"), "")
+        if invalid:
+            return f"Sorry, I can only chat about: {user}"
+        return json.dumps({"response": f"Stub recommendation for: {user}", "products": self.products})
+
+    def start(self) -> threading.Thread:
+        """Serve from a daemon thread; returns the thread."""
+        thread = threading.Thread(target=self.serve_forever, name="llm-stub", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,103 @@
+import logging
+import math
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .vector_index import ProductFacets
+
+rag_logger = logging.getLogger('rag_debug')
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _features(text: str) -> List[str]:
+    """Word unigrams plus boundary-marked character trigrams of each word."""
+    words = _TOKEN_RE.findall(text.lower())
+    feats = list(words)
+    for w in words:
+        padded = f"#{w}#"
+        feats.extend("~" + padded[i:i + 3] for i in range(len(padded) - 2))
+    return feats
+
+
+def hashed_features(texts: List[str], dim: int = 512) -> np.ndarray:
+    """Sublinear term-frequency vectors using the signed hashing trick.
+
+    crc32 keeps bucket assignment identical across processes and restarts;
+    the sign bit reduces the bias collisions add to inner products.
+    """
+    rows: List[int] = []
+    cols: List[int] = []
+    vals: List[float] = []
+    for r, text in enumerate(texts):
+        for feat, count in Counter(_features(text)).items():
+            h = zlib.crc32(feat.encode("utf-8"))
+            rows.append(r)
+            cols.append(h % dim)
+            vals.append((1.0 + math.log(count)) * (1.0 if h & 0x80000000 else -1.0))
+    X = np.zeros((len(texts), dim), dtype=np.float32)
+    np.add.at(X, (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)), vals)
+    return X
+
+
+class LocalTextIndex:
+    """Offline TF-IDF index over hashed word and character n-grams.
+
+    Used for degraded semantic search when no remote embedding is available.
+    It lives in its own vector space and never mixes with provider vectors.
+    """
+
+    def __init__(self, dim: int = 512, refresh_interval: float = 300.0):
+        self.dim = dim
+        self.refresh_interval = refresh_interval
+        self.built_at = 0.0
+        self._idf = np.ones(dim, dtype=np.float32)
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._pks: List[str] = []
+        self._facets = ProductFacets()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pks)
+
+    @property
+    def is_stale(self) -> bool:
+        return not self.built_at or time.monotonic() - self.built_at > self.refresh_interval
+
+    def fit(self, pks: List[str], texts: List[str], metadata: Optional[List[dict]] = None) -> None:
+        """Build the index; ``metadata`` holds per-product category/price/tags for filtering."""
+        X = hashed_features(texts, self.dim)
+        df = np.count_nonzero(X, axis=0)
+        idf = (np.log((1.0 + len(texts)) / (1.0 + df)) + 1.0).astype(np.float32)
+        matrix = X * idf
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-8
+        facets = ProductFacets.from_docs(metadata or [{} for _ in pks])
+        with self._lock:
+            self._idf, self._matrix, self._pks, self._facets = idf, matrix, list(pks), facets
+            self.built_at = time.monotonic()
+        rag_logger.info(f"Built local text index: {len(pks)} products, dim={self.dim}")
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """L2-normalized TF-IDF vectors for ``texts`` in this index's space."""
+        X = hashed_features(texts, self.dim) * self._idf
+        return X / (np.linalg.norm(X, axis=1, keepdims=True) + 1e-8)
+
+    def search(self, query: str, top_k: int = 8, filters: Optional[dict] = None) -> Tuple[List[str], List[float]]:
+        with self._lock:
+            matrix, pks, facets = self._matrix, self._pks, self._facets
+        if not pks:
+            return [], []
+        scores = matrix @ self.embed([query])[0]
+        mask = facets.mask(**filters) if filters else None
+        if mask is not None:
+            scores = np.where(mask, scores, 0.0)
+        idxs = np.argsort(-scores)[:top_k]
+        # Rows with no overlapping features are noise, not results
+        idxs = [i for i in idxs if scores[i] > 0]
+        return [pks[int(i)] for i in idxs], [float(scores[i]) for i in idxs]
@@ -0,0 +1,60 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bench import BENCH_CONFIGS, run_benchmark
+from api.mongo import get_client
+
+
+class Command(BaseCommand):
+    help = ('Benchmark backfill, index build, query latency, memory and recall@k of the RAG layer '
+            'on synthetic catalogs, using a stub embedder; prints JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='*', default=[1000, 10000, 100000],
+                            help='Catalog sizes to generate (e.g. 1000 10000 100000 1000000)')
+        parser.add_argument('--dim', type=int, default=384)
+        parser.add_argument('--configs', nargs='*', default=list(BENCH_CONFIGS) + ['cosine_matrix'],
+                            choices=list(BENCH_CONFIGS) + ['cosine_matrix'])
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--top-k', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--nprobe', type=int, default=8, help='IVF lists scanned per query')
+        parser.add_argument('--rescore-factor', type=int, default=4,
+                            help='Compressed configs rerank top-k times this many rows exactly; 0 = no rerank')
+        parser.add_argument('--reduced-dim', type=int, default=256, help='Dimensions kept by truncate and pca')
+        parser.add_argument('--database', default=None,
+                            help='Scratch database, dropped afterwards (default: <MONGODB_NAME>_bench)')
+        parser.add_argument('--keep', action='store_true', help='Keep the scratch database')
+        parser.add_argument('--output', default=None, help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        name = options['database'] or f"{os.getenv('MONGODB_NAME', 'ecommerce_ai')}_bench"
+        if name == os.getenv('MONGODB_NAME', 'ecommerce_ai'):
+            raise CommandError('Refusing to benchmark in the application database')
+        db = get_client()[name]
+
+        runs = []
+        try:
+            for size in options['sizes']:
+                self.stderr.write(f'Benchmarking {size} products...')
+                runs.append(run_benchmark(
+                    db, size, dim=options['dim'], configs=options['configs'],
+                    n_queries=options['queries'], top_k=options['top_k'], seed=options['seed'],
+                    index_kwargs={
+                        'nprobe': options['nprobe'],
+                        'rescore_factor': options['rescore_factor'],
+                        'reduced_dim': options['reduced_dim'],
+                    },
+                ))
+        finally:
+            if not options['keep']:
+                get_client().drop_database(name)
+
+        report = json.dumps({'runs': runs}, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(report)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        self.stdout.write(report)
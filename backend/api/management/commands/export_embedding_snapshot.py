@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.rag import _get_mongo_db
+from api.vector_index import EmbeddingIndex
+
+
+class Command(BaseCommand):
+    help = 'Export product embeddings to a memory-mapped snapshot shared by worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None,
+                            help='Snapshot directory (default: RAG_SNAPSHOT_DIR)')
+        parser.add_argument('--watch', type=float, default=0,
+                            help='Keep running and re-export every N seconds when embeddings changed')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or getattr(settings, 'RAG_SNAPSHOT_DIR', '')
+        if not directory:
+            raise CommandError('No snapshot directory: pass --dir or set RAG_SNAPSHOT_DIR')
+
+        coll = _get_mongo_db()["product_embeddings"]
+        # Plain Mongo-backed index: the exporter must never read its own snapshots
+        index = EmbeddingIndex(refresh_interval=0)
+        index.refresh(coll, force=True)
+        name = index.export_snapshot(directory)
+        self.stdout.write(self.style.SUCCESS(f'Exported snapshot {name} with {len(index)} embeddings'))
+
+        interval = options['watch']
+        while interval > 0:
+            time.sleep(interval)
+            if index.refresh(coll):
+                name = index.export_snapshot(directory)
+                self.stdout.write(self.style.SUCCESS(f'Exported snapshot {name} with {len(index)} embeddings'))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from api.rag import _get_mongo_db
+from api.vector_index import decode_embedding, encode_embedding
+
+
+class Command(BaseCommand):
+    help = 'Convert product_embeddings documents between array and binary float32 storage in place'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', choices=['binary', 'array'], default='binary',
+                            help='Target storage format (default: binary)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Documents rewritten per bulk write')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count documents that would be converted')
+
+    def handle(self, *args, **options):
+        target = options['to']
+        batch_size = options['batch_size']
+        coll = _get_mongo_db()["product_embeddings"]
+
+        # Binary documents carry a dtype field; legacy array documents do not
+        pending = {"dtype": {"$exists": False}} if target == 'binary' else {"dtype": {"$exists": True}}
+        total = coll.count_documents(pending)
+        self.stdout.write(f'{total} embedding documents to convert to {target}')
+        if options['dry_run'] or not total:
+            return
+
+        converted = 0
+        ops = []
+        # updated_at is left untouched: the vectors are unchanged, so resident
+        # indexes have nothing to reload
+        for doc in coll.find(pending, {"_id": 1, "embedding": 1, "dtype": 1}):
+            fields = encode_embedding(decode_embedding(doc), target)
+            update = {"$set": fields}
+            if target == 'array':
+                update["$unset"] = {"dtype": "", "dim": ""}
+            ops.append(UpdateOne({"_id": doc["_id"]}, update))
+            if len(ops) >= batch_size:
+                converted += coll.bulk_write(ops, ordered=False).modified_count
+                ops = []
+                self.stdout.write(f'  converted {converted}/{total}')
+        if ops:
+            converted += coll.bulk_write(ops, ordered=False).modified_count
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully converted {converted} embeddings to {target} storage')
+        )
@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.quantization import recall_report
+from api.rag import _get_mongo_db
+from api.vector_index import EmbeddingIndex
+
+
+class Command(BaseCommand):
+    help = 'Report recall@k versus memory of the embedding quantization settings on the stored catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=10)
+        parser.add_argument('--queries', type=int, default=200,
+                            help='Number of perturbed catalog rows used as queries')
+        parser.add_argument('--pq-subspaces', type=int, nargs='*', default=[16, 32, 64, 128],
+                            help='PQ subspace counts to evaluate (bytes per vector)')
+        parser.add_argument('--reduced-dims', type=int, nargs='*', default=[256, 512],
+                            help='Dimensions kept by truncate and pca to evaluate')
+        parser.add_argument('--rescore-factors', type=int, nargs='*', default=[1, 4, 10],
+                            help='Shortlist sizes as multiples of top-k; 1 means no exact rescoring')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        index = EmbeddingIndex(refresh_interval=0)
+        index.refresh(_get_mongo_db()["product_embeddings"], force=True)
+        if not len(index):
+            raise CommandError('No embeddings stored; run the indexer first')
+
+        configs = [{"kind": "int8"}] + [{"kind": "pq", "pq_subspaces": m} for m in options['pq_subspaces']]
+        configs += [
+            {"kind": kind, "reduced_dim": d}
+            for kind in ("truncate", "pca") for d in options['reduced_dims'] if d < index.dim
+        ]
+        rows = recall_report(
+            index.matrix, configs,
+            n_queries=options['queries'], top_k=options['top_k'],
+            rescore_factors=options['rescore_factors'],
+        )
+
+        if options['json']:
+            self.stdout.write(json.dumps({"rows": len(index), "dim": index.dim, "results": rows}, indent=2))
+            return
+
+        k = options['top_k']
+        self.stdout.write(f'{len(index)} embeddings, dim={index.dim}, recall@{k}')
+        self.stdout.write(f'{"quantization":<14}{"rescore":>8}{"bytes/vec":>11}{"memory MB":>11}{"recall":>9}{"build s":>9}')
+        for row in rows:
+            rescore = '-' if row['rescore_factor'] is None else f"x{row['rescore_factor']}"
+            self.stdout.write(
+                f"{row['quantization']:<14}{rescore:>8}{row['bytes_per_vector']:>11}"
+                f"{row['memory_mb']:>11}{row['recall']:>9}{row['build_seconds']:>9}"
+            )
+        self.stdout.write(self.style.SUCCESS('Set RAG_QUANTIZATION / RAG_PQ_SUBSPACES / RAG_REDUCED_DIM / RAG_RESCORE_FACTOR accordingly'))
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.indexer import IndexerWorker, enqueue_reconcile, process_pending, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = 'Run the embedding indexer: drain the embedding job queue and keep product embeddings current'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Reconcile the catalog, drain the queue, then exit')
+        parser.add_argument('--batch-size', type=int, default=32,
+                            help='Jobs claimed per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        if options['once']:
+            enqueue_reconcile()
+            requeue_stale_jobs()
+            total = 0
+            while True:
+                processed = process_pending(batch_size)
+                if not processed:
+                    break
+                total += processed
+            self.stdout.write(self.style.SUCCESS(f'Processed {total} embedding jobs'))
+            return
+
+        worker = IndexerWorker(
+            poll_interval=getattr(settings, 'RAG_INDEXER_POLL_SECONDS', 2.0),
+            reconcile_interval=getattr(settings, 'RAG_INDEXER_RECONCILE_SECONDS', 3600.0),
+            batch_size=batch_size,
+            lease_ttl=getattr(settings, 'RAG_INDEXER_LEASE_SECONDS', 30.0),
+        )
+        self.stdout.write('Embedding indexer running, press Ctrl+C to stop')
+        worker.start()
+        try:
+            while worker.is_alive():
+                worker.join(timeout=1)
+        except KeyboardInterrupt:
+            worker.stop()
+            worker.join()
+        self.stdout.write(self.style.SUCCESS('Embedding indexer stopped'))
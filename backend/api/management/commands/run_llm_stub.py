@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api.llm_stub import StubLLMServer
+
+
+class Command(BaseCommand):
+    help = 'Serve an OpenRouter-compatible stub API for offline development (set OPENROUTER_BASE_URL to it)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--delay', type=float, default=0.05,
+                            help='Seconds before each answer, unless the key asks for slow-<seconds>')
+        parser.add_argument('--products', nargs='*', default=[],
+                            help='Product ids returned in every recommendation')
+
+    def handle(self, *args, **options):
+        server = StubLLMServer(options['host'], options['port'], delay=options['delay'],
+                               products=options['products'])
+        self.stdout.write(self.style.SUCCESS(f'LLM stub listening on {server.base_url}, press Ctrl+C to stop'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from pymongo import MongoClient, monitoring
+
+rag_logger = logging.getLogger('rag_debug')
+
+
+class _PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events for one client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checked_out": 0,
+            "checked_in": 0,
+            "checkout_failures": 0,
+            "pools_cleared": 0,
+        }
+
+    def _inc(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._inc("pools_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._inc("connections_created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._inc("connections_closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._inc("checkout_failures")
+
+    def connection_checked_out(self, event):
+        self._inc("checked_out")
+
+    def connection_checked_in(self, event):
+        self._inc("checked_in")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+        stats["open"] = stats["connections_created"] - stats["connections_closed"]
+        stats["in_use"] = stats["checked_out"] - stats["checked_in"]
+        return stats
+
+
+_client = None
+_client_pid = None
+_listener = None
+_lock = threading.Lock()
+_last_health = {"ok": None, "checked_at": 0.0, "latency_ms": None, "error": None}
+
+
+def get_client() -> MongoClient:
+    """Process-wide MongoClient, using the same env as the Django djongo settings.
+
+    A client must not be shared across fork(), so a process that finds a
+    client created by its parent builds its own. ``connect=False`` defers
+    connecting until first use, so clients created before a fork are harmless.
+    """
+    global _client, _client_pid, _listener
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
+                username = os.getenv('MONGODB_USERNAME', '')
+                password = os.getenv('MONGODB_PASSWORD', '')
+                auth_source = os.getenv('MONGODB_AUTH_SOURCE', 'admin')
+                options = {
+                    "maxPoolSize": getattr(settings, 'MONGODB_MAX_POOL_SIZE', 50),
+                    "minPoolSize": getattr(settings, 'MONGODB_MIN_POOL_SIZE', 0),
+                    "serverSelectionTimeoutMS": getattr(settings, 'MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000),
+                    "connectTimeoutMS": getattr(settings, 'MONGODB_CONNECT_TIMEOUT_MS', 5000),
+                    "socketTimeoutMS": getattr(settings, 'MONGODB_SOCKET_TIMEOUT_MS', 30000),
+                    "connect": False,
+                }
+                if username and password:
+                    options.update(username=username, password=password, authSource=auth_source)
+
+                listener = _PoolStatsListener()
+                rag_logger.info(f"Creating MongoClient for pid {pid}: uri={uri}, maxPoolSize={options['maxPoolSize']}")
+                _client = MongoClient(uri, event_listeners=[listener], **options)
+                _client_pid = pid
+                _listener = listener
+    return _client
+
+
+def get_db(name: str = None):
+    return get_client()[name or os.getenv('MONGODB_NAME', 'ecommerce_ai')]
+
+
+def check_health(max_age: float = None) -> dict:
+    """Ping the server, reusing the last result if it is younger than ``max_age`` seconds."""
+    if max_age is None:
+        max_age = getattr(settings, 'MONGODB_HEALTH_CHECK_SECONDS', 30.0)
+    if _last_health["ok"] is not None and time.monotonic() - _last_health["checked_at"] < max_age:
+        return dict(_last_health)
+
+    start = time.monotonic()
+    try:
+        get_client().admin.command('ping')
+        _last_health.update(ok=True, error=None, latency_ms=round((time.monotonic() - start) * 1000, 2))
+    except Exception as e:
+        rag_logger.error(f"MongoDB health check failed: {e}")
+        _last_health.update(ok=False, error=str(e), latency_ms=None)
+    _last_health["checked_at"] = time.monotonic()
+    return dict(_last_health)
+
+
+def pool_stats() -> dict:
+    """Connection pool counters for this process's client."""
+    client = get_client()
+    stats = _listener.snapshot() if _listener else {}
+    stats.update({
+        "pid": _client_pid,
+        "max_pool_size": client.max_pool_size,
+        "min_pool_size": client.min_pool_size,
+    })
+    return stats
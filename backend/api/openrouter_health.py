@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+import requests
+from django.conf import settings
+
+from .key_pool import OPENROUTER_BASE_URL
+
+openrouter_logger = logging.getLogger('openrouter_debug')
+
+
+class OpenRouterHealthMonitor(threading.Thread):
+    """Background probe of OpenRouter reachability and the published model list.
+
+    One ``GET /models`` per interval answers both questions, so request
+    handlers read the cached result instead of probing the network before
+    every chat call. ``request_check`` wakes the thread early, e.g. after
+    every key failed.
+    """
+
+    def __init__(self, interval: float = 300.0, timeout: float = 10.0, base_url: str = OPENROUTER_BASE_URL,
+                 require_listed_model: bool = False):
+        super().__init__(name="openrouter-health", daemon=True)
+        self.interval = interval
+        self.timeout = timeout
+        self.base_url = base_url
+        self.require_listed_model = require_listed_model
+        self.session = requests.Session()
+        self.reachable: Optional[bool] = None
+        self.models: Optional[frozenset] = None
+        self.checked_at: Optional[float] = None
+        self.latency_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        # Models already warned about, so a missing one is logged once per model list
+        self._missing_warned: set = set()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._wake.set()
+
+    def request_check(self) -> None:
+        self._wake.set()
+
+    def check(self) -> None:
+        start = time.monotonic()
+        try:
+            resp = self.session.get(f"{self.base_url}/models", timeout=self.timeout)
+            latency_ms = round((time.monotonic() - start) * 1000, 1)
+            if resp.status_code != 200:
+                raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+            models = frozenset(m.get('id', '') for m in resp.json().get('data', []))
+        except Exception as e:
+            if self.reachable is not False:
+                openrouter_logger.error(f"OpenRouter health check failed: {e}")
+            self.reachable, self.error, self.latency_ms = False, str(e), None
+        else:
+            if self.reachable is not True:
+                openrouter_logger.info(f"OpenRouter reachable: {len(models)} models listed ({latency_ms} ms)")
+            if models != self.models:
+                self._missing_warned = set()
+            self.reachable, self.models, self.error, self.latency_ms = True, models, None, latency_ms
+        self.checked_at = time.time()
+
+    def model_available(self, model: str) -> Optional[bool]:
+        """Whether ``model`` is listed; None until a model list has been fetched."""
+        if self.models is None:
+            return None
+        return model in self.models
+
+    def usable(self, model: str) -> bool:
+        """False only when the last check found OpenRouter unreachable.
+
+        The model list can omit a model that still serves requests (``:free``
+        variants come and go, listings may be truncated), so a missing model
+        is only logged unless ``require_listed_model`` is set.
+        """
+        if self.reachable is False:
+            return False
+        if self.model_available(model) is False:
+            if model not in self._missing_warned:
+                self._missing_warned.add(model)
+                openrouter_logger.warning(f"⚠️ Configured model '{model}' not found in available models")
+            return not self.require_listed_model
+        return True
+
+    def snapshot(self, model: Optional[str] = None) -> dict:
+        stats = {
+            "reachable": self.reachable,
+            "models_listed": len(self.models) if self.models is not None else None,
+            "checked_at": self.checked_at,
+            "latency_ms": self.latency_ms,
+            "error": self.error,
+        }
+        if model:
+            stats["model"] = model
+            stats["model_available"] = self.model_available(model)
+        return stats
+
+    def run(self) -> None:
+        openrouter_logger.info(f"OpenRouter health monitor started (interval={self.interval}s)")
+        while not self._stop_event.is_set():
+            self.check()
+            # Re-probe sooner while down so recovery is noticed quickly
+            self._wake.wait(self.interval if self.reachable else min(self.interval, 30.0))
+            self._wake.clear()
+
+
+_monitor = None
+_monitor_pid = None
+_monitor_lock = threading.Lock()
+
+
+def get_health_monitor() -> OpenRouterHealthMonitor:
+    """Start the health monitor thread once per process (threads do not survive fork)."""
+    global _monitor, _monitor_pid
+    pid = os.getpid()
+    if _monitor is None or _monitor_pid != pid or not _monitor.is_alive():
+        with _monitor_lock:
+            if _monitor is None or _monitor_pid != pid or not _monitor.is_alive():
+                _monitor = OpenRouterHealthMonitor(
+                    interval=getattr(settings, 'OPENROUTER_HEALTH_CHECK_SECONDS', 300.0),
+                    base_url=getattr(settings, 'OPENROUTER_BASE_URL', OPENROUTER_BASE_URL),
+                    require_listed_model=getattr(settings, 'OPENROUTER_REQUIRE_LISTED_MODEL', False),
+                )
+                _monitor.start()
+                _monitor_pid = pid
+    return _monitor
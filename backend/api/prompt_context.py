@@ -0,0 +1,104 @@
+import re
+from typing import Dict, Iterable, List, Optional
+
+from .tokens import chars_for_tokens, estimate_tokens
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+CONTEXT_HEADER = "id|name|price|category|tags|description"
+
+
+def _clean(value) -> str:
+    """One-line table cell: collapsed whitespace, no column separators."""
+    return _WHITESPACE_RE.sub(" ", str(value or "")).replace("|", "/").strip()
+
+
+def _format_price(price) -> str:
+    try:
+        return f"{float(str(price)):.2f}".rstrip("0").rstrip(".")
+    except (ValueError, TypeError):
+        return "?"
+
+
+def _trim(text: str, max_chars: int) -> str:
+    """Cut ``text`` to at most ``max_chars`` at a word boundary, marking the cut with an ellipsis."""
+    if len(text) <= max_chars:
+        return text
+    if max_chars < 8:
+        return ""
+    cut = text[:max_chars - 1]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip(" ,.;:") + "…"
+
+
+class ProductContext:
+    """Products rendered for the system prompt, with the short ids the model sees.
+
+    The model answers with short ids such as ``P3``; ``resolve`` maps them
+    back to product pks.
+    """
+
+    def __init__(self, text: str, ids: Dict[str, str]):
+        self.text = text
+        self.ids = ids
+        self._pks = set(ids.values())
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+    def resolve_one(self, product_id) -> Optional[str]:
+        """Pk for a short id (or a pk that was in the context); None for anything else."""
+        value = str(product_id).strip()
+        pk = self.ids.get(value.upper())
+        if pk is None and value in self._pks:
+            pk = value
+        return pk
+
+    def resolve(self, product_ids: Iterable) -> List[str]:
+        pks = []
+        for product_id in product_ids:
+            pk = self.resolve_one(product_id)
+            if pk is not None and pk not in pks:
+                pks.append(pk)
+        return pks
+
+
+def build_product_context(products: List, max_tokens: int = 800, max_description_chars: int = 160) -> ProductContext:
+    """Compact ``id|name|price|category|tags|description`` table of ``products`` within ``max_tokens``.
+
+    Products are listed in the given (relevance) order. Descriptions share
+    whatever budget the other columns leave, short ones first so their
+    unused space goes to the longer ones; when even bare rows do not fit,
+    the least relevant products are dropped.
+    """
+    rows = []
+    for i, product in enumerate(products, 1):
+        tags = product.tags if isinstance(product.tags, list) else []
+        rows.append((
+            f"P{i}",
+            str(product.pk),
+            f"P{i}|{_clean(product.name)}|{_format_price(product.price)}|{_clean(product.category)}|"
+            f"{','.join(_clean(t) for t in tags)}|",
+            _clean(product.description),
+        ))
+
+    # Keep the most relevant rows whose other columns fit the budget (at least one)
+    kept = 0
+    while kept < len(rows) and (kept == 0 or estimate_tokens(
+            "\n".join([CONTEXT_HEADER] + [row[2] for row in rows[:kept + 1]])) <= max_tokens):
+        kept += 1
+    rows = rows[:kept]
+
+    fixed = "\n".join([CONTEXT_HEADER] + [row[2] for row in rows])
+    remaining_chars = chars_for_tokens(max_tokens - estimate_tokens(fixed))
+    descriptions = [""] * len(rows)
+    by_length = sorted(range(len(rows)), key=lambda j: len(rows[j][3]))
+    for k, j in enumerate(by_length):
+        share = remaining_chars // (len(rows) - k)
+        descriptions[j] = _trim(rows[j][3], min(share, max_description_chars))
+        remaining_chars -= len(descriptions[j])
+
+    lines = [CONTEXT_HEADER] + [row[2] + description for row, description in zip(rows, descriptions)]
+    return ProductContext("\n".join(lines), {row[0]: row[1] for row in rows})
@@ -0,0 +1,299 @@
+import logging
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+from .ann import top_k_indices, top_k_indices_2d
+
+rag_logger = logging.getLogger('rag_debug')
+
+# Rows decoded per block when scoring, bounding the float32 temporaries
+_SCORE_CHUNK = 65536
+
+
+class ScalarQuantizer:
+    """Symmetric int8 quantization with one scale per dimension.
+
+    A row x is stored as round(x / scale) in [-127, 127]; the inner product
+    with a float query q is codes @ (scale * q), so queries are never quantized.
+    Codes take a quarter of the float32 memory.
+    """
+
+    kind = "int8"
+
+    def __init__(self, scale: np.ndarray):
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def train(cls, matrix: np.ndarray, sample_size: int = 100000, seed: int = 0) -> "ScalarQuantizer":
+        n = matrix.shape[0]
+        if n > sample_size:
+            matrix = matrix[np.sort(np.random.default_rng(seed).choice(n, sample_size, replace=False))]
+        scale = np.abs(np.asarray(matrix, dtype=np.float32)).max(axis=0) / 127.0
+        return cls(np.where(scale > 0, scale, 1.0))
+
+    def bytes_per_vector(self, dim: int) -> int:
+        return dim
+
+    def encode(self, matrix: np.ndarray) -> np.ndarray:
+        codes = np.empty(matrix.shape, dtype=np.int8)
+        for start in range(0, matrix.shape[0], _SCORE_CHUNK):
+            block = np.asarray(matrix[start:start + _SCORE_CHUNK], dtype=np.float32) / self.scale
+            codes[start:start + block.shape[0]] = np.clip(np.rint(block), -127, 127)
+        return codes
+
+    def scores(self, codes: np.ndarray, Q: np.ndarray) -> np.ndarray:
+        """Approximate (n_rows, n_queries) inner products for unit queries Q (n_queries, dim)."""
+        Qs = (np.atleast_2d(Q) * self.scale).T.astype(np.float32)
+        out = np.empty((codes.shape[0], Qs.shape[1]), dtype=np.float32)
+        for start in range(0, codes.shape[0], _SCORE_CHUNK):
+            block = codes[start:start + _SCORE_CHUNK]
+            out[start:start + block.shape[0]] = block.astype(np.float32) @ Qs
+        return out
+
+
+def _kmeans(X: np.ndarray, k: int, n_iter: int = 10, seed: int = 0) -> np.ndarray:
+    """Euclidean k-means; returns (k, dim) float32 centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = X[rng.choice(X.shape[0], k, replace=False)].copy()
+    for _ in range(n_iter):
+        d2 = (X * X).sum(1)[:, None] - 2.0 * X @ centroids.T + (centroids * centroids).sum(1)[None, :]
+        labels = np.argmin(d2, axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, X)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        n_empty = int((~nonempty).sum())
+        if n_empty:
+            centroids[~nonempty] = X[rng.choice(X.shape[0], n_empty, replace=False)]
+    return centroids.astype(np.float32)
+
+
+class ProductQuantizer:
+    """Product quantization with asymmetric distance computation (ADC).
+
+    The vector is split into ``m`` subspaces, each encoded as the index of its
+    nearest of up to 256 sub-centroids, so a row costs ``m`` bytes. A query
+    builds an (m, 256) table of sub-inner-products once; scoring a row is then
+    ``m`` table lookups.
+    """
+
+    kind = "pq"
+
+    def __init__(self, codebooks: np.ndarray):
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)  # (m, ksub, dsub)
+
+    @property
+    def m(self) -> int:
+        return int(self.codebooks.shape[0])
+
+    @property
+    def dsub(self) -> int:
+        return int(self.codebooks.shape[2])
+
+    @staticmethod
+    def subspaces_for(dim: int, m: int) -> int:
+        """Largest subspace count <= m that divides ``dim``."""
+        m = max(1, min(m, dim))
+        while dim % m:
+            m -= 1
+        return m
+
+    @classmethod
+    def train(cls, matrix: np.ndarray, m: int = 64, ksub: int = 256, sample_size: int = 20000,
+              n_iter: int = 10, seed: int = 0) -> "ProductQuantizer":
+        n, dim = matrix.shape
+        m = cls.subspaces_for(dim, m)
+        if n > sample_size:
+            matrix = matrix[np.sort(np.random.default_rng(seed).choice(n, sample_size, replace=False))]
+        X = np.asarray(matrix, dtype=np.float32)
+        ksub = max(1, min(ksub, X.shape[0]))
+        dsub = dim // m
+        rag_logger.info(f"Training PQ: rows={X.shape[0]}, m={m}, ksub={ksub}, dsub={dsub}")
+        codebooks = np.stack([
+            _kmeans(X[:, j * dsub:(j + 1) * dsub], ksub, n_iter, seed + j) for j in range(m)
+        ])
+        return cls(codebooks)
+
+    def bytes_per_vector(self, dim: int) -> int:
+        return self.m
+
+    def encode(self, matrix: np.ndarray) -> np.ndarray:
+        codes = np.empty((matrix.shape[0], self.m), dtype=np.uint8)
+        for start in range(0, matrix.shape[0], _SCORE_CHUNK):
+            block = np.asarray(matrix[start:start + _SCORE_CHUNK], dtype=np.float32)
+            for j, book in enumerate(self.codebooks):
+                sub = block[:, j * self.dsub:(j + 1) * self.dsub]
+                d2 = -2.0 * sub @ book.T + (book * book).sum(1)[None, :]
+                codes[start:start + block.shape[0], j] = np.argmin(d2, axis=1)
+        return codes
+
+    def scores(self, codes: np.ndarray, Q: np.ndarray) -> np.ndarray:
+        Q = np.atleast_2d(Q).astype(np.float32)
+        out = np.zeros((codes.shape[0], Q.shape[0]), dtype=np.float32)
+        for qi, q in enumerate(Q):
+            # ADC table: inner product of each query sub-vector with every sub-centroid
+            tables = np.einsum("mkd,md->mk", self.codebooks, q.reshape(self.m, self.dsub))
+            col = out[:, qi]
+            for j in range(self.m):
+                col += tables[j][codes[:, j]]
+        return out
+
+
+class DimensionReducer:
+    """Scores in a reduced embedding space of ``out_dim`` float32 dimensions.
+
+    ``truncate`` keeps the leading dimensions and renormalizes; models trained
+    Matryoshka-style (text-embedding-3) front-load information, so prefixes
+    rank well. ``pca`` projects onto the top right-singular vectors of a
+    catalog sample, the rank-``out_dim`` subspace that best preserves inner
+    products; the basis is persisted next to the IVF centroids. A sample
+    with fewer rows than the configured ``requested_dim`` yields a smaller
+    ``out_dim``.
+    """
+
+    def __init__(self, kind: str, out_dim: int, basis: Optional[np.ndarray] = None, trained_rows: int = 0,
+                 requested_dim: Optional[int] = None):
+        self.kind = kind
+        self.out_dim = out_dim
+        self.requested_dim = requested_dim or out_dim
+        self.basis = None if basis is None else np.asarray(basis, dtype=np.float32)  # (out_dim, dim)
+        self.trained_rows = trained_rows
+
+    @classmethod
+    def train(cls, kind: str, matrix: np.ndarray, out_dim: int, sample_size: int = 20000,
+              seed: int = 0) -> "DimensionReducer":
+        n, dim = matrix.shape
+        out_dim = max(1, min(out_dim, dim))
+        if kind == "truncate":
+            return cls(kind, out_dim, trained_rows=n)
+        if n > sample_size:
+            matrix = matrix[np.sort(np.random.default_rng(seed).choice(n, sample_size, replace=False))]
+        X = np.asarray(matrix, dtype=np.float32)
+        requested_dim, out_dim = out_dim, min(out_dim, X.shape[0])
+        rag_logger.info(f"Fitting PCA basis: rows={X.shape[0]}, dim={dim} -> {out_dim}")
+        # Uncentered: the inner products themselves are what ranking needs preserved
+        _, _, vt = np.linalg.svd(X, full_matrices=False)
+        return cls(kind, out_dim, basis=vt[:out_dim], trained_rows=n, requested_dim=requested_dim)
+
+    def needs_retrain(self, n_rows: int) -> bool:
+        return self.kind == "pca" and n_rows > 4 * max(self.trained_rows, 1)
+
+    def bytes_per_vector(self, dim: int) -> int:
+        return self.out_dim * 4
+
+    def project(self, X: np.ndarray) -> np.ndarray:
+        X = np.atleast_2d(np.asarray(X, dtype=np.float32))
+        if self.basis is not None:
+            return X @ self.basis.T
+        prefix = X[:, :self.out_dim]
+        return prefix / (np.linalg.norm(prefix, axis=1, keepdims=True) + 1e-8)
+
+    def encode(self, matrix: np.ndarray) -> np.ndarray:
+        codes = np.empty((matrix.shape[0], self.out_dim), dtype=np.float32)
+        for start in range(0, matrix.shape[0], _SCORE_CHUNK):
+            block = matrix[start:start + _SCORE_CHUNK]
+            codes[start:start + block.shape[0]] = self.project(block)
+        return codes
+
+    def scores(self, codes: np.ndarray, Q: np.ndarray) -> np.ndarray:
+        return codes @ self.project(Q).T
+
+    def save(self, coll) -> None:
+        coll.replace_one(
+            {"_id": "pca"},
+            {
+                "_id": "pca",
+                "dim": int(self.basis.shape[1]),
+                "out_dim": self.out_dim,
+                "requested_dim": self.requested_dim,
+                "trained_rows": self.trained_rows,
+                "basis": self.basis.astype("<f4").tobytes(),
+                "updated_at": datetime.utcnow(),
+            },
+            upsert=True,
+        )
+        rag_logger.info(f"Saved PCA basis to {coll.name}: {self.basis.shape[1]} -> {self.out_dim}")
+
+    @classmethod
+    def load(cls, coll, dim: int, out_dim: int) -> Optional["DimensionReducer"]:
+        """The persisted basis if it was fitted for ``dim`` -> ``out_dim`` (the configured size)."""
+        doc = coll.find_one({"_id": "pca"})
+        if not doc or doc.get("dim") != dim or doc.get("requested_dim", doc.get("out_dim")) != out_dim:
+            return None
+        effective = doc["out_dim"]
+        basis = np.frombuffer(doc["basis"], dtype="<f4").reshape(effective, dim)
+        return cls("pca", effective, basis=basis, trained_rows=doc.get("trained_rows", 0), requested_dim=out_dim)
+
+
+def train_quantizer(kind: str, matrix: np.ndarray, pq_subspaces: int = 64, reduced_dim: int = 256):
+    if kind == "int8":
+        return ScalarQuantizer.train(matrix)
+    if kind == "pq":
+        return ProductQuantizer.train(matrix, m=pq_subspaces)
+    if kind in ("truncate", "pca"):
+        return DimensionReducer.train(kind, matrix, reduced_dim)
+    raise ValueError(f"Unknown quantization {kind!r}; expected 'int8', 'pq', 'truncate' or 'pca'")
+
+
+def rescore(matrix: np.ndarray, candidates: np.ndarray, q: np.ndarray, top_k: int):
+    """Exact float32 top_k among ``candidates`` (row indices), best first."""
+    candidates = np.sort(candidates)  # sequential reads when matrix is memory-mapped
+    scores = np.asarray(matrix[candidates], dtype=np.float32) @ q
+    top = top_k_indices(scores, top_k)
+    return candidates[top], scores[top]
+
+
+def recall_report(matrix: np.ndarray, configs: List[dict], n_queries: int = 200, top_k: int = 10,
+                  rescore_factors: Iterable[int] = (1, 4, 10), noise: float = 0.05,
+                  seed: int = 0) -> List[dict]:
+    """Recall@k and memory of each quantizer config against exact search.
+
+    Queries are perturbed catalog rows. ``configs`` are dicts such as
+    ``{"kind": "int8"}``, ``{"kind": "pq", "pq_subspaces": 32}`` or
+    ``{"kind": "pca", "reduced_dim": 256}``; each
+    config is reported once per rescore factor (1 = no exact rescoring).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    n, dim = matrix.shape
+    rng = np.random.default_rng(seed)
+    Q = matrix[rng.choice(n, min(n_queries, n), replace=False)]
+    Q = Q + noise * rng.normal(size=Q.shape).astype(np.float32) / np.sqrt(dim)
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True) + 1e-8
+    truth, _ = top_k_indices_2d(matrix @ Q.T, top_k)
+
+    rows = [{
+        "quantization": "none", "rescore_factor": None, "bytes_per_vector": dim * 4,
+        "memory_mb": round(n * dim * 4 / 2 ** 20, 2), "recall": 1.0, "build_seconds": 0.0,
+    }]
+    for config in configs:
+        start = time.perf_counter()
+        quantizer = train_quantizer(config["kind"], matrix, config.get("pq_subspaces", 64),
+                                    config.get("reduced_dim", 256))
+        codes = quantizer.encode(matrix)
+        build_seconds = time.perf_counter() - start
+        approx = quantizer.scores(codes, Q)
+        if config["kind"] == "int8":
+            label = "int8"
+        elif config["kind"] == "pq":
+            label = f"pq{quantizer.m}"
+        else:
+            label = f"{config['kind']}{quantizer.out_dim}"
+        for factor in rescore_factors:
+            shortlist, _ = top_k_indices_2d(approx, top_k * factor)
+            hits = 0
+            for qi in range(Q.shape[0]):
+                found = shortlist[qi] if factor == 1 else rescore(matrix, shortlist[qi], Q[qi], top_k)[0]
+                hits += len(set(found.tolist()) & set(truth[qi].tolist()))
+            rows.append({
+                "quantization": label,
+                "rescore_factor": factor,
+                "bytes_per_vector": quantizer.bytes_per_vector(dim),
+                "memory_mb": round(codes.nbytes / 2 ** 20, 2),
+                "recall": round(hits / (Q.shape[0] * top_k), 4),
+                "build_seconds": round(build_seconds, 3),
+            })
+    return rows
@@ -1,15 +1,27 @@
-import os
+import hashlib
 import logging
-from typing import List, Tuple
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Callable, List, Tuple
 from datetime import datetime
-import json
 
 import numpy as np
-import requests
+from pymongo import ReplaceOne, UpdateOne, WriteConcern
+from pymongo.errors import BulkWriteError
 from django.conf import settings
-from pymongo import MongoClient
 
+from .cache import QueryEmbeddingCache, SearchResultCache, SemanticResponseCache, normalize_query
+from .key_pool import KeyPoolExhausted, get_key_pool
+from .keyword_index import BM25Index, reciprocal_rank_fusion
+from .local_embedder import LocalTextIndex
 from .models import Product
+from .mongo import get_db
+from .sharded import shard_count
+from .tokens import estimate_tokens
+from .vector_index import EmbeddingIndex, encode_embedding
 
 # Create dedicated logger for RAG debugging
 logger = logging.getLogger(__name__)
@@ -25,146 +37,322 @@ if not rag_logger.handlers:
     rag_logger.addHandler(handler)
 
 
+# Database, index and embedder installed by search_backend()
+_backend_overrides: dict = {}
+
+
 def _get_mongo_db():
-    """Connect to Mongo using same env as Django djongo settings."""
-    uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
-    username = os.getenv('MONGODB_USERNAME', '')
-    password = os.getenv('MONGODB_PASSWORD', '')
-    auth_source = os.getenv('MONGODB_AUTH_SOURCE', 'admin')
-    db_name = os.getenv('MONGODB_NAME', 'ecommerce_ai')
+    """Database handle on the shared, pooled client (see api.mongo)."""
+    db = _backend_overrides.get("db")
+    return db if db is not None else get_db()
+
+
+_embedding_index = None
+_singleton_lock = threading.Lock()
+
+
+def get_embedding_index() -> EmbeddingIndex:
+    """Return the process-wide embedding index, creating it on first use."""
+    global _embedding_index
+    if "index" in _backend_overrides:
+        return _backend_overrides["index"]
+    if _embedding_index is None:
+        with _singleton_lock:
+            if _embedding_index is None:
+                _embedding_index = EmbeddingIndex(
+                    refresh_interval=getattr(settings, 'RAG_INDEX_REFRESH_SECONDS', 5.0),
+                    delete_check_interval=getattr(settings, 'RAG_INDEX_DELETE_CHECK_SECONDS', 60.0),
+                    engine=getattr(settings, 'RAG_SEARCH_ENGINE', 'exact'),
+                    nlist=getattr(settings, 'RAG_IVF_NLIST', 0),
+                    nprobe=getattr(settings, 'RAG_IVF_NPROBE', 8),
+                    ann_min_rows=getattr(settings, 'RAG_ANN_MIN_ROWS', 10000),
+                    snapshot_dir=getattr(settings, 'RAG_SNAPSHOT_DIR', ''),
+                    quantization=getattr(settings, 'RAG_QUANTIZATION', 'none'),
+                    pq_subspaces=getattr(settings, 'RAG_PQ_SUBSPACES', 64),
+                    rescore_factor=getattr(settings, 'RAG_RESCORE_FACTOR', 4),
+                    reduced_dim=getattr(settings, 'RAG_REDUCED_DIM', 256),
+                    float_store_dir=getattr(settings, 'RAG_FLOAT_STORE_DIR', ''),
+                    shards=shard_count(getattr(settings, 'RAG_SEARCH_SHARDS', 1)),
+                    shard_min_rows=getattr(settings, 'RAG_SHARD_MIN_ROWS', 50000),
+                )
+    return _embedding_index
+
+
+_local_text_index = None
+
+
+def get_local_text_index() -> LocalTextIndex:
+    """Return the process-wide offline text index, (re)building it when stale."""
+    global _local_text_index
+    if _local_text_index is None:
+        with _singleton_lock:
+            if _local_text_index is None:
+                _local_text_index = LocalTextIndex(
+                    dim=getattr(settings, 'RAG_LOCAL_EMBEDDING_DIM', 512),
+                    refresh_interval=getattr(settings, 'RAG_LOCAL_INDEX_REFRESH_SECONDS', 300.0),
+                )
+    index = _local_text_index
+    if index.is_stale:
+        products = list(Product.objects.all())
+        index.fit(
+            [str(p.pk) for p in products],
+            [_product_text(p) for p in products],
+            [_product_metadata(p) for p in products],
+        )
+    return index
+
+
+# Per-thread flag set when a search fell back to the offline text index
+_search_state = threading.local()
 
-    rag_logger.info(f"Connecting to MongoDB: uri={uri}, db_name={db_name}, username={username}, auth_source={auth_source}")
 
+def reset_search_degraded() -> None:
+    _search_state.degraded = False
+
+
+def search_degraded() -> bool:
+    """Whether a search in this thread used the offline index since reset_search_degraded().
+
+    Such results should not be cached: they would outlive the provider outage.
+    """
+    return getattr(_search_state, "degraded", False)
+
+
+def _local_search(query: str, top_k: int, filters: dict = None) -> List[str]:
+    """Degraded semantic search over the offline TF-IDF index."""
+    _search_state.degraded = True
     try:
-        if username and password:
-            client = MongoClient(uri, username=username, password=password, authSource=auth_source)
-        else:
-            client = MongoClient(uri)
-        
-        db = client[db_name]
-        # Test connection
-        db.command('ping')
-        rag_logger.info(f"Successfully connected to MongoDB database: {db_name}")
-        return db
+        pks, scores = get_local_text_index().search(query, top_k, filters)
+        rag_logger.info(f"Local index results: {list(zip(pks, scores))}")
+        return pks
     except Exception as e:
-        rag_logger.error(f"Failed to connect to MongoDB: {e}")
-        raise
+        rag_logger.error(f"Local text search failed: {e}")
+        return []
 
 
-def _simple_text_embedding(text: str, dim: int = 384) -> List[float]:
-    """Simple hash-based embedding for fallback when OpenRouter is unavailable."""
-    import hashlib
-    import struct
-    
-    # Create a hash of the text
-    hash_obj = hashlib.sha256(text.lower().encode('utf-8'))
-    hash_bytes = hash_obj.digest()
-    
-    # Convert hash bytes to float vector
-    embedding = []
-    for i in range(0, min(len(hash_bytes), dim * 4), 4):
-        chunk = hash_bytes[i:i+4]
-        if len(chunk) == 4:
-            val = struct.unpack('f', chunk)[0]
-        else:
-            val = float(sum(chunk))
-        embedding.append(val)
-    
-    # Pad or truncate to desired dimension
-    while len(embedding) < dim:
-        embedding.append(0.0)
-    embedding = embedding[:dim]
-    
-    # Normalize the vector
-    norm = sum(x*x for x in embedding) ** 0.5
-    if norm > 0:
-        embedding = [x / norm for x in embedding]
-    
-    return embedding
+_keyword_index = None
+
+
+def get_keyword_index() -> BM25Index:
+    """Return the process-wide BM25 index, rebuilding it from the catalog when stale.
+
+    Saves and deletes in this process update it immediately (see signals);
+    the periodic rebuild picks up changes made by other processes.
+    """
+    global _keyword_index
+    if _keyword_index is None:
+        with _singleton_lock:
+            if _keyword_index is None:
+                _keyword_index = BM25Index(
+                    refresh_interval=getattr(settings, 'RAG_KEYWORD_INDEX_REFRESH_SECONDS', 300.0),
+                )
+    index = _keyword_index
+    if index.is_stale:
+        products = list(Product.objects.all())
+        index.fit(
+            [str(p.pk) for p in products],
+            [_product_text(p) for p in products],
+            [_product_metadata(p) for p in products],
+        )
+    return index
+
+
+def update_keyword_index(product: Product) -> None:
+    """Apply a product save to the keyword index if this process has built one."""
+    if _keyword_index is not None and _keyword_index.built_at:
+        _keyword_index.upsert(str(product.pk), _product_text(product), _product_metadata(product))
+
+
+def remove_from_keyword_index(pk: str) -> None:
+    if _keyword_index is not None and _keyword_index.built_at:
+        _keyword_index.remove(pk)
+
+
+def keyword_search(query: str, top_k: int = 8, category: str = None, min_price: float = None,
+                   max_price: float = None, tags: List[str] = None) -> Tuple[List[str], List[float]]:
+    """BM25 ranked (pks, scores); ``top_k=None`` returns every matching product."""
+    filters = _search_filters(category, min_price, max_price, tags)
+    if not query:
+        return [], []
+    try:
+        pks, scores = get_keyword_index().search(query, top_k, filters)
+        rag_logger.info(f"Keyword search '{query}': {len(pks)} results, filters={filters}")
+        return pks, scores
+    except Exception as e:
+        rag_logger.error(f"Keyword search failed: {e}")
+        return [], []
+
+
+def _parse_embeddings(resp) -> List[List[float]]:
+    if not resp.text.strip():
+        raise ValueError("empty response")
+    data = resp.json()
+    if not isinstance(data, dict) or "data" not in data:
+        raise ValueError(f"response missing 'data' field: {str(data)[:200]}")
+    return [item["embedding"] for item in data["data"]]
 
 
 def _openrouter_embed(texts: List[str]) -> List[List[float]]:
-    # Load all available API keys for rotation
-    api_keys = []
-    for i in range(1, 11):  # Keys 1-10
-        key = getattr(settings, f'OPENROUTER_API_KEY_{i}', None)
-        if key:
-            api_keys.append(key)
-    
-    # Also include the main key if present
-    main_key = getattr(settings, 'OPENROUTER_API_KEY', None)
-    if main_key and main_key not in api_keys:
-        api_keys.insert(0, main_key)
-    
-    if not api_keys:
+    """Embed ``texts`` with the configured model through the shared API key pool.
+
+    Raises RuntimeError when every key fails. Vectors from any other source
+    would live in a different space, so there is deliberately no fallback
+    here; see ``_local_search`` for degraded search.
+    """
+    pool = get_key_pool()
+    if not len(pool):
         rag_logger.error("No OPENROUTER_API_KEY configured")
         raise RuntimeError("No OPENROUTER_API_KEY configured")
-    
+
     model = getattr(settings, 'OPENROUTER_EMBEDDING_MODEL', 'openai/text-embedding-3-small')
-    base_url = "https://openrouter.ai/api/v1"
-    
-    rag_logger.info(f"OpenRouter embedding request: model={model}, texts_count={len(texts)}, available_keys={len(api_keys)}")
-    
-    payload = {
-        "model": model,
-        "input": texts,
-    }
-    
-    # Try each API key until one works
-    for i, api_key in enumerate(api_keys, 1):
-        try:
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "http://localhost",
-                "X-Title": "SellerAgent E-commerce",
-            }
-            
-            rag_logger.info(f"Trying embedding token {i}/{len(api_keys)}: {api_key[:20]}...")
-            
-            resp = requests.post(f"{base_url}/embeddings", headers=headers, json=payload, timeout=60)
-            rag_logger.info(f"Embedding token {i} response status: {resp.status_code}")
-            
-            # Log response details for debugging
-            rag_logger.debug(f"Response headers: {dict(resp.headers)}")
-            rag_logger.debug(f"Response content length: {len(resp.content)} bytes")
-            rag_logger.debug(f"Response content preview: {resp.text[:200]}...")
-            
-            if resp.status_code == 200:
-                try:
-                    # Check if response is empty
-                    if not resp.text.strip():
-                        rag_logger.error(f"❌ Embedding token {i} returned empty response")
-                        continue
-                    
-                    data = resp.json()
-                    rag_logger.debug(f"OpenRouter response data keys: {list(data.keys()) if isinstance(data, dict) else 'not a dict'}")
-                    
-                    if "data" not in data:
-                        rag_logger.error(f"OpenRouter response missing 'data' field: {data}")
-                        continue  # Try next token
-                    
-                    embeddings = [item["embedding"] for item in data.get("data", [])]
-                    rag_logger.info(f"✅ Embedding SUCCESS with token {i}! Got {len(embeddings)} embeddings")
-                    return embeddings
-                    
-                except json.JSONDecodeError as e:
-                    rag_logger.error(f"❌ Embedding token {i} JSON decode error: {e}")
-                    rag_logger.error(f"❌ Raw response text: '{resp.text}'")
-                    rag_logger.error(f"❌ Response content type: {resp.headers.get('content-type', 'unknown')}")
-                    continue  # Try next token
-            else:
-                rag_logger.warning(f"❌ Embedding token {i} failed: {resp.status_code} - {resp.text[:100]}")
-                continue  # Try next token
-                
-        except Exception as e:
-            rag_logger.error(f"❌ Embedding token {i} exception: {e}")
-            continue  # Try next token
-    
-    # All tokens failed - fall back to simple embeddings
-    rag_logger.error(f"❌ ALL {len(api_keys)} EMBEDDING TOKENS FAILED - falling back to simple embeddings")
-    rag_logger.warning(f"Falling back to simple text embeddings for {len(texts)} texts")
-    return [_simple_text_embedding(text) for text in texts]
+    rag_logger.info(f"OpenRouter embedding request: model={model}, texts_count={len(texts)}, available_keys={len(pool)}")
+    try:
+        embeddings = pool.post("/embeddings", {"model": model, "input": texts}, timeout=60, parse=_parse_embeddings)
+    except KeyPoolExhausted as e:
+        rag_logger.error(f"❌ Embedding request failed: {e}")
+        raise
+    rag_logger.info(f"✅ Embedding SUCCESS: got {len(embeddings)} embeddings")
+    return embeddings
+
+
+_query_embedding_cache = None
+
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    """Return the process-wide query embedding cache, creating it on first use."""
+    global _query_embedding_cache
+    if _query_embedding_cache is None:
+        with _singleton_lock:
+            if _query_embedding_cache is None:
+                _query_embedding_cache = QueryEmbeddingCache(
+                    get_collection=lambda: _get_mongo_db()["query_embedding_cache"],
+                    max_entries=getattr(settings, 'RAG_QUERY_CACHE_SIZE', 2048),
+                    max_bytes=getattr(settings, 'RAG_QUERY_CACHE_MAX_BYTES', 16 * 2 ** 20),
+                    ttl=getattr(settings, 'RAG_QUERY_CACHE_TTL_SECONDS', 7 * 24 * 3600),
+                )
+    return _query_embedding_cache
+
+
+_search_result_cache = None
+
+
+def get_search_result_cache() -> SearchResultCache:
+    """Return the process-wide search result cache, creating it on first use."""
+    global _search_result_cache
+    if _search_result_cache is None:
+        with _singleton_lock:
+            if _search_result_cache is None:
+                _search_result_cache = SearchResultCache(
+                    max_entries=getattr(settings, 'RAG_SEARCH_CACHE_SIZE', 1024),
+                    max_bytes=getattr(settings, 'RAG_SEARCH_CACHE_MAX_BYTES', 32 * 2 ** 20),
+                    ttl=getattr(settings, 'RAG_SEARCH_CACHE_TTL_SECONDS', 300.0),
+                )
+    return _search_result_cache
+
+
+def search_cache_key(kind: str, query: str, top_k: int, filters: dict = None) -> str:
+    """Result cache key for a search against the current embedding index.
+
+    The index is refreshed first (throttled), so a product change picked up by
+    the indexer bumps the version and retires older entries in every process.
+    """
+    index = get_embedding_index()
+    try:
+        index.refresh(_get_mongo_db()["product_embeddings"])
+    except Exception as e:
+        rag_logger.warning(f"Index refresh before result cache lookup failed: {e}")
+    return SearchResultCache.key(kind, query, top_k, filters, index.version)
+
+
+def invalidate_search_results() -> None:
+    """Drop cached search results after a product change in this process."""
+    if _search_result_cache is not None:
+        _search_result_cache.invalidate()
+
+
+_response_cache = None
+
+
+def get_response_cache() -> SemanticResponseCache:
+    """Return the process-wide recommendation response cache, creating it on first use."""
+    global _response_cache
+    if _response_cache is None:
+        with _singleton_lock:
+            if _response_cache is None:
+                _response_cache = SemanticResponseCache(
+                    max_entries=getattr(settings, 'RAG_RESPONSE_CACHE_SIZE', 512),
+                    threshold=getattr(settings, 'RAG_RESPONSE_CACHE_THRESHOLD', 0.92),
+                    ttl=getattr(settings, 'RAG_RESPONSE_CACHE_TTL_SECONDS', 3600.0),
+                )
+    return _response_cache
+
+
+def invalidate_cached_responses(pk: str, price=None, deleted: bool = False) -> None:
+    """Drop cached recommendations that show ``pk`` at an outdated price or after its deletion."""
+    if _response_cache is None:
+        return
+    if deleted:
+        removed = _response_cache.invalidate_product(pk)
+    else:
+        removed = _response_cache.invalidate_product(pk, price)
+    if removed:
+        rag_logger.info(f"Dropped {removed} cached recommendations for product {pk}")
+
+
+def embed_query(query: str) -> List[float]:
+    """Embedding for a search query, served from the query cache when possible.
+
+    Raises RuntimeError when the query is not cached and the provider is down.
+    """
+    return embed_queries([query])[0]
+
+
+def embed_queries(queries: List[str]) -> List[List[float]]:
+    """Embeddings for several queries; all cache misses go in one provider call."""
+    model = getattr(settings, 'OPENROUTER_EMBEDDING_MODEL', 'openai/text-embedding-3-small')
+    cache = get_query_embedding_cache()
+    vectors = [cache.get(q, model) for q in queries]
+    misses = [i for i, vec in enumerate(vectors) if vec is None]
+    rag_logger.info(f"Query embedding cache: {len(queries) - len(misses)} hits, {len(misses)} misses")
+
+    if misses:
+        # Queries that normalize to the same text are embedded once
+        unique = list(dict.fromkeys(normalize_query(queries[i]) for i in misses))
+        fresh = _backend_overrides.get("embed", _openrouter_embed)(unique)
+        if len(fresh) != len(unique):
+            raise RuntimeError(f"Expected {len(unique)} query embeddings, got {len(fresh)}")
+        by_text = dict(zip(unique, fresh))
+        for text, vec in by_text.items():
+            cache.set(text, model, vec)
+        for i in misses:
+            vectors[i] = by_text[normalize_query(queries[i])]
+    return vectors
+
+
+@contextmanager
+def search_backend(db=None, index: EmbeddingIndex = None,
+                   embed: Callable[[List[str]], List[List[float]]] = None):
+    """Point this process's search path at another database, index and embedder.
+
+    Meant for benchmarks and offline tools, not a process serving requests:
+    inside the block ``semantic_search`` and its caches use ``db`` (for
+    ``product_embeddings`` and the shared query cache), ``index`` and
+    ``embed`` for query embedding misses. The query embedding and result
+    caches start empty; everything is restored on exit.
+    """
+    global _query_embedding_cache, _search_result_cache
+    overrides = {"db": db, "index": index, "embed": embed}
+    with _singleton_lock:
+        saved = dict(_backend_overrides), _query_embedding_cache, _search_result_cache
+        _backend_overrides.update({k: v for k, v in overrides.items() if v is not None})
+        _query_embedding_cache = _search_result_cache = None
+    try:
+        yield
+    finally:
+        with _singleton_lock:
+            _backend_overrides.clear()
+            _backend_overrides.update(saved[0])
+            _query_embedding_cache, _search_result_cache = saved[1], saved[2]
 
 
 def _product_text(product: Product) -> str:
@@ -173,76 +361,301 @@ def _product_text(product: Product) -> str:
     return f"Name: {product.name}\nDescription: {product.description}\nCategory: {product.category}\nTags: {tags_str}"
 
 
-def ensure_embeddings_for_all_products(batch_size: int = 32) -> int:
-    """Create embeddings for products missing in the embeddings collection.
-    Returns number of new embeddings created.
+def _product_metadata(product: Product) -> dict:
+    """Filterable fields stored next to each embedding."""
+    tags = product.tags if isinstance(product.tags, list) else []
+    return {
+        "category": product.category or None,
+        "price": float(product.price) if product.price is not None else None,
+        "tags": sorted({str(t).strip().lower() for t in tags if str(t).strip()}),
+    }
+
+
+def _content_hash(text: str, model: str) -> str:
+    """Fingerprint of the embedded text and model; a change means the vector is stale."""
+    return hashlib.sha1(f"{model}\n{text}".encode('utf-8')).hexdigest()
+
+
+# Fields read back from stored embeddings to decide what needs rewriting
+_STORED_PROJECTION = {"_id": 1, "content_hash": 1, "category": 1, "price": 1, "tags": 1}
+
+
+def _collect_stale(products, stored: dict, model: str) -> Tuple[List[tuple], List[Tuple[str, dict]]]:
+    """Split products into those needing a new embedding and metadata-only updates.
+
+    ``stored`` maps pk to its stored embedding document. Returns
+    ``(missing, meta_updates)`` where ``missing`` holds
+    (pk, text, content_hash, metadata) tuples and ``meta_updates`` holds
+    (pk, metadata) for products whose text is unchanged but whose filterable
+    fields (e.g. price) are not.
+    """
+    missing: List[tuple] = []
+    meta_updates: List[Tuple[str, dict]] = []
+    for p in products:
+        pk = str(p.pk)
+        product_text = _product_text(p)
+        content_hash = _content_hash(product_text, model)
+        meta = _product_metadata(p)
+        doc = stored.get(pk)
+        if doc is None:
+            missing.append((pk, product_text, content_hash, meta))
+            rag_logger.debug(f"Missing embedding for product {pk}: {p.name}")
+        elif doc.get("content_hash") != content_hash:
+            missing.append((pk, product_text, content_hash, meta))
+            rag_logger.debug(f"Stale embedding for product {pk}: {p.name}")
+        elif any(doc.get(field) != value for field, value in meta.items()):
+            meta_updates.append((pk, meta))
+    return missing, meta_updates
+
+
+def _write_concern() -> WriteConcern:
+    """Write concern for indexing writes, from RAG_INDEX_WRITE_CONCERN_W / _J."""
+    w = getattr(settings, 'RAG_INDEX_WRITE_CONCERN_W', '1')
+    w = int(w) if str(w).isdigit() else w
+    return WriteConcern(w=w, j=getattr(settings, 'RAG_INDEX_WRITE_CONCERN_J', False) or None)
+
+
+def _embeddings_for_writes(coll):
+    return coll.with_options(write_concern=_write_concern())
+
+
+def _bulk_write(coll, ops: list, pks: List[str], what: str) -> Tuple[int, dict]:
+    """Unordered bulk write of ``ops`` (one per pk in ``pks``).
+
+    Returns (number of operations applied, {pk: error message}) so one bad
+    document never sinks the rest of the batch.
+    """
+    if not ops:
+        return 0, {}
+    try:
+        coll.bulk_write(ops, ordered=False)
+        return len(ops), {}
+    except BulkWriteError as e:
+        errors = {pks[err["index"]]: f"{err.get('code')}: {err.get('errmsg')}" for err in e.details.get("writeErrors", [])}
+        for pk, message in errors.items():
+            rag_logger.error(f"Failed to write {what} for product {pk}: {message}")
+        return len(ops) - len(errors), errors
+
+
+def _store_metadata(coll, meta_updates: List[Tuple[str, dict]]) -> int:
+    """Rewrite filterable fields without re-embedding. Returns number updated."""
+    now = datetime.utcnow()
+    applied, _ = _bulk_write(
+        _embeddings_for_writes(coll),
+        [UpdateOne({"_id": pk}, {"$set": {**meta, "updated_at": now}}) for pk, meta in meta_updates],
+        [pk for pk, _ in meta_updates],
+        "embedding metadata",
+    )
+    if applied:
+        rag_logger.info(f"Updated metadata of {applied} embeddings")
+    return applied
+
+
+def _plan_batches(missing: List[tuple], max_tokens: int, max_items: int) -> List[List[tuple]]:
+    """Group ``missing`` into consecutive batches that fit a token budget and item cap."""
+    batches: List[List[tuple]] = []
+    batch: List[tuple] = []
+    tokens = 0
+    for item in missing:
+        cost = estimate_tokens(item[1])
+        if batch and (tokens + cost > max_tokens or len(batch) >= max_items):
+            batches.append(batch)
+            batch, tokens = [], 0
+        batch.append(item)
+        tokens += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _embed_with_retry(texts: List[str], max_retries: int, backoff: float,
+                      embed: Callable[[List[str]], List[List[float]]] = None) -> List[List[float]]:
+    """``embed`` (default ``_openrouter_embed``) with exponential backoff and jitter between attempts."""
+    embed = embed or _openrouter_embed
+    attempt = 0
+    while True:
+        try:
+            vectors = embed(texts)
+            if len(vectors) != len(texts):
+                raise RuntimeError(f"Expected {len(texts)} embeddings, got {len(vectors)}")
+            return vectors
+        except Exception as e:
+            if attempt >= max_retries:
+                raise
+            delay = min(backoff * 2 ** attempt, 60.0) * (0.5 + random.random())
+            rag_logger.warning(f"Embedding batch of {len(texts)} failed (attempt {attempt + 1}), retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+            attempt += 1
+
+
+def _store_batch(coll, batch: List[tuple], vectors: List[List[float]], model: str, storage: str) -> int:
+    """Upsert one batch of embeddings in a single unordered bulk write. Returns number saved."""
+    now = datetime.utcnow()
+    ops = [
+        ReplaceOne(
+            {"_id": pk},
+            {
+                "_id": pk,
+                **encode_embedding(vec, storage),
+                "content_hash": content_hash,
+                **meta,
+                "model": model,
+                "updated_at": now,
+            },
+            upsert=True,
+        )
+        for (pk, _, content_hash, meta), vec in zip(batch, vectors)
+    ]
+    saved, _ = _bulk_write(_embeddings_for_writes(coll), ops, [item[0] for item in batch], "embedding")
+    rag_logger.debug(f"Saved {saved}/{len(batch)} embeddings in one bulk write")
+    return saved
+
+
+def _embed_and_store(coll, missing: List[tuple], model: str, batch_size: int = None,
+                     on_progress: Callable[[str], None] = None,
+                     embed: Callable[[List[str]], List[List[float]]] = None,
+                     heartbeat: Callable[[], None] = None) -> int:
+    """Embed ``missing`` and upsert the vectors. Returns number saved.
+
+    Batches are sized to ``RAG_EMBED_BATCH_TOKENS`` (and at most
+    ``batch_size`` items) and up to ``RAG_EMBED_CONCURRENCY`` are in flight
+    at once. A failing batch is retried with backoff; if it still fails the
+    remaining batches carry on. ``on_progress`` receives the pk of the last
+    item of the longest fully saved prefix of ``missing``, as a checkpoint.
+    ``embed`` replaces the OpenRouter call (benchmarks pass a local stub).
+    ``heartbeat`` is called before the first and after every finished batch;
+    an exception it raises cancels the batches not yet started and propagates.
+    """
+    storage = getattr(settings, 'RAG_EMBEDDING_STORAGE', 'binary')
+    max_items = batch_size or getattr(settings, 'RAG_EMBED_BATCH_MAX_ITEMS', 256)
+    batches = _plan_batches(missing, getattr(settings, 'RAG_EMBED_BATCH_TOKENS', 16000), max_items)
+    max_retries = getattr(settings, 'RAG_EMBED_MAX_RETRIES', 4)
+    backoff = getattr(settings, 'RAG_EMBED_RETRY_BACKOFF_SECONDS', 1.0)
+    concurrency = max(1, getattr(settings, 'RAG_EMBED_CONCURRENCY', 4))
+    rag_logger.info(f"Embedding {len(missing)} products in {len(batches)} batches, concurrency={concurrency}")
+
+    def run(batch: List[tuple]) -> int:
+        vectors = _embed_with_retry([t for _, t, _, _ in batch], max_retries, backoff, embed)
+        saved = _store_batch(coll, batch, vectors, model, storage)
+        if saved < len(batch):
+            raise RuntimeError(f"Saved {saved} of {len(batch)} embeddings")
+        return saved
+
+    created = 0
+    done = [False] * len(batches)
+    next_checkpoint = 0
+    if heartbeat:
+        heartbeat()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed-backfill") as pool:
+        futures = {pool.submit(run, batch): i for i, batch in enumerate(batches)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                created += future.result()
+                done[i] = True
+            except Exception as e:
+                rag_logger.error(f"Embedding batch {i + 1}/{len(batches)} failed after retries: {e}")
+            else:
+                advanced = next_checkpoint
+                while next_checkpoint < len(batches) and done[next_checkpoint]:
+                    next_checkpoint += 1
+                if on_progress and next_checkpoint > advanced:
+                    on_progress(batches[next_checkpoint - 1][-1][0])
+                rag_logger.info(f"Embedded batch {i + 1}/{len(batches)}: {created}/{len(missing)} products saved")
+            if heartbeat:
+                try:
+                    heartbeat()
+                except Exception:
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+
+    return created
+
+
+# Collection holding the resumable checkpoint of the full-catalog backfill
+BACKFILL_COLLECTION = "embedding_backfill"
+_BACKFILL_ID = "all_products"
+
+
+def backfill_checkpoint() -> dict:
+    """The last backfill checkpoint, or {} if no backfill has run."""
+    return _get_mongo_db()[BACKFILL_COLLECTION].find_one({"_id": _BACKFILL_ID}) or {}
+
+
+def _save_checkpoint(**fields) -> None:
+    try:
+        _get_mongo_db()[BACKFILL_COLLECTION].update_one(
+            {"_id": _BACKFILL_ID},
+            {"$set": {**fields, "updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+    except Exception as e:
+        rag_logger.warning(f"Could not save backfill checkpoint: {e}")
+
+
+def ensure_embeddings_for_all_products(batch_size: int = None, heartbeat: Callable[[], None] = None) -> int:
+    """Create embeddings for products that are missing or stale in the embeddings collection.
+
+    An embedding is stale when the product text or the embedding model changed
+    since it was computed. Embeddings of deleted products are removed.
+    Products are processed in pk order and progress is checkpointed, so a run
+    that was interrupted or left failed batches resumes after the last fully
+    embedded pk instead of rescanning the catalog. ``heartbeat`` is passed to
+    ``_embed_and_store``.
+    Returns number of embeddings (re)created.
     """
     rag_logger.info(f"Starting ensure_embeddings_for_all_products with batch_size={batch_size}")
     
     try:
+        from bson import ObjectId
+
         db = _get_mongo_db()
         coll = db["product_embeddings"]
         rag_logger.info(f"Connected to embeddings collection: {coll.name}")
 
-        # Get total product count
-        total_products = Product.objects.count()
-        rag_logger.info(f"Total products in database: {total_products}")
-
-        # Collect products without embeddings
-        missing: List[Tuple[str, str]] = []  # (pk, text)
-        for p in Product.objects.all():
-            pk = str(p.pk)
-            existing = coll.find_one({"_id": pk})
-            if existing is None:
-                product_text = _product_text(p)
-                missing.append((pk, product_text))
-                rag_logger.debug(f"Missing embedding for product {pk}: {p.name}")
-            else:
-                rag_logger.debug(f"Embedding exists for product {pk}: {p.name}")
+        # One bulk read of every stored fingerprint instead of a lookup per product
+        model = getattr(settings, 'OPENROUTER_EMBEDDING_MODEL', 'openai/text-embedding-3-small')
+        stored = {str(doc["_id"]): doc for doc in coll.find({}, _STORED_PROJECTION)}
+
+        checkpoint = backfill_checkpoint()
+        resume_after = checkpoint.get("last_pk") if checkpoint.get("status") == "running" else None
+        products = Product.objects.order_by('_id')
+        if resume_after and ObjectId.is_valid(resume_after):
+            rag_logger.info(f"Resuming backfill after product {resume_after}")
+            products = products.filter(_id__gt=ObjectId(resume_after))
+        products = list(products)
+        rag_logger.info(f"Total products to scan: {len(products)}")
+        missing, meta_updates = _collect_stale(products, stored, model)
+        _store_metadata(coll, meta_updates)
+
+        # Orphans can only be identified by a scan of the whole catalog
+        if not resume_after:
+            product_pks = {str(p.pk) for p in products}
+            orphans = [pk for pk in stored if pk not in product_pks]
+            if orphans:
+                result = _embeddings_for_writes(coll).delete_many({"_id": {"$in": orphans}})
+                rag_logger.info(f"Removed {result.deleted_count} embeddings of deleted products")
 
-        rag_logger.info(f"Found {len(missing)} products without embeddings")
+        stale = sum(1 for pk, _, _, _ in missing if pk in stored)
+        rag_logger.info(f"Found {len(missing)} products needing embeddings ({stale} stale)")
 
         if not missing:
-            rag_logger.info("All products already have embeddings")
+            rag_logger.info("All products already have up-to-date embeddings")
+            _save_checkpoint(status="complete", last_pk=None)
             return 0
 
-        created = 0
-        i = 0
-        while i < len(missing):
-            chunk = missing[i : i + batch_size]
-            texts = [t for _, t in chunk]
-            pks = [pk for pk, _ in chunk]
-            
-            rag_logger.info(f"Processing batch {i//batch_size + 1}: {len(chunk)} products")
-            rag_logger.debug(f"Batch product IDs: {pks}")
-            
-            try:
-                vectors = _openrouter_embed(texts)
-                rag_logger.info(f"Got {len(vectors)} embeddings from OpenRouter")
-                
-                if len(vectors) != len(chunk):
-                    rag_logger.error(f"Mismatch: expected {len(chunk)} embeddings, got {len(vectors)}")
-                    break
-                    
-            except Exception as e:
-                rag_logger.error(f"Embedding batch failed: {e}")
-                break
-                
-            now = datetime.utcnow()
-            for (pk, _), vec in zip(chunk, vectors):
-                try:
-                    result = coll.replace_one(
-                        {"_id": pk},
-                        {"_id": pk, "embedding": vec, "updated_at": now},
-                        upsert=True,
-                    )
-                    rag_logger.debug(f"Saved embedding for product {pk}: matched={result.matched_count}, modified={result.modified_count}, upserted={result.upserted_id}")
-                    created += 1
-                except Exception as e:
-                    rag_logger.error(f"Failed to save embedding for product {pk}: {e}")
-                    
-            i += batch_size
-            
+        _save_checkpoint(status="running", last_pk=resume_after, total=len(missing), started_at=datetime.utcnow())
+        created = _embed_and_store(
+            coll, missing, model, batch_size,
+            on_progress=lambda pk: _save_checkpoint(last_pk=pk),
+            heartbeat=heartbeat,
+        )
+        if created == len(missing):
+            _save_checkpoint(status="complete", last_pk=None, embedded=created)
+        else:
+            _save_checkpoint(embedded=created, failed=len(missing) - created)
+            rag_logger.warning(f"Backfill left {len(missing) - created} products unembedded; the next run resumes at the checkpoint")
         rag_logger.info(f"Completed embedding creation: {created} new embeddings created")
         return created
         
@@ -251,6 +664,34 @@ def ensure_embeddings_for_all_products(batch_size: int = 32) -> int:
         raise
 
 
+def ensure_embeddings_for_products(pks: List[str], batch_size: int = None,
+                                   heartbeat: Callable[[], None] = None) -> int:
+    """Create or refresh embeddings for the given product pks only.
+
+    Raises RuntimeError if some embeddings could not be saved, so callers
+    holding queued work can retry it.
+    """
+    from bson import ObjectId
+
+    db = _get_mongo_db()
+    coll = db["product_embeddings"]
+    model = getattr(settings, 'OPENROUTER_EMBEDDING_MODEL', 'openai/text-embedding-3-small')
+
+    object_ids = [ObjectId(pk) for pk in pks if ObjectId.is_valid(pk)]
+    products = list(Product.objects.filter(_id__in=object_ids))
+    stored = {str(doc["_id"]): doc for doc in coll.find({"_id": {"$in": list(pks)}}, _STORED_PROJECTION)}
+    missing, meta_updates = _collect_stale(products, stored, model)
+    _store_metadata(coll, meta_updates)
+    if not missing:
+        return 0
+
+    created = _embed_and_store(coll, missing, model, batch_size, heartbeat=heartbeat)
+    if created < len(missing):
+        raise RuntimeError(f"Saved {created} of {len(missing)} embeddings")
+    rag_logger.info(f"Refreshed {created} embeddings for {len(pks)} queued products")
+    return created
+
+
 def _cosine_sim_matrix(A: np.ndarray, b: np.ndarray) -> np.ndarray:
     # A: (n, d), b: (d,)
     A_norm = A / (np.linalg.norm(A, axis=1, keepdims=True) + 1e-8)
@@ -258,9 +699,22 @@ def _cosine_sim_matrix(A: np.ndarray, b: np.ndarray) -> np.ndarray:
     return A_norm @ b_norm
 
 
-def semantic_search(query: str, top_k: int = 8) -> List[str]:
-    """Return product PKs (as strings) most similar to the query."""
-    rag_logger.info(f"Starting semantic_search: query='{query}', top_k={top_k}")
+def _search_filters(category: str = None, min_price: float = None, max_price: float = None,
+                    tags: List[str] = None) -> dict:
+    filters = {"category": category, "min_price": min_price, "max_price": max_price, "tags": tags}
+    return {k: v for k, v in filters.items() if v not in (None, "", [])}
+
+
+def semantic_search(query: str, top_k: int = 8, category: str = None, min_price: float = None,
+                    max_price: float = None, tags: List[str] = None) -> List[str]:
+    """Return product PKs (as strings) most similar to the query.
+
+    ``category``, ``min_price``, ``max_price`` and ``tags`` (all must match)
+    restrict the candidates before ranking, so top_k results are returned
+    whenever that many products match the filters.
+    """
+    filters = _search_filters(category, min_price, max_price, tags)
+    rag_logger.info(f"Starting semantic_search: query='{query}', top_k={top_k}, filters={filters}")
     
     if not query:
         rag_logger.warning("Empty query provided to semantic_search")
@@ -271,54 +725,94 @@ def semantic_search(query: str, top_k: int = 8) -> List[str]:
         coll = db["product_embeddings"]
         rag_logger.info(f"Connected to embeddings collection for search")
 
-        # Ensure all products have embeddings
-        try:
-            created = ensure_embeddings_for_all_products()
-            rag_logger.info(f"Ensured embeddings: {created} new embeddings created")
-        except Exception as e:
-            rag_logger.warning(f"Could not ensure all embeddings: {e}")
+        # Embeddings are maintained by the background indexer (api.indexer); a
+        # search only brings the resident index up to date with what is stored
+        index = get_embedding_index()
+        index.refresh(coll)
+        rag_logger.info(f"Embedding index ready: {len(index)} rows, dim={index.dim}, version={index.version}")
 
-        # Load all embeddings
-        docs = list(coll.find({}, {"_id": 1, "embedding": 1}))
-        rag_logger.info(f"Loaded {len(docs)} embeddings from database")
-        
-        if not docs:
-            rag_logger.warning("No embeddings found in database")
-            return []
+        if not len(index):
+            rag_logger.warning("No embeddings found in database, using local text index")
+            return _local_search(query, top_k, filters)
 
         # Compute query embedding
         try:
             rag_logger.info(f"Computing embedding for query: '{query}'")
-            embeddings = _openrouter_embed([query])
-            if not embeddings:
-                rag_logger.error("OpenRouter returned empty embeddings for query")
-                return []
-            q_vec = embeddings[0]
+            q_vec = embed_query(query)
             rag_logger.info(f"Got query embedding vector of length {len(q_vec)}")
         except Exception as e:
-            rag_logger.error(f"Query embedding failed: {e}")
-            return []
+            rag_logger.error(f"Query embedding failed, using local text index: {e}")
+            return _local_search(query, top_k, filters)
 
-        # Prepare embedding matrix
+        # Rank against the pre-normalized matrix
         try:
-            A = np.array([d["embedding"] for d in docs], dtype=np.float32)
-            rag_logger.info(f"Created embedding matrix: shape={A.shape}")
-            
-            scores = _cosine_sim_matrix(A, np.array(q_vec, dtype=np.float32))
-            rag_logger.info(f"Computed similarity scores: shape={scores.shape}, min={scores.min():.4f}, max={scores.max():.4f}")
-
-            # Rank and select top_k
-            idxs = np.argsort(-scores)[:top_k]
-            pks = [str(docs[int(i)]["_id"]) for i in idxs]
-            scores_top = [float(scores[i]) for i in idxs]
-            
+            pks, scores_top = index.search(np.array(q_vec, dtype=np.float32), top_k, filters=filters)
             rag_logger.info(f"Top {len(pks)} results: {list(zip(pks, scores_top))}")
             return pks
-            
+
         except Exception as e:
             rag_logger.error(f"Error in similarity computation: {e}")
             return []
-            
+
     except Exception as e:
         rag_logger.error(f"Error in semantic_search: {e}")
         return []
+
+
+def semantic_search_many(queries: List[str], top_k: int = 8) -> List[Tuple[List[str], List[float]]]:
+    """Batched semantic_search returning one (pks, scores) pair per query.
+
+    Queries are embedded in a single provider call and scored with one matmul
+    against the resident index.
+    """
+    rag_logger.info(f"Starting semantic_search_many: {len(queries)} queries, top_k={top_k}")
+    results: List[Tuple[List[str], List[float]]] = [([], []) for _ in queries]
+    live = [i for i, q in enumerate(queries) if q]
+    if not live:
+        return results
+
+    def local_results():
+        _search_state.degraded = True
+        index = get_local_text_index()
+        for i in live:
+            results[i] = index.search(queries[i], top_k)
+        return results
+
+    try:
+        index = get_embedding_index()
+        index.refresh(_get_mongo_db()["product_embeddings"])
+        if not len(index):
+            rag_logger.warning("No embeddings found in database, using local text index")
+            return local_results()
+
+        try:
+            q_vecs = embed_queries([queries[i] for i in live])
+        except Exception as e:
+            rag_logger.error(f"Query embedding failed, using local text index: {e}")
+            return local_results()
+
+        for i, result in zip(live, index.search_many(np.array(q_vecs, dtype=np.float32), top_k)):
+            results[i] = result
+        return results
+
+    except Exception as e:
+        rag_logger.error(f"Error in semantic_search_many: {e}")
+        return results
+
+
+def hybrid_search(query: str, top_k: int = 8, category: str = None, min_price: float = None,
+                  max_price: float = None, tags: List[str] = None) -> List[str]:
+    """Fuse BM25 and vector rankings with reciprocal rank fusion.
+
+    Exact terms such as SKUs or colours rank highly through BM25, paraphrases
+    through the vector index; products found by both rise to the top.
+    """
+    if not query:
+        return []
+    filters = _search_filters(category, min_price, max_price, tags)
+    depth = max(top_k * 4, getattr(settings, 'RAG_HYBRID_CANDIDATES', 50))
+    keyword_pks, _ = keyword_search(query, top_k=depth, **filters)
+    vector_pks = semantic_search(query, top_k=depth, **filters)
+    fused = reciprocal_rank_fusion([keyword_pks, vector_pks], k=getattr(settings, 'RAG_HYBRID_RRF_K', 60))
+    rag_logger.info(f"Hybrid search '{query}': {len(keyword_pks)} keyword, {len(vector_pks)} vector, {len(fused)} fused")
+    return fused[:top_k]
@@ -68,6 +68,7 @@ class AIRecommendationRequest(serializers.Serializer):
         required=False,
         default=list
     )
+    stream = serializers.BooleanField(required=False, default=False)
 
 class AIRecommendationResponse(serializers.Serializer):
     response = serializers.CharField()
@@ -2,13 +2,17 @@ import openai
 from django.conf import settings
 from .models import Product
 import logging
+import os
 import random
-import re
-import requests
-import json
+import threading
 import time
-from urllib.parse import urlparse
-from .rag import semantic_search
+from .hedged_llm import InvalidReply, get_hedged_client
+from .key_pool import OPENROUTER_BASE_URL, KeyPoolExhausted, get_key_pool
+from .openrouter_health import get_health_monitor
+from .prompt_context import build_product_context
+from .streaming import RecommendationStreamParser, iter_chat_deltas, parse_recommendation
+from .cache import price_key
+from .rag import embed_query, get_response_cache, hybrid_search, keyword_search, semantic_search
 
 logger = logging.getLogger(__name__)
 
@@ -40,23 +44,56 @@ if not openrouter_logger.handlers:
     handler.setFormatter(formatter)
     openrouter_logger.addHandler(handler)
 
+def _parse_chat_response(response):
+    """Chat completion JSON; a body without a message counts as a failed key."""
+    data = response.json()
+    data['choices'][0]['message']['content']
+    return data
+
+
+def _validate_recommendation(data):
+    """(response JSON, recommendation) for a hedged attempt.
+
+    A reply without the JSON object still ends the race as (response JSON, None),
+    like the non-hedged path, without counting against the key.
+    """
+    result = parse_recommendation(data['choices'][0]['message']['content'].strip())
+    if result is None:
+        raise InvalidReply("reply has no recommendation JSON", value=(data, None))
+    return data, result
+
+
+def _current_prices(pks):
+    """price_key of each existing product in ``pks``."""
+    from bson import ObjectId
+    try:
+        products = Product.objects.filter(_id__in=[ObjectId(pk) for pk in pks])
+    except Exception as e:
+        ai_logger.warning(f"Could not load prices for cached recommendation: {e}")
+        return {}
+    return {str(p.pk): price_key(p.price) for p in products}
+
+
+def _prices_unchanged(prices):
+    """Whether every product of a cached reply still exists at the cached price."""
+    return not prices or _current_prices(list(prices)) == prices
+
+
 class AIRecommendationService:
+    """Long-lived recommendation service; use ``get_recommendation_service()``.
+
+    Reachability and model availability come from the background health
+    monitor, so a chat turn costs a single upstream LLM call.
+    """
+
     def __init__(self):
         # Configure for OpenRouter API with token rotation
         self.openrouter_model = getattr(settings, 'OPENROUTER_MODEL', 'deepseek/deepseek-r1:free')
-        self.openrouter_base_url = "https://openrouter.ai/api/v1"
-        
-        # Load all available OpenRouter API keys for rotation
-        self.openrouter_api_keys = []
-        for i in range(1, 11):  # Keys 1-10
-            key = getattr(settings, f'OPENROUTER_API_KEY_{i}', None)
-            if key:
-                self.openrouter_api_keys.append(key)
+        self.openrouter_base_url = getattr(settings, 'OPENROUTER_BASE_URL', OPENROUTER_BASE_URL)
         
-        # Also include the main key if present
-        main_key = getattr(settings, 'OPENROUTER_API_KEY', None)
-        if main_key and main_key not in self.openrouter_api_keys:
-            self.openrouter_api_keys.insert(0, main_key)
+        # API keys are scheduled by health in a pool shared with embedding calls
+        self.key_pool = get_key_pool()
+        self.openrouter_api_keys = self.key_pool.keys
         
         if self.openrouter_api_keys:
             openrouter_logger.info(f"🔧 OpenRouter configured with {len(self.openrouter_api_keys)} API keys and model: {self.openrouter_model}")
@@ -67,74 +104,233 @@ class AIRecommendationService:
                 openrouter_logger.info(f"🔑 API Key {i}: {masked_key}")
             self.client = "openrouter"  # Flag to indicate OpenRouter is available
             
-            # Test network connectivity to OpenRouter
-            self._test_openrouter_connectivity()
+            # Reachability and the model list are probed off the request path
+            self.health = get_health_monitor()
         else:
             openrouter_logger.error("❌ No OpenRouter API keys found in settings!")
             self.client = None
+            self.health = None
     
     def get_recommendation(self, user_message, conversation_history=None):
         """
         Get AI-powered product recommendations
         """
         if self.client == "openrouter":
-            return self._get_openrouter_recommendation(user_message, conversation_history)
+            query_vec, cached = self._cached_reply(user_message, conversation_history)
+            if cached is not None:
+                return cached
+            result = self._ask_openrouter(user_message, conversation_history)
+            if result is None:
+                return self._get_fallback_recommendation(user_message)
+            self._cache_reply(query_vec, user_message, result)
+            return result
         else:
             return self._get_fallback_recommendation(user_message)
     
-    def _get_openrouter_recommendation(self, user_message, conversation_history):
+    def _cached_reply(self, user_message, conversation_history):
         """
-        Get recommendations using OpenRouter API
+        (query embedding, cached reply) for a first-turn message.
+
+        Openers without history are answered from the semantic response cache
+        when a similar one was answered before; follow-ups depend on the
+        conversation and always go to the LLM. Returns (None, None) when the
+        cache does not apply.
+        """
+        if conversation_history or not getattr(settings, 'RAG_RESPONSE_CACHE', True):
+            return None, None
+        try:
+            query_vec = embed_query(user_message)
+        except Exception as e:
+            ai_logger.warning(f"Response cache skipped, query embedding failed: {e}")
+            return None, None
+        return query_vec, get_response_cache().get(query_vec, is_fresh=_prices_unchanged)
+    
+    def _cache_reply(self, query_vec, user_message, result):
+        if query_vec is not None:
+            get_response_cache().set(query_vec, user_message, result, _current_prices(result['products']))
+    
+    def _ask_openrouter(self, user_message, conversation_history):
+        """
+        Recommendation from the OpenRouter LLM, or None when it is unavailable
+        or its reply is unusable
         """
         ai_logger.info(f"Starting OpenRouter recommendation for message: '{user_message}'")
         
+        if not self.health.usable(self.openrouter_model):
+            openrouter_logger.warning(f"⚠️ Skipping LLM call, last health check: {self.health.snapshot(self.openrouter_model)}")
+            return None
+        
         try:
-            # RAG: retrieve most relevant products for the user_message
-            ai_logger.info(f"Starting RAG semantic search for: '{user_message}'")
-            top_ids = semantic_search(user_message, top_k=12)
-            ai_logger.info(f"RAG semantic search returned {len(top_ids)} product IDs: {top_ids}")
+            messages, context = self._build_messages(user_message, conversation_history)
             
-            if top_ids:
-                # Convert string IDs to ObjectId for MongoDB querying
-                from bson import ObjectId
-                try:
-                    object_ids = [ObjectId(pid) for pid in top_ids if pid]
-                    retrieved = list(Product.objects.filter(_id__in=object_ids))
-                    ai_logger.info(f"Retrieved {len(retrieved)} products from database using {len(object_ids)} RAG ObjectIDs")
-                except Exception as e:
-                    ai_logger.error(f"Error converting RAG IDs to ObjectId: {e}")
-                    retrieved = list(Product.objects.all()[:20])
-                    ai_logger.warning(f"ObjectId conversion failed, using fallback: first 20 products")
-            else:
-                retrieved = list(Product.objects.all()[:20])
-                ai_logger.warning(f"RAG returned no results, using fallback: first 20 products")
+            # The shared key pool tries the healthiest key first and fails over
+            payload = {
+                "model": self.openrouter_model,
+                "messages": messages,
+                "max_tokens": 500,
+                "temperature": 0.7
+            }
+            
+            openrouter_logger.info(f"🚀 Attempting OpenRouter request with {len(self.openrouter_api_keys)} available tokens")
+            import json as json_module
+            openrouter_logger.debug(f"📝 Request payload: {json_module.dumps(payload, indent=2)[:500]}...")
             
-            product_context = []
-            for product in retrieved:
-                try:
-                    price_value = float(str(product.price))
-                except (ValueError, TypeError):
-                    price_value = 0.0
-                    ai_logger.warning(f"Failed to parse price for product {product.pk}: {product.price}")
+            try:
+                start_time = time.time()
+                result = None
+                if getattr(settings, 'OPENROUTER_HEDGING', True):
+                    # Slow attempts are raced against another key or model
+                    response_data, result = get_hedged_client().complete(payload, validate=_validate_recommendation)
+                else:
+                    response_data = self.key_pool.post("/chat/completions", payload, timeout=30, parse=_parse_chat_response)
+                response_content = response_data['choices'][0]['message']['content'].strip()
+                openrouter_logger.info(f"✅ SUCCESS in {time.time() - start_time:.2f}s! Response length: {len(response_content)} chars")
+                openrouter_logger.debug(f"📄 AI response preview: {response_content[:200]}...")
                 
-                product_data = {
-                    'id': str(product.pk),  # Use string IDs for MongoDB
-                    'name': product.name,
-                    'description': product.description,
-                    'price': price_value,
-                    'category': product.category,
-                    'tags': product.tags,
-                }
-                product_context.append(product_data)
-                ai_logger.debug(f"Added product to context: {product.pk} - {product.name}")
+                # Log usage info if available
+                if 'usage' in response_data:
+                    usage = response_data['usage']
+                    openrouter_logger.info(f"📊 Token usage - Prompt: {usage.get('prompt_tokens', 'N/A')}, Completion: {usage.get('completion_tokens', 'N/A')}, Total: {usage.get('total_tokens', 'N/A')}")
+            except KeyPoolExhausted as e:
+                openrouter_logger.error(f"💀 ALL TOKENS FAILED - falling back to keyword matching: {e}")
+                openrouter_logger.debug(f"🔑 Key health: {self.key_pool.stats()}")
+                self.health.request_check()
+                return None
             
-            ai_logger.info(f"Built product context with {len(product_context)} products")
+            # Try to extract JSON from the response
+            if result is None:
+                result = parse_recommendation(response_content)
+            if result is not None:
+                result['products'] = context.resolve(result['products'])
+                return result
+            
+            # Fallback if JSON parsing fails
+            return None
             
-            # Build conversation context
-            messages = [
-                {
-                    "role": "system",
-                    "content": f"""You are an expert AI shopping consultant for a premium e-commerce platform. Your mission is to understand customer needs and recommend products that perfectly match their specific requirements, budget, and shopping intent.
+        except Exception as e:
+            openrouter_logger.error(f"💥 Unexpected error in OpenRouter recommendation: {str(e)}")
+            openrouter_logger.error(f"🔍 Error type: {type(e).__name__}")
+            import traceback
+            openrouter_logger.error(f"📚 Full traceback: {traceback.format_exc()}")
+            return None
+    
+    def stream_recommendation(self, user_message, conversation_history=None):
+        """
+        Streamed variant of get_recommendation.
+
+        Yields ("delta", text) as reply text arrives, ("product", pk) as soon as
+        each id in the products array is complete, then ("done", result) with
+        the same dict get_recommendation returns.
+        """
+        if self.client != "openrouter":
+            yield from self._stream_result(self._get_fallback_recommendation(user_message))
+            return
+        query_vec, cached = self._cached_reply(user_message, conversation_history)
+        if cached is not None:
+            yield from self._stream_result(cached)
+            return
+        if not self.health.usable(self.openrouter_model):
+            yield from self._stream_result(self._get_fallback_recommendation(user_message))
+            return
+        
+        parser = RecommendationStreamParser()
+        sent = []
+        response = None
+        try:
+            messages, context = self._build_messages(user_message, conversation_history)
+            payload = {
+                "model": self.openrouter_model,
+                "messages": messages,
+                "max_tokens": 500,
+                "temperature": 0.7,
+                "stream": True
+            }
+            start_time = time.time()
+            response = self.key_pool.post("/chat/completions", payload, timeout=30, stream=True)
+            first_token = None
+            for delta in iter_chat_deltas(response):
+                if first_token is None:
+                    first_token = time.time() - start_time
+                text, products = parser.feed(delta)
+                if text:
+                    yield "delta", text
+                for pk in context.resolve(products):
+                    if pk not in sent:
+                        sent.append(pk)
+                        yield "product", pk
+            openrouter_logger.info(f"✅ Stream finished in {time.time() - start_time:.2f}s (first token {first_token or 0:.2f}s), {len(parser.buffer)} chars")
+        except KeyPoolExhausted as e:
+            openrouter_logger.error(f"💀 ALL TOKENS FAILED - falling back to keyword matching: {e}")
+            self.health.request_check()
+        except Exception as e:
+            openrouter_logger.error(f"💥 Error while streaming OpenRouter recommendation: {type(e).__name__}: {e}")
+        finally:
+            if response is not None:
+                response.close()
+        
+        result = parser.result()
+        if result is None:
+            # Nothing usable was streamed, so the fallback can still be shown whole
+            yield from self._stream_result(self._get_fallback_recommendation(user_message))
+            return
+        result['products'] = context.resolve(result['products'])
+        if parse_recommendation(parser.buffer) is not None:
+            # Only complete replies are reused, not text salvaged from a broken stream
+            self._cache_reply(query_vec, user_message, result)
+        if not parser.text and result['response']:
+            yield "delta", result['response']
+        for pk in result['products']:
+            if pk not in sent:
+                yield "product", pk
+        yield "done", result
+    
+    def _stream_result(self, result):
+        yield "delta", result['response']
+        for pk in result['products']:
+            yield "product", pk
+        yield "done", result
+    
+    def _build_messages(self, user_message, conversation_history):
+        """Chat messages for a turn plus the ProductContext that maps the model's short product ids to pks.
+
+        The system prompt lists RAG-retrieved products in a token-budgeted table,
+        followed by the history and the user message.
+        """
+        # RAG: retrieve most relevant products for the user_message
+        ai_logger.info(f"Starting RAG semantic search for: '{user_message}'")
+        top_ids = semantic_search(user_message, top_k=12)
+        ai_logger.info(f"RAG semantic search returned {len(top_ids)} product IDs: {top_ids}")
+        
+        if top_ids:
+            # Convert string IDs to ObjectId for MongoDB querying
+            from bson import ObjectId
+            try:
+                object_ids = [ObjectId(pid) for pid in top_ids if pid]
+                retrieved = list(Product.objects.filter(_id__in=object_ids))
+                # Keep retrieval order so budget trimming drops the least relevant products
+                rank = {pid: i for i, pid in enumerate(top_ids)}
+                retrieved.sort(key=lambda p: rank.get(str(p.pk), len(rank)))
+                ai_logger.info(f"Retrieved {len(retrieved)} products from database using {len(object_ids)} RAG ObjectIDs")
+            except Exception as e:
+                ai_logger.error(f"Error converting RAG IDs to ObjectId: {e}")
+                retrieved = list(Product.objects.all()[:20])
+                ai_logger.warning(f"ObjectId conversion failed, using fallback: first 20 products")
+        else:
+            retrieved = list(Product.objects.all()[:20])
+            ai_logger.warning(f"RAG returned no results, using fallback: first 20 products")
+        
+        context = build_product_context(
+            retrieved,
+            max_tokens=getattr(settings, 'RAG_PROMPT_CONTEXT_TOKENS', 800),
+            max_description_chars=getattr(settings, 'RAG_PROMPT_DESCRIPTION_CHARS', 160),
+        )
+        ai_logger.info(f"Built product context with {len(context.ids)} of {len(retrieved)} products (~{context.tokens} tokens)")
+        
+        # Build conversation context
+        messages = [
+            {
+                "role": "system",
+                "content": f"""You are an expert AI shopping consultant for a premium e-commerce platform. Your mission is to understand customer needs and recommend products that perfectly match their specific requirements, budget, and shopping intent.
 
 **CONVERSATION CONTEXT TRACKING:**
 - ALWAYS pay attention to previous conversation history to understand context
@@ -144,7 +340,8 @@ class AIRecommendationService:
 - Track user preferences and constraints mentioned earlier in the conversation
 
 **AVAILABLE PRODUCT INVENTORY:**
-{product_context}
+(one product per line; use the id column in "products")
+{context.text}
 
 **CONVERSATION CONTINUITY RULES:**
 1. **Context Memory**: Remember what the user was previously looking at (category, type, price range)
@@ -179,7 +376,7 @@ class AIRecommendationService:
 ```json
 {{
     "response": "Based on [previous context + current request], I recommend these perfectly matched options: [brief explanation of why these specific products solve their problem]",
-    "products": ["product_id_1", "product_id_2"]
+    "products": ["P1", "P2"]
 }}
 ```
 
@@ -195,225 +392,45 @@ Follow-up: "different color"
 Response: "Since you're looking at T-shirts, here are other color options: [T-shirt in different colors]"
 
 **Remember**: You're a trusted advisor with perfect memory. Always consider the conversation flow and maintain context continuity."""
-                }
-            ]
-            
-            # Add conversation history
-            if conversation_history:
-                for msg in conversation_history[-6:]:  # Last 6 messages for context
-                    messages.append({
-                        "role": "user" if msg.get('type') == 'user' else "assistant",
-                        "content": msg.get('content', '')
-                    })
-            
-            # Add current message
-            messages.append({
-                "role": "user",
-                "content": user_message
-            })
-            
-            # Try each API key until one works (token rotation)
-            payload = {
-                "model": self.openrouter_model,
-                "messages": messages,
-                "max_tokens": 500,
-                "temperature": 0.7
             }
-            
-            openrouter_logger.info(f"🚀 Attempting OpenRouter request with {len(self.openrouter_api_keys)} available tokens")
-            import json as json_module
-            openrouter_logger.debug(f"📝 Request payload: {json_module.dumps(payload, indent=2)[:500]}...")
-            
-            # Log network connectivity check
-            self._check_network_connectivity()
-            
-            for i, api_key in enumerate(self.openrouter_api_keys, 1):
-                try:
-                    headers = {
-                        "Authorization": f"Bearer {api_key}",
-                        "Content-Type": "application/json",
-                        "HTTP-Referer": "http://localhost",
-                        "X-Title": "SellerAgent E-commerce"
-                    }
-                    
-                    masked_key = f"{api_key[:8]}...{api_key[-4:]}" if len(api_key) > 12 else "[INVALID_KEY]"
-                    openrouter_logger.info(f"🔑 Trying token {i}/{len(self.openrouter_api_keys)}: {masked_key}")
-                    import json as json_module
-                    openrouter_logger.debug(f"📋 Request headers: {json_module.dumps({k: v if k != 'Authorization' else f'Bearer {masked_key}' for k, v in headers.items()}, indent=2)}")
-                    
-                    # Log request timing
-                    start_time = time.time()
-                    openrouter_logger.info(f"⏱️ Starting request to {self.openrouter_base_url}/chat/completions at {time.strftime('%H:%M:%S')}")
-                    
-                    response = requests.post(
-                        f"{self.openrouter_base_url}/chat/completions",
-                        headers=headers,
-                        json=payload,
-                        timeout=30
-                    )
-                    
-                    request_duration = time.time() - start_time
-                    openrouter_logger.info(f"⏱️ Request completed in {request_duration:.2f}s with status: {response.status_code}")
-                    
-                    # Log response headers for debugging
-                    openrouter_logger.debug(f"📥 Response headers: {dict(response.headers)}")
-                    
-                    if response.status_code == 200:
-                        response_data = response.json()
-                        response_content = response_data['choices'][0]['message']['content'].strip()
-                        openrouter_logger.info(f"✅ SUCCESS with token {i}! Response length: {len(response_content)} chars")
-                        openrouter_logger.debug(f"📄 AI response preview: {response_content[:200]}...")
-                        
-                        # Log usage info if available
-                        if 'usage' in response_data:
-                            usage = response_data['usage']
-                            openrouter_logger.info(f"📊 Token usage - Prompt: {usage.get('prompt_tokens', 'N/A')}, Completion: {usage.get('completion_tokens', 'N/A')}, Total: {usage.get('total_tokens', 'N/A')}")
-                        
-                        break  # Success! Use this response
-                    else:
-                        error_text = response.text[:500] if response.text else 'No error text'
-                        openrouter_logger.warning(f"❌ Token {i} failed: HTTP {response.status_code}")
-                        openrouter_logger.warning(f"❌ Error response: {error_text}")
-                        
-                        # Log specific error types
-                        if response.status_code == 401:
-                            openrouter_logger.error(f"🔐 Authentication failed for token {i} - API key may be invalid")
-                        elif response.status_code == 429:
-                            openrouter_logger.error(f"⏳ Rate limit exceeded for token {i}")
-                        elif response.status_code == 403:
-                            openrouter_logger.error(f"🚫 Forbidden - token {i} may not have access to model {self.openrouter_model}")
-                        elif response.status_code >= 500:
-                            openrouter_logger.error(f"🔥 Server error {response.status_code} - OpenRouter may be experiencing issues")
-                        
-                        continue  # Try next token
-                        
-                except requests.exceptions.Timeout as e:
-                    openrouter_logger.error(f"⏰ Token {i} timeout after 30s: {str(e)}")
-                    continue
-                except requests.exceptions.ConnectionError as e:
-                    openrouter_logger.error(f"🌐 Token {i} connection error: {str(e)}")
-                    continue
-                except requests.exceptions.RequestException as e:
-                    openrouter_logger.error(f"📡 Token {i} request exception: {str(e)}")
-                    continue
-                except Exception as e:
-                    openrouter_logger.error(f"💥 Token {i} unexpected exception: {str(e)}")
-                    continue
-            
-            else:
-                # All tokens failed
-                openrouter_logger.error(f"💀 ALL {len(self.openrouter_api_keys)} TOKENS FAILED - falling back to keyword matching")
-                openrouter_logger.error(f"🔍 Troubleshooting suggestions:")
-                openrouter_logger.error(f"   1. Check API key validity at https://openrouter.ai/keys")
-                openrouter_logger.error(f"   2. Verify model '{self.openrouter_model}' is available")
-                openrouter_logger.error(f"   3. Check network connectivity to {self.openrouter_base_url}")
-                openrouter_logger.error(f"   4. Review rate limits and billing status")
-                return self._get_fallback_recommendation(user_message)
-            
-            # Try to extract JSON from the response
-            import json
-            try:
-                # Look for JSON in the response
-                json_match = re.search(r'\{.*\}', response_content, re.DOTALL)
-                if json_match:
-                    result = json.loads(json_match.group())
-                    return {
-                        'response': result.get('response', response_content),
-                        'products': result.get('products', [])
-                    }
-            except json.JSONDecodeError:
-                pass
-            
-            # Fallback if JSON parsing fails
-            return self._get_fallback_recommendation(user_message)
-            
-        except Exception as e:
-            openrouter_logger.error(f"💥 Unexpected error in OpenRouter recommendation: {str(e)}")
-            openrouter_logger.error(f"🔍 Error type: {type(e).__name__}")
-            import traceback
-            openrouter_logger.error(f"📚 Full traceback: {traceback.format_exc()}")
-            return self._get_fallback_recommendation(user_message)
-    
-    def _test_openrouter_connectivity(self):
-        """Test basic connectivity to OpenRouter API"""
-        try:
-            openrouter_logger.info("🔍 Testing OpenRouter connectivity...")
-            response = requests.get(f"{self.openrouter_base_url}/models", timeout=10)
-            if response.status_code == 200:
-                openrouter_logger.info("✅ OpenRouter API is reachable")
-                # Log available models if possible
-                try:
-                    models_data = response.json()
-                    if 'data' in models_data:
-                        model_count = len(models_data['data'])
-                        openrouter_logger.info(f"📋 Found {model_count} available models")
-                        # Check if our configured model is available
-                        available_models = [m.get('id', '') for m in models_data['data']]
-                        if self.openrouter_model in available_models:
-                            openrouter_logger.info(f"✅ Configured model '{self.openrouter_model}' is available")
-                        else:
-                            openrouter_logger.warning(f"⚠️ Configured model '{self.openrouter_model}' not found in available models")
-                            openrouter_logger.debug(f"📋 Available models: {available_models[:10]}...")  # Log first 10
-                except Exception as e:
-                    openrouter_logger.warning(f"⚠️ Could not parse models response: {e}")
-            else:
-                openrouter_logger.warning(f"⚠️ OpenRouter API returned {response.status_code}: {response.text[:200]}")
-        except requests.exceptions.Timeout:
-            openrouter_logger.error("⏰ Timeout connecting to OpenRouter API")
-        except requests.exceptions.ConnectionError as e:
-            openrouter_logger.error(f"🌐 Connection error to OpenRouter API: {e}")
-        except Exception as e:
-            openrouter_logger.error(f"💥 Unexpected error testing OpenRouter connectivity: {e}")
+        ]
+        
+        # Add conversation history
+        if conversation_history:
+            for msg in conversation_history[-6:]:  # Last 6 messages for context
+                messages.append({
+                    "role": "user" if msg.get('type') == 'user' else "assistant",
+                    "content": msg.get('content', '')
+                })
+        
+        # Add current message
+        messages.append({
+            "role": "user",
+            "content": user_message
+        })
+        
+        return messages, context
     
-    def _check_network_connectivity(self):
-        """Check general network connectivity before making requests"""
-        try:
-            # Parse the OpenRouter URL to get the domain
-            parsed_url = urlparse(self.openrouter_base_url)
-            domain = parsed_url.netloc
-            
-            openrouter_logger.debug(f"🌐 Checking network connectivity to {domain}...")
-            
-            # Simple connectivity test
-            response = requests.head(f"https://{domain}", timeout=5)
-            openrouter_logger.debug(f"✅ Network connectivity to {domain} confirmed (status: {response.status_code})")
-            
-        except requests.exceptions.Timeout:
-            openrouter_logger.warning(f"⏰ Network timeout to {domain}")
-        except requests.exceptions.ConnectionError as e:
-            openrouter_logger.warning(f"🌐 Network connection issue to {domain}: {e}")
-        except Exception as e:
-            openrouter_logger.debug(f"🔍 Network check completed with minor issue: {e}")
+    def _provider_available(self):
+        """Whether OpenRouter looks able to serve embeddings right now."""
+        return (self.client == "openrouter" and self.health.usable(self.openrouter_model)
+                and self.key_pool.has_available())
     
     def _get_fallback_recommendation(self, user_message):
         """
         Fallback recommendation system when OpenAI is not available
         """
-        # Simple keyword matching
-        keywords = user_message.lower().split()
-        
-        # Find relevant products
-        relevant_products = []
-        all_products = list(Product.objects.all())
-        
-        for product in all_products:
-            score = 0
-            search_text = f"{product.name} {product.description} {' '.join(product.tags)}".lower()
-            
-            for keyword in keywords:
-                if keyword in search_text:
-                    score += 1
-            
-            if score > 0:
-                relevant_products.append((product, score))
-        
-        # Sort by relevance and take top 5
-        relevant_products.sort(key=lambda x: x[1], reverse=True)
-        recommended_products = [p[0] for p in relevant_products[:5]]
+        if self._provider_available():
+            # The LLM reply was unusable but embeddings still work: BM25 + vector retrieval
+            recommended_ids = hybrid_search(user_message, top_k=5)
+        else:
+            # Don't wait on query embeddings from a provider that is down or out of keys
+            recommended_ids, _ = keyword_search(user_message, top_k=5)
         
         # If no relevant products found, return random selection
-        if not recommended_products:
-            recommended_products = random.sample(all_products, min(4, len(all_products)))
+        if not recommended_ids:
+            all_products = list(Product.objects.all())
+            recommended_ids = [str(p.pk) for p in random.sample(all_products, min(4, len(all_products)))]
         
         # Generate response
         responses = [
@@ -426,5 +443,22 @@ Response: "Since you're looking at T-shirts, here are other color options: [T-sh
         
         return {
             'response': random.choice(responses),
-            'products': [p.pk for p in recommended_products]  # Use pk instead of id for MongoDB
-        }
\ No newline at end of file
+            'products': recommended_ids  # Product pks as strings for MongoDB
+        }
+
+
+_service = None
+_service_pid = None
+_service_lock = threading.Lock()
+
+
+def get_recommendation_service() -> AIRecommendationService:
+    """Process-wide service; a forked child builds its own along with its key pool."""
+    global _service, _service_pid
+    pid = os.getpid()
+    if _service is None or _service_pid != pid:
+        with _service_lock:
+            if _service is None or _service_pid != pid:
+                _service = AIRecommendationService()
+                _service_pid = pid
+    return _service
@@ -0,0 +1,103 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
+
+if multiprocessing.parent_process() is not None:
+    # Shard workers each scan one slice; multi-threaded BLAS in every worker
+    # would oversubscribe the cores the shards are meant to use. Must run
+    # before numpy is imported in the worker.
+    for _var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(_var, "1")
+
+import numpy as np  # noqa: E402
+
+from .ann import top_k_indices_2d  # noqa: E402
+
+rag_logger = logging.getLogger('rag_debug')
+
+# Worker-side cache of the memory-mapped matrix, keyed by file path
+_mapped = {}
+
+
+def _shard_matrix(path: str) -> np.ndarray:
+    matrix = _mapped.get(path)
+    if matrix is None:
+        # A new path means the parent swapped files; drop mappings of old ones
+        _mapped.clear()
+        matrix = _mapped[path] = np.load(path, mmap_mode="r")
+    return matrix
+
+
+def _search_shard(path: str, start: int, stop: int, Q: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Partial top_k of rows [start, stop) for every query; runs in a worker process."""
+    block = _shard_matrix(path)[start:stop]
+    idxs, scores = top_k_indices_2d(block @ Q.T, top_k)
+    return idxs + start, scores
+
+
+def _warm(path: str) -> int:
+    return int(_shard_matrix(path).shape[0])
+
+
+class ShardedSearcher:
+    """Exact search split across worker processes over a shared ``.npy`` file.
+
+    The embedding matrix is never pickled: workers memory-map the same file
+    (a snapshot, or a spill file in shared memory such as /dev/shm), so all
+    shards share one copy in the page cache. Each worker scans a contiguous
+    slice and returns its partial top_k; the parent merges them.
+    """
+
+    def __init__(self, n_shards: int):
+        self.n_shards = max(1, n_shards)
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # A pool inherited through fork() has no live workers in the child
+        pid = os.getpid()
+        if self._pool is None or self._pid != pid:
+            with self._lock:
+                if self._pool is None or self._pid != pid:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.n_shards,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                    self._pid = pid
+                    rag_logger.info(f"Started {self.n_shards} search shard processes")
+        return self._pool
+
+    def warm(self, path: str) -> None:
+        """Have the workers map ``path`` ahead of the first query."""
+        pool = self._executor()
+        list(pool.map(_warm, [path] * self.n_shards))
+
+    def search(self, path: str, n_rows: int, Q: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Merged (indices, scores), each shaped (n_queries, k), best first."""
+        Q = np.ascontiguousarray(np.atleast_2d(Q), dtype=np.float32)
+        bounds = np.linspace(0, n_rows, self.n_shards + 1).astype(int)
+        pool = self._executor()
+        futures = [
+            pool.submit(_search_shard, path, int(start), int(stop), Q, top_k)
+            for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+        ]
+        parts = [f.result() for f in futures]
+        idxs = np.concatenate([p[0] for p in parts], axis=1)
+        scores = np.concatenate([p[1] for p in parts], axis=1)
+        best, _ = top_k_indices_2d(scores.T, top_k)
+        return np.take_along_axis(idxs, best, axis=1), np.take_along_axis(scores, best, axis=1)
+
+    def shutdown(self) -> None:
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+
+def shard_count(setting: int) -> int:
+    """RAG_SEARCH_SHARDS: a positive count, or 0 for one shard per CPU core."""
+    return setting if setting > 0 else (os.cpu_count() or 1)
+
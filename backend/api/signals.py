@@ -0,0 +1,42 @@
+import logging
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Product
+
+rag_logger = logging.getLogger('rag_debug')
+
+
+@receiver(post_save, sender=Product)
+def queue_product_embedding(sender, instance, **kwargs):
+    from .indexer import enqueue
+    from .rag import invalidate_cached_responses, invalidate_search_results, update_keyword_index
+    invalidate_search_results()
+    invalidate_cached_responses(str(instance.pk), price=instance.price)
+    try:
+        update_keyword_index(instance)
+    except Exception as e:
+        rag_logger.error(f"Could not update keyword index for product {instance.pk}: {e}")
+    try:
+        enqueue(str(instance.pk), "upsert")
+    except Exception as e:
+        # Never fail a product save because the queue is unavailable; the
+        # periodic reconcile picks the change up later
+        rag_logger.error(f"Could not enqueue embedding for product {instance.pk}: {e}")
+
+
+@receiver(post_delete, sender=Product)
+def queue_embedding_removal(sender, instance, **kwargs):
+    from .indexer import enqueue
+    from .rag import invalidate_cached_responses, invalidate_search_results, remove_from_keyword_index
+    invalidate_search_results()
+    invalidate_cached_responses(str(instance.pk), deleted=True)
+    try:
+        remove_from_keyword_index(str(instance.pk))
+    except Exception as e:
+        rag_logger.error(f"Could not remove product {instance.pk} from keyword index: {e}")
+    try:
+        enqueue(str(instance.pk), "delete")
+    except Exception as e:
+        rag_logger.error(f"Could not enqueue embedding removal for product {instance.pk}: {e}")
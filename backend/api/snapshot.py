@@ -0,0 +1,92 @@
+import json
+import logging
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+rag_logger = logging.getLogger('rag_debug')
+
+# Pointer file naming the snapshot currently being served
+CURRENT_FILE = "CURRENT"
+
+
+def _write_atomic(path: str, write) -> None:
+    """Write through a temp file and rename it over ``path``."""
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_snapshot(directory: str, matrix: np.ndarray, pks: List[str],
+                   watermark: Optional[datetime] = None, facets: Optional[dict] = None) -> str:
+    """Export a normalized embedding matrix and its pk list, then make it current.
+
+    Each snapshot is an ``<name>.npy`` matrix plus an ``<name>.json`` sidecar
+    holding the pks and per-row facet columns.
+    Both are fully written before the ``CURRENT`` pointer is renamed into place,
+    so readers never observe a partial snapshot. Returns the snapshot name.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = f"embeddings-{datetime.utcnow():%Y%m%dT%H%M%S%f}"
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+
+    _write_atomic(os.path.join(directory, f"{name}.npy"), lambda f: np.save(f, matrix))
+    meta = {
+        "pks": list(pks),
+        "rows": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "watermark": watermark.isoformat() if watermark else None,
+        "facets": facets,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+    _write_atomic(os.path.join(directory, f"{name}.json"), lambda f: f.write(json.dumps(meta).encode("utf-8")))
+    _write_atomic(os.path.join(directory, CURRENT_FILE), lambda f: f.write(name.encode("utf-8")))
+    rag_logger.info(f"Wrote embedding snapshot {name}: shape={matrix.shape}")
+
+    _prune(directory, keep={name, previous_snapshot_name(directory, exclude=name)})
+    return name
+
+
+def current_snapshot_name(directory: str) -> Optional[str]:
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def previous_snapshot_name(directory: str, exclude: str) -> Optional[str]:
+    names = sorted(
+        f[:-len(".npy")] for f in os.listdir(directory)
+        if f.startswith("embeddings-") and f.endswith(".npy") and f[:-len(".npy")] != exclude
+    )
+    return names[-1] if names else None
+
+
+def _prune(directory: str, keep: set) -> None:
+    # Workers still mapping an older file keep it alive until they swap; on
+    # POSIX unlinking a mapped file is safe
+    for f in os.listdir(directory):
+        if not f.startswith("embeddings-") or ".tmp." in f:
+            continue
+        if f.rsplit(".", 1)[0] not in keep:
+            try:
+                os.remove(os.path.join(directory, f))
+            except OSError as e:
+                rag_logger.warning(f"Could not remove old snapshot file {f}: {e}")
+
+
+def load_snapshot(directory: str, name: str) -> Tuple[np.ndarray, List[str], dict]:
+    """Open snapshot ``name`` read-only; the matrix is memory-mapped, not copied."""
+    matrix = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+    with open(os.path.join(directory, f"{name}.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    pks = meta.pop("pks")
+    if len(pks) != matrix.shape[0]:
+        raise ValueError(f"Snapshot {name} is inconsistent: {len(pks)} pks for {matrix.shape[0]} rows")
+    return matrix, pks, meta
@@ -0,0 +1,115 @@
+import json
+import re
+from typing import Iterator, List, Optional, Tuple
+
+# Model replies follow the prompt's {"response": "...", "products": [...]} format
+_RESPONSE_RE = re.compile(r'"response"\s*:\s*"')
+_PRODUCTS_RE = re.compile(r'"products"\s*:\s*\[')
+# Body of a JSON string up to (not including) its closing quote or the end of input
+_STRING_BODY_RE = re.compile(r'(?:[^"\\]|\\.)*')
+_STRING_RE = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+# Models sometimes put raw newlines inside strings
+_decoder = json.JSONDecoder(strict=False)
+
+
+def sse_event(event: str, data) -> str:
+    """One Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def iter_chat_deltas(response) -> Iterator[str]:
+    """Content deltas of an OpenAI-style ``stream: true`` chat completion."""
+    for line in response.iter_lines(decode_unicode=True):
+        # Blank separators and ": keep-alive" comments carry no data
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        chunk = json.loads(data)
+        if chunk.get("error"):
+            raise RuntimeError(f"Stream error: {chunk['error']}")
+        choices = chunk.get("choices") or []
+        delta = (choices[0].get("delta") or {}).get("content") if choices else None
+        if delta:
+            yield delta
+
+
+def _decode_partial(raw: str) -> str:
+    """Decode a possibly truncated JSON string body, dropping an incomplete trailing escape."""
+    for cut in range(0, min(len(raw), 6) + 1):
+        try:
+            text = _decoder.decode(f'"{raw[:len(raw) - cut]}"')
+        except ValueError:
+            continue
+        # Half of a surrogate pair waits for the other half
+        if text and "\ud800" <= text[-1] <= "\udbff":
+            text = text[:-1]
+        return text
+    return ""
+
+
+def parse_recommendation(content: str) -> Optional[dict]:
+    """The {"response", "products"} object in a complete model reply, or None."""
+    match = re.search(r'\{.*\}', content, re.DOTALL)
+    if not match:
+        return None
+    try:
+        result = _decoder.decode(match.group())
+    except ValueError:
+        return None
+    if not isinstance(result, dict):
+        return None
+    return {
+        'response': result.get('response', content),
+        'products': [str(pk) for pk in result.get('products', []) if pk],
+    }
+
+
+class RecommendationStreamParser:
+    """Incremental reader of a streamed ``{"response": ..., "products": [...]}`` reply.
+
+    ``feed`` returns the reply text decoded so far beyond what was already
+    returned, plus product ids whose strings have closed; both are safe to
+    show before the JSON object is complete.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.text = ""
+        self.products: List[str] = []
+        self._strings_seen = 0
+
+    def feed(self, delta: str) -> Tuple[str, List[str]]:
+        self.buffer += delta
+        return self._text_delta(), self._new_products()
+
+    def _text_delta(self) -> str:
+        match = _RESPONSE_RE.search(self.buffer)
+        if not match:
+            return ""
+        raw = _STRING_BODY_RE.match(self.buffer, match.end()).group()
+        text = _decode_partial(raw)
+        if len(text) <= len(self.text):
+            return ""
+        delta, self.text = text[len(self.text):], text
+        return delta
+
+    def _new_products(self) -> List[str]:
+        match = _PRODUCTS_RE.search(self.buffer)
+        if not match:
+            return []
+        listed = self.buffer[match.end():].split("]", 1)[0]
+        closed = _STRING_RE.findall(listed)
+        new = [pk for pk in map(_decode_partial, closed[self._strings_seen:]) if pk]
+        self._strings_seen = len(closed)
+        self.products.extend(new)
+        return new
+
+    def result(self) -> Optional[dict]:
+        """Final parse of the whole reply, falling back to what was streamed."""
+        result = parse_recommendation(self.buffer)
+        if result is None and self.text:
+            result = {'response': self.text, 'products': list(self.products)}
+        return result
@@ -0,0 +1,28 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from api import apps
+
+
+@override_settings(RAG_INDEXER_MODE='thread')
+class BackgroundThreadTests(SimpleTestCase):
+
+    def setUp(self):
+        apps._started_pid = None
+        self.addCleanup(setattr, apps, '_started_pid', None)
+
+    def test_threads_start_once_per_process_on_first_request(self):
+        with mock.patch('api.openrouter_health.get_health_monitor') as monitor, \
+                mock.patch('api.indexer.start_background_indexer') as indexer:
+            apps._start_background_threads()
+            apps._start_background_threads()
+        self.assertEqual((monitor.call_count, indexer.call_count), (1, 1))
+
+    def test_forked_worker_starts_its_own(self):
+        with mock.patch('api.openrouter_health.get_health_monitor') as monitor, \
+                mock.patch('api.indexer.start_background_indexer'):
+            apps._start_background_threads()
+            with mock.patch('api.apps.os.getpid', return_value=-1):
+                apps._start_background_threads()
+        self.assertEqual(monitor.call_count, 2)
@@ -0,0 +1,25 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from api.cache import QueryEmbeddingCache
+
+
+class BrokenCollection:
+    """Shared tier that always fails, so only the in-process LRU answers."""
+
+    name = "query_embedding_cache"
+
+    def __getattr__(self, name):
+        raise RuntimeError("mongo unavailable")
+
+
+class QueryEmbeddingCacheTests(SimpleTestCase):
+
+    def test_memory_tier_is_bounded_by_bytes(self):
+        cache = QueryEmbeddingCache(BrokenCollection, max_entries=100, max_bytes=3 * 1536 * 4)
+        for i in range(5):
+            cache.set(f"query {i}", "model", np.ones(1536))
+        memory = cache.stats()["memory"]
+        self.assertEqual((memory["entries"], memory["bytes"], memory["evictions"]), (3, 3 * 1536 * 4, 2))
+        self.assertIsNone(cache.get("query 0", "model"))
+        self.assertIsNotNone(cache.get("Query  4", "model"))
@@ -0,0 +1,91 @@
+import json
+
+from django.test import SimpleTestCase
+
+from api.hedged_llm import HedgeBudget, HedgedChatClient, InvalidReply
+from api.key_pool import KeyPool, KeyPoolExhausted
+from api.llm_stub import StubLLMServer
+
+
+def _validate(data):
+    content = data["choices"][0]["message"]["content"]
+    if not content.startswith("{"):
+        raise InvalidReply("prose reply", value=content)
+    return json.loads(content)
+
+
+class HedgedChatClientTests(SimpleTestCase):
+    """Hedging, failover and budget accounting against the OpenRouter stub."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubLLMServer(port=0, delay=0.01)
+        cls.stub.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.shutdown()
+        cls.stub.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.stub.requests.clear()
+
+    def hedged_client(self, keys, **kwargs):
+        pool = KeyPool(keys, base_url=self.stub.base_url)
+        kwargs.setdefault("hedge_delay", 0.2)
+        return HedgedChatClient(pool, timeout=5.0, **kwargs)
+
+    def complete(self, client):
+        payload = {"model": "stub-model", "messages": [{"role": "user", "content": "t-shirt"}]}
+        return client.complete(payload, validate=_validate)
+
+    def test_fast_primary_wins_without_hedging(self):
+        client = self.hedged_client(["stub-key-aaaaaaaa", "stub-key-bbbbbbbb"])
+        result = self.complete(client)
+        self.assertEqual(result["response"], "Stub recommendation for: t-shirt")
+        self.assertEqual(client.wins["primary"], 1)
+        self.assertEqual(client.budget.hedges, 0)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_slow_primary_is_hedged_to_next_key(self):
+        client = self.hedged_client(["stub-slow-2.0-aaaa", "stub-key-bbbbbbbb"])
+        result = self.complete(client)
+        self.assertIn("t-shirt", result["response"])
+        self.assertEqual(client.wins["hedge"], 1)
+        self.assertEqual(client.budget.hedges, 1)
+        self.assertEqual([r["key"] for r in self.stub.requests], ["stub-slow-2.0-aaaa", "stub-key-bbbbbbbb"])
+
+    def test_empty_budget_denies_hedge(self):
+        client = self.hedged_client(["stub-slow-0.5-aaaa", "stub-key-bbbbbbbb"], budget=HedgeBudget(ratio=0.0, burst=0.0))
+        self.complete(client)
+        self.assertEqual(client.wins["primary"], 1)
+        self.assertEqual(client.budget.hedges, 0)
+        self.assertGreaterEqual(client.budget.denied, 1)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_http_error_fails_over_and_cools_key_down(self):
+        client = self.hedged_client(["stub-fail-503-aaaa", "stub-key-bbbbbbbb"])
+        self.complete(client)
+        self.assertEqual(client.wins["failover"], 1)
+        failed, ok = client.pool.stats()
+        self.assertEqual(failed["failures"], 1)
+        self.assertGreater(failed["cooldown_seconds"], 0)
+        self.assertEqual(ok["successes"], 1)
+
+    def test_failovers_are_capped(self):
+        keys = [f"stub-fail-503-{i}aaaaaaa" for i in range(5)]
+        client = self.hedged_client(keys, max_failovers=2)
+        with self.assertRaises(KeyPoolExhausted):
+            self.complete(client)
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_invalid_reply_ends_race_without_penalising_key(self):
+        client = self.hedged_client(["stub-invalid-aaaa", "stub-key-bbbbbbbb"])
+        result = self.complete(client)
+        self.assertTrue(result.startswith("Sorry"))
+        self.assertEqual(client.invalid_replies, 1)
+        self.assertEqual(len(self.stub.requests), 1)
+        stats = client.pool.stats()[0]
+        self.assertEqual((stats["failures"], stats["successes"], stats["cooldown_seconds"]), (0, 1, 0))
@@ -0,0 +1,58 @@
+import time
+
+from django.test import SimpleTestCase
+
+from api.key_pool import KeyPool, KeyPoolExhausted, _retry_after_seconds
+
+
+class KeyPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = KeyPool(["key-one-aaaaaaaa", "key-two-bbbbbbbb"], base_url="http://127.0.0.1:9")
+        self.first, self.second = self.pool.ordered()
+
+    def test_auth_failure_disables_key(self):
+        self.pool.record_failure(self.first, "HTTP 401", status=401)
+        self.assertTrue(self.first.disabled)
+        self.assertEqual(self.pool.ordered(), [self.second])
+
+    def test_rate_limit_cools_down_for_retry_after(self):
+        self.pool.record_failure(self.first, "HTTP 429", status=429, retry_after=120)
+        self.assertAlmostEqual(self.first.cooldown_until - time.monotonic(), 120, delta=1)
+        self.assertEqual(self.pool.ordered(), [self.second])
+        self.first.cooldown_until = 0.0
+        self.assertIn(self.first, self.pool.ordered())
+
+    def test_other_failures_back_off_exponentially(self):
+        backoffs = []
+        for _ in range(3):
+            self.pool.record_failure(self.first, "HTTP 503", status=503)
+            backoffs.append(round(self.first.cooldown_until - time.monotonic()))
+        self.assertEqual(backoffs, [1, 2, 4])
+        self.pool.record_success(self.first, 0.1)
+        self.assertEqual(self.first.consecutive_failures, 0)
+
+    def test_healthier_key_is_tried_first(self):
+        self.pool.record_success(self.second, 0.1)
+        self.pool.record_failure(self.first, "timeout", latency=2.0)
+        self.first.cooldown_until = 0.0
+        self.assertEqual(self.pool.ordered(), [self.second, self.first])
+
+    def test_post_raises_when_every_key_is_unusable(self):
+        for state in (self.first, self.second):
+            self.pool.record_failure(state, "HTTP 401", status=401)
+        with self.assertRaises(KeyPoolExhausted):
+            self.pool.post("/chat/completions", {}, timeout=1)
+
+    def test_retry_after_accepts_seconds_and_dates(self):
+        self.assertEqual(_retry_after_seconds("7"), 7.0)
+        self.assertIsNone(_retry_after_seconds("soon"))
+        self.assertEqual(_retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+
+
+    def test_key_due_back_first_is_probed_when_all_cool_down(self):
+        self.pool.record_failure(self.first, "HTTP 503", status=503)
+        self.pool.record_failure(self.second, "HTTP 429", status=429, retry_after=120)
+        self.assertEqual(self.pool.ordered(), [self.first])
+        self.pool.record_failure(self.first, "HTTP 401", status=401)
+        self.assertEqual(self.pool.ordered(), [self.second])
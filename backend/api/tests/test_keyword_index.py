@@ -0,0 +1,48 @@
+from django.test import SimpleTestCase
+
+from api.keyword_index import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+class BM25IndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.index = BM25Index()
+        self.index.fit(
+            ["tee", "jacket", "mug", "sku"],
+            ["red cotton t-shirt", "red rain jacket with red hood", "coffee mug", "socks SKU-1042"],
+            [{"category": "clothing", "price": 20}, {"category": "clothing", "price": 90},
+             {"category": "kitchen", "price": 8}, {"category": "clothing", "price": 5}],
+        )
+
+    def test_tokenize_splits_on_punctuation(self):
+        self.assertEqual(tokenize("SKU-1042, Red!"), ["sku", "1042", "red"])
+
+    def test_ranks_by_term_frequency_and_skips_non_matches(self):
+        pks, scores = self.index.search("red", top_k=None)
+        self.assertEqual(pks, ["jacket", "tee"])
+        self.assertGreater(scores[0], scores[1])
+
+    def test_exact_token_match(self):
+        self.assertEqual(self.index.search("1042")[0], ["sku"])
+
+    def test_filters_apply_to_scores(self):
+        self.assertEqual(self.index.search("red", filters={"max_price": 50})[0], ["tee"])
+
+    def test_upsert_and_remove(self):
+        self.index.upsert("mug", "red enamel mug", {"category": "kitchen"})
+        self.assertIn("mug", self.index.search("red", top_k=None)[0])
+        self.index.remove("jacket")
+        self.assertNotIn("jacket", self.index.search("red", top_k=None)[0])
+        self.assertEqual(len(self.index), 3)
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+
+    def test_documents_in_both_rankings_rise_to_the_top(self):
+        keyword = ["sku", "tee", "jacket"]
+        vector = ["jacket", "hoodie", "tee"]
+        self.assertEqual(reciprocal_rank_fusion([keyword, vector], k=60)[:2], ["jacket", "tee"])
+
+    def test_ties_keep_first_seen_order_and_weights_break_them(self):
+        self.assertEqual(reciprocal_rank_fusion([["a"], ["b"]]), ["a", "b"])
+        self.assertEqual(reciprocal_rank_fusion([["a"], ["b"]], weights=[1.0, 2.0]), ["b", "a"])
@@ -0,0 +1,24 @@
+from django.test import SimpleTestCase
+
+from api.openrouter_health import OpenRouterHealthMonitor
+
+
+class HealthMonitorTests(SimpleTestCase):
+
+    def monitor(self, **kwargs):
+        monitor = OpenRouterHealthMonitor(**kwargs)
+        monitor.reachable, monitor.models = True, frozenset({"listed/model"})
+        return monitor
+
+    def test_missing_model_is_only_a_warning_by_default(self):
+        self.assertTrue(self.monitor().usable("unlisted/model:free"))
+
+    def test_missing_model_blocks_when_required(self):
+        monitor = self.monitor(require_listed_model=True)
+        self.assertFalse(monitor.usable("unlisted/model:free"))
+        self.assertTrue(monitor.usable("listed/model"))
+
+    def test_unreachable_blocks(self):
+        monitor = self.monitor()
+        monitor.reachable = False
+        self.assertFalse(monitor.usable("listed/model"))
@@ -0,0 +1,33 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from api.quantization import DimensionReducer
+
+
+class FakeBasisCollection:
+    name = "ann_index"
+
+    def __init__(self):
+        self.docs = {}
+
+    def replace_one(self, query, doc, upsert=False):
+        self.docs[query["_id"]] = doc
+
+    def find_one(self, query):
+        return self.docs.get(query["_id"])
+
+
+class DimensionReducerTests(SimpleTestCase):
+
+    def test_basis_capped_by_sample_rows_is_reused(self):
+        matrix = np.random.default_rng(0).standard_normal((10, 32)).astype(np.float32)
+        reducer = DimensionReducer.train("pca", matrix, 16)
+        self.assertEqual((reducer.out_dim, reducer.requested_dim), (10, 16))
+
+        coll = FakeBasisCollection()
+        reducer.save(coll)
+        loaded = DimensionReducer.load(coll, 32, 16)
+        self.assertIsNotNone(loaded)
+        self.assertEqual(loaded.out_dim, 10)
+        np.testing.assert_array_equal(loaded.encode(matrix), reducer.encode(matrix))
+        self.assertIsNone(DimensionReducer.load(coll, 32, 8))
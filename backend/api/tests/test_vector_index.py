@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from api.vector_index import EmbeddingIndex, encode_embedding
+
+
+class FakeCollection:
+    """The slice of a pymongo collection the embedding index reads."""
+
+    name = "product_embeddings"
+
+    def __init__(self):
+        self.docs = {}
+        # estimated_document_count comes from metadata and may lag behind
+        self.reported_count = None
+        self.clock = datetime(2026, 1, 1)
+
+    def put(self, pk, vec):
+        self.clock += timedelta(seconds=1)
+        self.docs[pk] = {"_id": pk, "updated_at": self.clock, **encode_embedding(vec)}
+
+    def find(self, query, projection=None):
+        since = query.get("updated_at", {}).get("$gte")
+        return [dict(d) for d in self.docs.values() if since is None or d["updated_at"] >= since]
+
+    def estimated_document_count(self):
+        return len(self.docs) if self.reported_count is None else self.reported_count
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+
+class EmbeddingIndexRefreshTests(SimpleTestCase):
+
+    def setUp(self):
+        self.coll = FakeCollection()
+        for pk, vec in (("a", [1, 0, 0]), ("b", [0, 1, 0]), ("c", [0, 0, 1])):
+            self.coll.put(pk, vec)
+        self.index = EmbeddingIndex(refresh_interval=0, delete_check_interval=3600)
+        self.index.refresh(self.coll)
+
+    def test_incremental_refresh_adds_and_updates_rows(self):
+        self.coll.put("d", [1, 1, 0])
+        self.coll.put("a", [0, 1, 1])
+        self.assertEqual(self.index.refresh(self.coll), 2)
+        self.assertEqual(self.index._pks, ["a", "b", "c", "d"])
+        np.testing.assert_allclose(self.index.matrix[0], np.array([0, 1, 1]) / np.sqrt(2), rtol=1e-5)
+
+    def test_shrinking_collection_drops_deleted_rows(self):
+        del self.coll.docs["b"]
+        self.index.refresh(self.coll)
+        self.assertEqual(self.index._pks, ["a", "c"])
+
+    def test_deletion_hidden_from_the_count_is_caught_by_the_id_comparison(self):
+        del self.coll.docs["b"]
+        self.coll.reported_count = 3
+        self.index.refresh(self.coll)
+        self.assertIn("b", self.index._pks)
+
+        self.index.delete_check_interval = 0
+        self.index.refresh(self.coll)
+        self.assertEqual(self.index._pks, ["a", "c"])
+
+    def test_appends_go_into_the_spilled_float_store(self):
+        index = EmbeddingIndex(refresh_interval=0, quantization="int8")
+        index.refresh(self.coll)
+        store = index._float_store
+        self.assertEqual(index.matrix.shape, (3, 3))
+
+        self.coll.put("d", [1, 1, 0])
+        index.refresh(self.coll)
+        self.assertIs(index._float_store, store)
+        self.assertEqual(index.matrix.shape, (4, 3))
+        np.testing.assert_allclose(store[3], np.array([1, 1, 0]) / np.sqrt(2), rtol=1e-5)
+        self.assertEqual(index.search(np.array([1, 1, 0], dtype=np.float32), 1)[0], ["d"])
+
+    def test_full_load_grows_past_an_underestimated_count(self):
+        for i in range(1100):
+            self.coll.put(f"p{i}", [1, i, 0])
+        self.coll.reported_count = 1
+        for quantization in ("none", "int8"):
+            index = EmbeddingIndex(refresh_interval=0, quantization=quantization)
+            self.assertEqual(index.refresh(self.coll), 1103)
+            self.assertEqual(index.matrix.shape, (1103, 3))
+            np.testing.assert_allclose(np.linalg.norm(index.matrix, axis=1), 1.0, rtol=1e-5)
+            np.testing.assert_allclose(index.matrix[1102], np.array([1, 1099, 0]) / np.hypot(1, 1099), rtol=1e-5)
+            self.assertEqual(index._spilled(), quantization == "int8")
+
+    def test_updates_do_not_write_into_arrays_a_search_may_hold(self):
+        index = EmbeddingIndex(refresh_interval=0, quantization="int8")
+        index.refresh(self.coll)
+        matrix, codes = index.matrix, index._codes
+        before = matrix.copy(), codes.copy()
+
+        self.coll.put("a", [0, 1, 1])
+        index.refresh(self.coll)
+        np.testing.assert_array_equal(matrix, before[0])
+        np.testing.assert_array_equal(codes, before[1])
+        np.testing.assert_allclose(index.matrix[0], np.array([0, 1, 1]) / np.sqrt(2), rtol=1e-5)
+        self.assertEqual(index.search(np.array([0, 1, 1], dtype=np.float32), 1)[0], ["a"])
+
+    def test_stats_separate_resident_codes_from_mapped_rows(self):
+        stats = self.index.stats()
+        self.assertEqual((stats["rows"], stats["dim"], stats["quantization"]), (3, 3, "none"))
+        self.assertEqual((stats["resident_bytes"], stats["mapped_bytes"]), (36, 0))
+
+        index = EmbeddingIndex(refresh_interval=0, quantization="int8")
+        index.refresh(self.coll)
+        stats = index.stats()
+        self.assertEqual(stats["quantization"], "int8")
+        self.assertEqual((stats["resident_bytes"], stats["codes_bytes"], stats["mapped_bytes"]), (9, 9, 36))
@@ -0,0 +1,12 @@
+# Rough ratio for English text; good enough for batching and prompt budgets
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of ``text``."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def chars_for_tokens(tokens: int) -> int:
+    """Characters that fit in ``tokens`` by the same estimate."""
+    return max(0, tokens) * CHARS_PER_TOKEN
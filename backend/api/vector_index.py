@@ -0,0 +1,839 @@
+import atexit
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from bson.binary import Binary
+
+from .ann import ANN_COLLECTION, IVFIndex, top_k_indices, top_k_indices_2d
+from .quantization import DimensionReducer, rescore, train_quantizer
+from .sharded import ShardedSearcher
+from .snapshot import current_snapshot_name, load_snapshot, write_snapshot
+
+rag_logger = logging.getLogger('rag_debug')
+
+_EMBEDDING_PROJECTION = {
+    "_id": 1, "embedding": 1, "dtype": 1, "updated_at": 1,
+    "category": 1, "price": 1, "tags": 1,
+}
+
+
+# On-disk dtype for binary embeddings: little-endian float32
+EMBEDDING_DTYPE = "<f4"
+
+
+def encode_embedding(vec, storage: str = "binary") -> dict:
+    """Embedding fields for a ``product_embeddings`` document.
+
+    ``binary`` packs the vector as a little-endian float32 blob with dtype/dim
+    metadata; ``array`` keeps the legacy BSON array of doubles.
+    """
+    if storage == "array":
+        return {"embedding": [float(x) for x in vec]}
+    arr = np.asarray(vec, dtype=EMBEDDING_DTYPE)
+    return {"embedding": Binary(arr.tobytes()), "dtype": EMBEDDING_DTYPE, "dim": int(arr.shape[0])}
+
+
+def decode_embedding(doc: dict) -> np.ndarray:
+    """Read an embedding in either storage format; binary blobs are not copied."""
+    emb = doc.get("embedding")
+    if isinstance(emb, bytes):
+        return np.frombuffer(emb, dtype=doc.get("dtype", EMBEDDING_DTYPE))
+    return np.asarray(emb or [], dtype=np.float32)
+
+
+def _normalize_rows(A: np.ndarray) -> np.ndarray:
+    """L2-normalize each row of A, returning a float32 matrix."""
+    A = np.asarray(A, dtype=np.float32)
+    norms = np.linalg.norm(A, axis=1, keepdims=True)
+    return A / (norms + 1e-8)
+
+
+# Rows normalized per block by _normalize_rows_inplace
+_NORMALIZE_CHUNK = 65536
+
+
+def _normalize_rows_inplace(A: np.ndarray) -> None:
+    """``_normalize_rows`` for a float32 matrix (or memmap), without a full-size temporary."""
+    for start in range(0, A.shape[0], _NORMALIZE_CHUNK):
+        block = A[start:start + _NORMALIZE_CHUNK]
+        block /= np.linalg.norm(block, axis=1, keepdims=True) + 1e-8
+
+
+class ProductFacets:
+    """Columnar category/price/tag metadata aligned with the index rows.
+
+    Categories are stored as int32 codes, prices as float32 (NaN when
+    unknown) and tags as a bitset of uint64 words per row, so a filter over
+    the whole catalog is a handful of vectorized comparisons.
+    """
+
+    def __init__(self):
+        self.category_codes: Dict[str, int] = {}
+        self.tag_bits: Dict[str, int] = {}
+        self.category = np.zeros(0, dtype=np.int32)
+        self.price = np.zeros(0, dtype=np.float32)
+        self.tags = np.zeros((0, 1), dtype=np.uint64)
+
+    @classmethod
+    def from_docs(cls, docs: List[dict]) -> "ProductFacets":
+        facets = cls()
+        facets.extend(docs)
+        return facets
+
+    def copy(self) -> "ProductFacets":
+        other = ProductFacets()
+        other.category_codes = dict(self.category_codes)
+        other.tag_bits = dict(self.tag_bits)
+        other.category = self.category.copy()
+        other.price = self.price.copy()
+        other.tags = self.tags.copy()
+        return other
+
+    def _category_code(self, name) -> int:
+        if not name:
+            return -1
+        return self.category_codes.setdefault(str(name), len(self.category_codes))
+
+    def _tag_row(self, tags) -> np.ndarray:
+        bits = [self.tag_bits.setdefault(t, len(self.tag_bits)) for t in _normalize_tags(tags)]
+        words = max(self.tags.shape[1], (len(self.tag_bits) + 63) // 64)
+        if words > self.tags.shape[1]:
+            self.tags = np.hstack([self.tags, np.zeros((self.tags.shape[0], words - self.tags.shape[1]), dtype=np.uint64)])
+        row = np.zeros(words, dtype=np.uint64)
+        for bit in bits:
+            row[bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+        return row
+
+    @staticmethod
+    def _price(value) -> float:
+        try:
+            return float(str(value))
+        except (TypeError, ValueError):
+            return float("nan")
+
+    def extend(self, docs: List[dict]) -> None:
+        if not docs:
+            return
+        category = np.array([self._category_code(d.get("category")) for d in docs], dtype=np.int32)
+        price = np.array([self._price(d.get("price")) for d in docs], dtype=np.float32)
+        tag_rows = [self._tag_row(d.get("tags")) for d in docs]
+        width = self.tags.shape[1]
+        tags = np.vstack([np.pad(r, (0, width - r.shape[0])) for r in tag_rows])
+        self.category = np.concatenate([self.category, category])
+        self.price = np.concatenate([self.price, price])
+        self.tags = np.vstack([self.tags, tags])
+
+    def set_row(self, pos: int, doc: dict) -> None:
+        self.category[pos] = self._category_code(doc.get("category"))
+        self.price[pos] = self._price(doc.get("price"))
+        row = self._tag_row(doc.get("tags"))
+        self.tags[pos] = 0
+        self.tags[pos, :row.shape[0]] = row
+
+    def mask(self, category: Optional[str] = None, min_price: Optional[float] = None,
+             max_price: Optional[float] = None, tags: Optional[List[str]] = None) -> Optional[np.ndarray]:
+        """Boolean row mask for the given filters, or None when nothing is filtered."""
+        if not category and min_price is None and max_price is None and not tags:
+            return None
+        mask = np.ones(self.category.shape[0], dtype=bool)
+        if category:
+            code = self.category_codes.get(str(category))
+            if code is None:
+                return np.zeros_like(mask)
+            mask &= self.category == code
+        # NaN prices compare False, so unpriced rows drop out of price filters
+        if min_price is not None:
+            mask &= self.price >= np.float32(min_price)
+        if max_price is not None:
+            mask &= self.price <= np.float32(max_price)
+        for tag in _normalize_tags(tags):
+            bit = self.tag_bits.get(tag)
+            if bit is None:
+                return np.zeros_like(mask)
+            mask &= (self.tags[:, bit // 64] & (np.uint64(1) << np.uint64(bit % 64))) != 0
+        return mask
+
+    def to_lists(self) -> dict:
+        """Per-row values for a snapshot sidecar."""
+        categories = {code: name for name, code in self.category_codes.items()}
+        tag_names = {bit: name for name, bit in self.tag_bits.items()}
+        return {
+            "category": [categories.get(int(c)) for c in self.category],
+            "price": [None if np.isnan(p) else float(p) for p in self.price],
+            "tags": [
+                [tag_names[b] for b in range(len(tag_names)) if row[b // 64] & (np.uint64(1) << np.uint64(b % 64))]
+                for row in self.tags
+            ],
+        }
+
+    @classmethod
+    def from_lists(cls, columns: Optional[dict], n_rows: int) -> "ProductFacets":
+        if not columns:
+            return cls.from_docs([{} for _ in range(n_rows)])
+        return cls.from_docs([
+            {"category": c, "price": p, "tags": t}
+            for c, p, t in zip(columns["category"], columns["price"], columns["tags"])
+        ])
+
+
+def _normalize_tags(tags) -> List[str]:
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    return sorted({str(t).strip().lower() for t in tags if str(t).strip()})
+
+
+class EmbeddingIndex:
+    """Process-wide in-memory index over the ``product_embeddings`` collection.
+
+    Rows are stored L2-normalized as float32 so a query costs a single matmul.
+    The index is refreshed incrementally using the ``updated_at`` field of each
+    embedding document as a watermark. Deletions do not move the watermark, so
+    every ``delete_check_interval`` seconds (or sooner, when the collection
+    looks smaller than the index) the stored ``_id`` set is compared with the
+    resident pks, and a missing one triggers a full reload.
+
+    With ``engine="ivf"`` queries go through an IVF approximate index once the
+    catalog has at least ``ann_min_rows`` rows; smaller catalogs are always
+    searched exactly.
+
+    When ``snapshot_dir`` is set the matrix is not read from Mongo at all:
+    the index memory-maps the current snapshot written by
+    ``export_embedding_snapshot`` (shared page cache across worker processes)
+    and swaps to a newer one when the ``CURRENT`` pointer changes.
+
+    With ``quantization`` set to ``int8`` or ``pq`` exact scans run over
+    compressed codes held in memory, and the best ``top_k * rescore_factor``
+    candidates are rescored against the float32 rows, which then live on disk
+    (the snapshot file, or a spill file in ``float_store_dir``). ``truncate``
+    and ``pca`` do the same with ``reduced_dim``-dimensional float32 rows.
+    ``rescore_factor=0`` skips the exact rerank and returns approximate scores.
+
+    With ``shards`` > 1 unfiltered exact scans of at least ``shard_min_rows``
+    rows are split across that many worker processes, which memory-map the
+    snapshot file or a spill file (``float_store_dir``, else /dev/shm) and
+    return partial top_k lists that are merged here.
+    """
+
+    def __init__(self, refresh_interval: float = 5.0, delete_check_interval: float = 60.0,
+                 engine: str = "exact", nlist: int = 0,
+                 nprobe: int = 8, ann_min_rows: int = 10000, snapshot_dir: str = "",
+                 quantization: str = "none", pq_subspaces: int = 64, rescore_factor: int = 4,
+                 reduced_dim: int = 256, float_store_dir: str = "", shards: int = 1, shard_min_rows: int = 50000):
+        self.refresh_interval = refresh_interval
+        self.delete_check_interval = delete_check_interval
+        self.snapshot_dir = snapshot_dir
+        self.engine = engine
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.ann_min_rows = ann_min_rows
+        self.quantization = quantization
+        self.pq_subspaces = pq_subspaces
+        self.rescore_factor = max(0, rescore_factor)
+        self.reduced_dim = reduced_dim
+        self.float_store_dir = float_store_dir
+        self.shard_min_rows = shard_min_rows
+        self._sharded = ShardedSearcher(shards) if shards > 1 else None
+        self.version = 0
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._pks: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._watermark: Optional[datetime] = None
+        # pks already applied whose updated_at equals the watermark
+        self._watermark_pks: set = set()
+        self._last_refresh = 0.0
+        self._last_delete_check = 0.0
+        self._indexed_collection = False
+        self._ann: Optional[IVFIndex] = None
+        # Row positions changed since the ANN lists were last updated (None = all)
+        self._dirty_rows: Optional[set] = set()
+        self._snapshot_name: Optional[str] = None
+        self._facets = ProductFacets()
+        self._quantizer = None
+        self._codes: Optional[np.ndarray] = None
+        # Row positions changed since the codes were last encoded (None = all)
+        self._quant_dirty: Optional[set] = None
+        self._float_store: Optional[np.ndarray] = None
+        # File shard workers map: the snapshot, or the kept spill file and its owner pid
+        self._shard_path: Optional[str] = None
+        self._float_path: Optional[str] = None
+        self._float_pid: Optional[int] = None
+        # Path the shard workers last mapped, so unchanged files are not re-warmed
+        self._warmed_path: Optional[str] = None
+        if self._sharded is not None:
+            atexit.register(self._remove_float_file)
+
+    def __len__(self) -> int:
+        return len(self._pks)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """The L2-normalized float32 rows (possibly memory-mapped)."""
+        return self._matrix
+
+    @property
+    def dim(self) -> int:
+        return int(self._matrix.shape[1]) if self._matrix.size else 0
+
+    def stats(self) -> dict:
+        """Size, configuration and resident memory of the index.
+
+        ``resident_bytes`` counts arrays held in process memory; float rows
+        mapped from a snapshot or spill file are reported as ``mapped_bytes``.
+        """
+        with self._lock:
+            matrix, codes, ann = self._matrix, self._codes, self._ann
+            n_rows, version, shard_path = len(self._pks), self.version, self._shard_path
+        # Copies of a memmap keep the subclass but have no file behind them
+        mapped = getattr(matrix, "filename", None) is not None
+        resident = (0 if mapped else matrix.nbytes) + (codes.nbytes if codes is not None else 0)
+        return {
+            "rows": n_rows,
+            "dim": int(matrix.shape[1]) if matrix.size else 0,
+            "version": version,
+            "engine": "ivf" if ann is not None else "exact",
+            "quantization": self.quantization if codes is not None else "none",
+            "ivf_lists": ann.nlist if ann is not None else 0,
+            "sharded": self._sharded is not None and shard_path is not None and n_rows >= self.shard_min_rows,
+            "resident_bytes": resident + (ann.nbytes if ann is not None else 0),
+            "mapped_bytes": matrix.nbytes if mapped else 0,
+            "codes_bytes": codes.nbytes if codes is not None else 0,
+        }
+
+    def refresh(self, coll, force: bool = False) -> int:
+        """Bring the index up to date with ``coll``. Returns number of rows changed."""
+        now = time.monotonic()
+        if not force and self._watermark is not None and now - self._last_refresh < self.refresh_interval:
+            return 0
+
+        with self._lock:
+            if self.snapshot_dir:
+                changed = self._snapshot_load()
+                self._last_refresh = now
+                if changed:
+                    self.version += 1
+                    self._update_quantization(coll)
+                    self._update_ann(coll)
+                    self._warm_shards()
+                return changed
+
+            if self._float_store is not None and self._float_pid != os.getpid():
+                # A forked child must not write rows into its parent's shared mapping
+                self._matrix = np.array(self._matrix)
+                self._float_store, self._float_path, self._shard_path = None, None, None
+                self._warmed_path = None
+
+            if not self._indexed_collection:
+                try:
+                    coll.create_index("updated_at")
+                except Exception as e:
+                    rag_logger.warning(f"Could not create updated_at index on {coll.name}: {e}")
+                self._indexed_collection = True
+
+            if self._watermark is None or force:
+                changed = self._full_load(coll)
+                self._last_delete_check = now
+            else:
+                changed = self._incremental_load(coll)
+                if self._has_deletions(coll, now):
+                    rag_logger.info("Embeddings were deleted, reloading index from scratch")
+                    changed = self._full_load(coll)
+
+            self._last_refresh = now
+            if changed:
+                self.version += 1
+                self._update_quantization(coll)
+                self._update_ann(coll)
+                if self._sharded is not None and len(self._pks) >= self.shard_min_rows:
+                    self._spill_floats()
+                    self._warm_shards()
+            return changed
+
+    def _has_deletions(self, coll, now: float) -> bool:
+        """Whether a resident pk no longer exists in ``coll``.
+
+        Deletions don't advance the watermark, and a delete plus an insert
+        leave the count unchanged, so the ``_id`` set is compared on a slower
+        cadence. The (metadata-based) count only brings that check forward.
+        """
+        if not self._pks:
+            return False
+        if now - self._last_delete_check < self.delete_check_interval:
+            try:
+                if coll.estimated_document_count() >= len(self._pks):
+                    return False
+            except Exception as e:
+                rag_logger.warning(f"Could not count {coll.name}: {e}")
+                return False
+        self._last_delete_check = now
+        stored = {str(doc["_id"]) for doc in coll.find({}, {"_id": 1})}
+        return any(pk not in stored for pk in self._pks)
+
+    def _update_ann(self, coll) -> None:
+        if self.engine != "ivf" or len(self._pks) < self.ann_min_rows:
+            self._ann = None
+            self._dirty_rows = None
+            return
+
+        ann = self._ann
+        if ann is None or ann.dim != self.dim:
+            ann = IVFIndex.load(coll.database[ANN_COLLECTION], self.dim)
+            self._dirty_rows = None
+        if ann is None or ann.needs_retrain(len(self._pks)):
+            ann = IVFIndex.train(self._matrix, nlist=self.nlist)
+            self._dirty_rows = None
+            try:
+                ann.save(coll.database[ANN_COLLECTION])
+            except Exception as e:
+                rag_logger.warning(f"Could not persist IVF centroids: {e}")
+
+        ann.add(self._matrix, self._dirty_rows)
+        self._dirty_rows = set()
+        self._ann = ann
+
+    def _update_quantization(self, coll) -> None:
+        if self.quantization == "none" or not len(self._pks):
+            self._quantizer, self._codes, self._quant_dirty = None, None, None
+            return
+        if not self.snapshot_dir:
+            self._spill_floats()
+
+        quantizer, codes = self._quantizer, self._codes
+        if (quantizer is None or self._quant_dirty is None or codes is None
+                or (isinstance(quantizer, DimensionReducer) and quantizer.needs_retrain(len(self._pks)))):
+            start = time.monotonic()
+            quantizer = self._train_quantizer(coll)
+            codes = quantizer.encode(self._matrix)
+            rag_logger.info(
+                f"Quantized embedding index ({self.quantization}): {codes.nbytes / 2 ** 20:.1f} MB codes "
+                f"for {self._matrix.shape[0]} rows in {time.monotonic() - start:.1f}s"
+            )
+        else:
+            known = codes.shape[0]
+            if known < len(self._pks):
+                codes = np.vstack([codes, quantizer.encode(self._matrix[known:])])
+            rows = np.fromiter((r for r in self._quant_dirty if r < known), dtype=np.int64)
+            if rows.size:
+                # Searches may be scanning the current codes outside the lock
+                if codes is self._codes:
+                    codes = codes.copy()
+                codes[rows] = quantizer.encode(self._matrix[rows])
+        self._quantizer, self._codes, self._quant_dirty = quantizer, codes, set()
+
+    def _train_quantizer(self, coll):
+        if self.quantization != "pca":
+            return train_quantizer(self.quantization, self._matrix, self.pq_subspaces, self.reduced_dim)
+        # Reuse the persisted basis so every worker scores in the same subspace
+        basis_coll = coll.database[ANN_COLLECTION]
+        reducer = None
+        try:
+            reducer = DimensionReducer.load(basis_coll, self.dim, min(self.reduced_dim, self.dim))
+        except Exception as e:
+            rag_logger.warning(f"Could not load PCA basis: {e}")
+        if reducer is None or reducer.needs_retrain(len(self._pks)):
+            reducer = DimensionReducer.train("pca", self._matrix, self.reduced_dim)
+            try:
+                reducer.save(basis_coll)
+            except Exception as e:
+                rag_logger.warning(f"Could not persist PCA basis: {e}")
+        return reducer
+
+    def _spilled(self) -> bool:
+        return (self._float_store is not None and self._matrix.size > 0
+                and np.may_share_memory(self._matrix, self._float_store))
+
+    def _append_rows(self, rows: np.ndarray) -> None:
+        """Append rows, in place when the spill file has room left.
+
+        The matrix is then a longer view of the same file: shard workers keep
+        their mapping and only read up to the row count passed per search.
+        """
+        n = self._matrix.shape[0]
+        if self._spilled() and n + rows.shape[0] <= self._float_store.shape[0]:
+            self._float_store[n:n + rows.shape[0]] = rows
+            self._matrix = self._float_store[:n + rows.shape[0]]
+        else:
+            self._matrix = np.vstack([self._matrix, rows]) if self._matrix.size else rows
+
+    def _replace_rows(self, positions: np.ndarray, rows: np.ndarray) -> None:
+        """Overwrite existing rows in a copy of the matrix, then swap it in.
+
+        Searches scan the matrix outside the lock, so rows are never written
+        in place; a spilled matrix is copied into a new spill file.
+        """
+        if self._spilled():
+            n_rows, dim = self._matrix.shape
+            store, path = self._new_float_store(self._float_store.shape[0], dim)
+            store[:n_rows] = self._matrix
+            store[positions] = rows
+            self._adopt_float_store(store, path, n_rows)
+        else:
+            matrix = self._matrix.copy()
+            matrix[positions] = rows
+            self._matrix = matrix
+
+    def _spill_floats(self) -> None:
+        """Move the float32 matrix to a file-backed ``.npy`` map.
+
+        Quantized search only reads it to rescore; shard workers map the file
+        by path, so it is kept on disk while sharding is enabled. The file has
+        25% spare rows so later appends don't copy the whole matrix again.
+        """
+        if self._spilled():
+            return
+        if not self._matrix.size:
+            return
+        n_rows, dim = self._matrix.shape
+        store, path = self._new_float_store(n_rows + max(n_rows // 4, 1024), dim)
+        store[:n_rows] = self._matrix
+        self._adopt_float_store(store, path, n_rows)
+
+    def _new_float_store(self, capacity: int, dim: int) -> Tuple[np.ndarray, str]:
+        """An empty file-backed (capacity, dim) float32 ``.npy`` map and its path."""
+        directory = self.float_store_dir or None
+        if directory is None and self._sharded is not None and os.path.isdir("/dev/shm"):
+            directory = "/dev/shm"
+        fd, path = tempfile.mkstemp(prefix="embeddings-", suffix=".npy", dir=directory)
+        os.close(fd)
+        return np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(capacity, dim)), path
+
+    def _adopt_float_store(self, store: np.ndarray, path: str, n_rows: int) -> None:
+        """Make the first ``n_rows`` of ``store`` the matrix, replacing any previous spill file."""
+        store.flush()
+        self._remove_float_file()
+        if self._sharded is None:
+            # The mapping keeps the data reachable; the file disappears with the process
+            os.unlink(path)
+        else:
+            self._float_path = self._shard_path = path
+        self._float_pid = os.getpid()
+        self._float_store = store
+        self._matrix = store[:n_rows]
+
+    def _remove_float_file(self) -> None:
+        # Workers still mapping the old file keep its pages alive until they swap
+        if self._float_path and self._float_pid == os.getpid():
+            try:
+                os.unlink(self._float_path)
+            except OSError:
+                pass
+        self._float_path = None
+
+    def _warm_shards(self) -> None:
+        if self._sharded is None or not self._shard_path or len(self._pks) < self.shard_min_rows:
+            return
+        if self._shard_path == self._warmed_path:
+            return
+        try:
+            self._sharded.warm(self._shard_path)
+            self._warmed_path = self._shard_path
+        except Exception as e:
+            rag_logger.warning(f"Could not start search shards: {e}")
+
+    def _snapshot_load(self) -> int:
+        name = current_snapshot_name(self.snapshot_dir)
+        if name is None:
+            if self._snapshot_name is None:
+                rag_logger.warning(f"No embedding snapshot found in {self.snapshot_dir}")
+            return 0
+        if name == self._snapshot_name:
+            return 0
+
+        matrix, pks, meta = load_snapshot(self.snapshot_dir, name)
+        self._matrix = matrix
+        self._pks = pks
+        self._facets = ProductFacets.from_lists(meta.get("facets"), len(pks))
+        self._positions = {}
+        self._watermark = datetime.fromisoformat(meta["watermark"]) if meta.get("watermark") else datetime.min
+        self._snapshot_name = name
+        self._shard_path = os.path.join(self.snapshot_dir, f"{name}.npy")
+        self._quant_dirty = None
+        self._dirty_rows = None
+        rag_logger.info(f"Mapped embedding snapshot {name}: shape={matrix.shape}")
+        return len(pks)
+
+    def export_snapshot(self, directory: str) -> str:
+        """Write the current matrix and pks as a snapshot and make it current."""
+        with self._lock:
+            matrix, pks, watermark = self._matrix, list(self._pks), self._watermark
+            facets = self._facets.to_lists()
+        return write_snapshot(directory, matrix, pks, watermark, facets=facets)
+
+    def _spills_on_load(self, expected_rows: int) -> bool:
+        """Whether a full load should write rows straight into a spill file."""
+        if self.quantization != "none":
+            return True
+        return self._sharded is not None and expected_rows >= self.shard_min_rows
+
+    def _full_load(self, coll) -> int:
+        """Reload every row, streaming them into one preallocated buffer.
+
+        The buffer is sized from the collection's estimated count and is the
+        spill file itself when the rows would be spilled anyway, so the load
+        holds about one copy of the matrix rather than a list of rows, their
+        stacked copy and its normalized copy. An underestimate grows it.
+        """
+        try:
+            expected = int(coll.estimated_document_count())
+        except Exception as e:
+            rag_logger.warning(f"Could not count {coll.name}: {e}")
+            expected = 0
+        spill = self._spills_on_load(expected)
+        pks: List[str] = []
+        docs: List[dict] = []
+        store, path = None, None
+        watermark = None
+        watermark_pks: set = set()
+        dim = 0
+
+        def allocate(capacity: int):
+            if spill:
+                return self._new_float_store(capacity, dim)
+            return np.empty((capacity, dim), dtype=np.float32), None
+
+        for doc in coll.find({}, _EMBEDDING_PROJECTION):
+            vec = decode_embedding(doc)
+            if not dim:
+                dim = vec.shape[0]
+            if vec.shape[0] != dim or not dim:
+                rag_logger.warning(f"Skipping embedding {doc['_id']}: dim {vec.shape[0]} != {dim}")
+                continue
+            n = len(pks)
+            if store is None:
+                store, path = allocate(expected + max(expected // 4, 1024) if spill else max(expected, 1))
+            elif n == store.shape[0]:
+                grown, grown_path = allocate(n + max(n // 2, 1024))
+                grown[:n] = store
+                if path:
+                    os.unlink(path)
+                store, path = grown, grown_path
+            store[n] = vec
+            pks.append(str(doc["_id"]))
+            docs.append({k: doc.get(k) for k in ("category", "price", "tags")})
+            updated_at = doc.get("updated_at")
+            if updated_at is not None and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+                watermark_pks = set()
+            if updated_at is not None and updated_at == watermark:
+                watermark_pks.add(pks[-1])
+
+        if store is None:
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+        else:
+            _normalize_rows_inplace(store[:len(pks)])
+            if path:
+                self._adopt_float_store(store, path, len(pks))
+            elif store.shape[0] - len(pks) > len(pks) // 4:
+                self._matrix = store[:len(pks)].copy()
+            else:
+                self._matrix = store[:len(pks)]
+        self._pks = pks
+        self._positions = {pk: i for i, pk in enumerate(pks)}
+        self._facets = ProductFacets.from_docs(docs)
+        self._watermark = watermark or datetime.min
+        self._watermark_pks = watermark_pks
+        self._dirty_rows = None
+        self._quant_dirty = None
+        rag_logger.info(f"Loaded embedding index: shape={self._matrix.shape}, watermark={self._watermark}")
+        return len(pks)
+
+    def _incremental_load(self, coll) -> int:
+        # $gte rather than $gt: documents written in the same millisecond as the
+        # watermark would otherwise be missed; ones already applied are skipped
+        cursor = coll.find(
+            {"updated_at": {"$gte": self._watermark}},
+            _EMBEDDING_PROJECTION,
+        )
+        new_pks: List[str] = []
+        new_rows: List[np.ndarray] = []
+        new_docs: List[dict] = []
+        updated: Dict[int, np.ndarray] = {}
+        # Searches read facets without the lock, so changes go to a copy that is swapped in
+        facets = None
+        changed = 0
+        # Documents are not returned in updated_at order, so compare against the starting watermark
+        since, applied = self._watermark, self._watermark_pks
+        for doc in cursor:
+            pk = str(doc["_id"])
+            updated_at = doc.get("updated_at")
+            if updated_at == since and pk in applied:
+                continue
+            vec = decode_embedding(doc)
+            if self.dim and vec.shape[0] != self.dim:
+                rag_logger.warning(f"Skipping embedding {pk}: dim {vec.shape[0]} != {self.dim}")
+                continue
+            row = _normalize_rows(vec[None, :])[0]
+            pos = self._positions.get(pk)
+            if pos is not None:
+                updated[pos] = row
+                if facets is None:
+                    facets = self._facets.copy()
+                facets.set_row(pos, doc)
+                if self._dirty_rows is not None:
+                    self._dirty_rows.add(pos)
+                if self._quant_dirty is not None:
+                    self._quant_dirty.add(pos)
+            else:
+                new_pks.append(pk)
+                new_rows.append(row)
+                new_docs.append(doc)
+            changed += 1
+            if updated_at is not None and updated_at > self._watermark:
+                self._watermark = updated_at
+                self._watermark_pks = set()
+            if updated_at == self._watermark:
+                self._watermark_pks.add(pk)
+
+        if updated:
+            self._replace_rows(np.fromiter(updated, dtype=np.int64, count=len(updated)), np.vstack(list(updated.values())))
+        if new_rows:
+            base = len(self._pks)
+            self._append_rows(np.vstack(new_rows))
+            self._pks = self._pks + new_pks
+            facets = facets or self._facets.copy()
+            facets.extend(new_docs)
+            for i, pk in enumerate(new_pks):
+                self._positions[pk] = base + i
+        if facets is not None:
+            self._facets = facets
+
+        if changed:
+            rag_logger.info(f"Incremental index refresh: {changed} rows changed, {len(new_pks)} added")
+        return changed
+
+    def _filtered_rows(self, facets: "ProductFacets", n_rows: int, filters: Optional[dict]) -> Optional[np.ndarray]:
+        mask = facets.mask(**filters) if filters else None
+        if mask is None:
+            return None
+        if mask.shape[0] != n_rows:
+            raise ValueError(f"Facet rows {mask.shape[0]} do not match index rows {n_rows}")
+        return np.flatnonzero(mask)
+
+    @staticmethod
+    def _score_rows(matrix: np.ndarray, rows: np.ndarray, Q: np.ndarray) -> np.ndarray:
+        """Scores of ``rows`` only; a broad filter scores everything and then selects."""
+        if rows.size * 4 < matrix.shape[0]:
+            return matrix[rows] @ Q
+        return (matrix @ Q)[rows]
+
+    def _quantized_search(self, matrix: np.ndarray, pks: List[str], quantizer, codes: np.ndarray,
+                          Q: np.ndarray, top_k: int, rows: Optional[np.ndarray]) -> List[Tuple[List[str], List[float]]]:
+        """Shortlist by compressed scores, then rescore the shortlist exactly in float32 (unless rescore_factor is 0)."""
+        if rows is not None and not rows.size:
+            return [([], []) for _ in range(Q.shape[0])]
+        approx = quantizer.scores(codes if rows is None else codes[rows], Q)
+        if not self.rescore_factor:
+            idxs, scores = top_k_indices_2d(approx, top_k)
+            if rows is not None:
+                idxs = rows[idxs]
+            return [
+                ([pks[int(i)] for i in row_idxs], [float(s) for s in row_scores])
+                for row_idxs, row_scores in zip(idxs, scores)
+            ]
+        shortlist, _ = top_k_indices_2d(approx, top_k * self.rescore_factor)
+        results = []
+        for q, candidates in zip(Q, shortlist):
+            if rows is not None:
+                candidates = rows[candidates]
+            idxs, scores = rescore(matrix, candidates, q, top_k)
+            results.append(([pks[int(i)] for i in idxs], [float(s) for s in scores]))
+        return results
+
+    def _sharded_search(self, path: Optional[str], n_rows: int, Q: np.ndarray, top_k: int):
+        """Merged (indices, scores) from the shard workers, or None to scan in-process."""
+        if self._sharded is None or path is None or n_rows < self.shard_min_rows:
+            return None
+        try:
+            return self._sharded.search(path, n_rows, Q, top_k)
+        except Exception as e:
+            rag_logger.warning(f"Sharded search failed, scanning in-process: {e}")
+            return None
+
+    def search(self, q_vec: np.ndarray, top_k: int = 8, nprobe: Optional[int] = None,
+               filters: Optional[dict] = None) -> Tuple[List[str], List[float]]:
+        """Return (pks, scores) of the top_k rows most similar to q_vec.
+
+        ``nprobe`` overrides the configured number of IVF lists to scan; it is
+        ignored when the exact engine is in use. ``filters`` (category,
+        min_price, max_price, tags) restrict candidates before ranking;
+        filtered queries are always answered exactly over the matching rows.
+        """
+        with self._lock:
+            matrix, pks, ann, facets = self._matrix, self._pks, self._ann, self._facets
+            quantizer, codes, shard_path = self._quantizer, self._codes, self._shard_path
+        if not pks:
+            return [], []
+
+        q = np.asarray(q_vec, dtype=np.float32)
+        if q.shape[0] != matrix.shape[1]:
+            raise ValueError(f"Query dim {q.shape[0]} does not match index dim {matrix.shape[1]}")
+        q = q / (np.linalg.norm(q) + 1e-8)
+
+        rows = self._filtered_rows(facets, len(pks), filters)
+        if codes is not None and (ann is None or rows is not None):
+            return self._quantized_search(matrix, pks, quantizer, codes, q[None, :], top_k, rows)[0]
+        if rows is not None:
+            scores = self._score_rows(matrix, rows, q)
+            idxs = top_k_indices(scores, top_k)
+            return [pks[int(rows[i])] for i in idxs], [float(scores[i]) for i in idxs]
+
+        if ann is not None:
+            rows, scores = ann.search(matrix, q, top_k, nprobe or self.nprobe)
+            return [pks[int(i)] for i in rows], [float(s) for s in scores]
+
+        sharded = self._sharded_search(shard_path, len(pks), q[None, :], top_k)
+        if sharded is not None:
+            idxs, scores = sharded
+            return [pks[int(i)] for i in idxs[0]], [float(s) for s in scores[0]]
+
+        scores = matrix @ q
+        idxs = top_k_indices(scores, top_k)
+        return [pks[int(i)] for i in idxs], [float(scores[i]) for i in idxs]
+
+    def search_many(self, q_vecs: np.ndarray, top_k: int = 8, nprobe: Optional[int] = None,
+                    filters: Optional[dict] = None) -> List[Tuple[List[str], List[float]]]:
+        """Batched ``search``: one (pks, scores) pair per row of ``q_vecs``.
+
+        The exact engine scores every query with a single
+        (n_products x n_queries) matmul; ``filters`` apply to every query.
+        """
+        with self._lock:
+            matrix, pks, ann, facets = self._matrix, self._pks, self._ann, self._facets
+            quantizer, codes, shard_path = self._quantizer, self._codes, self._shard_path
+        Q = np.atleast_2d(np.asarray(q_vecs, dtype=np.float32))
+        if not pks:
+            return [([], []) for _ in range(Q.shape[0])]
+        if Q.shape[1] != matrix.shape[1]:
+            raise ValueError(f"Query dim {Q.shape[1]} does not match index dim {matrix.shape[1]}")
+        Q = Q / (np.linalg.norm(Q, axis=1, keepdims=True) + 1e-8)
+
+        rows = self._filtered_rows(facets, len(pks), filters)
+        if codes is not None and (ann is None or rows is not None):
+            return self._quantized_search(matrix, pks, quantizer, codes, Q, top_k, rows)
+        if rows is None and ann is not None:
+            results = []
+            for q in Q:
+                ann_rows, scores = ann.search(matrix, q, top_k, nprobe or self.nprobe)
+                results.append(([pks[int(i)] for i in ann_rows], [float(s) for s in scores]))
+            return results
+
+        sharded = self._sharded_search(shard_path, len(pks), Q, top_k) if rows is None else None
+        if sharded is not None:
+            idxs, scores = sharded
+        elif rows is None:
+            idxs, scores = top_k_indices_2d(matrix @ Q.T, top_k)
+        else:
+            idxs, scores = top_k_indices_2d(self._score_rows(matrix, rows, Q.T), top_k)
+            idxs = rows[idxs]
+        return [
+            ([pks[int(i)] for i in row_idxs], [float(s) for s in row_scores])
+            for row_idxs, row_scores in zip(idxs, scores)
+        ]
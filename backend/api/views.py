@@ -4,7 +4,8 @@ from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.conf import settings
 from .models import Product, ChatSession, ChatMessage, CartItem
 from .serializers import (
     ProductSerializer, 
@@ -14,11 +15,29 @@ from .serializers import (
     AIRecommendationRequest,
     AIRecommendationResponse
 )
-from .services import AIRecommendationService
+from .services import get_recommendation_service
 import uuid
 import logging
 from decimal import Decimal
-from .rag import semantic_search as rag_semantic_search, ensure_embeddings_for_all_products
+from .rag import (
+    semantic_search as rag_semantic_search,
+    semantic_search_many,
+    get_embedding_index,
+    get_query_embedding_cache,
+    hybrid_search,
+    keyword_search,
+    get_response_cache,
+    get_search_result_cache,
+    reset_search_degraded,
+    search_cache_key,
+    search_degraded,
+)
+from .indexer import enqueue_reconcile, indexing_progress
+from .mongo import check_health, pool_stats
+from .hedged_llm import get_hedged_client
+from .key_pool import get_key_pool
+from .openrouter_health import get_health_monitor
+from .streaming import sse_event
 
 logger = logging.getLogger(__name__)
 
@@ -34,33 +53,100 @@ if not api_logger.handlers:
     handler.setFormatter(formatter)
     api_logger.addHandler(handler)
 
+# Upper bound on queries accepted by semantic_search_batch
+SEMANTIC_SEARCH_BATCH_LIMIT = 64
+
+
+def _search_filter_params(params) -> dict:
+    """category/min_price/max_price/tags query params as semantic_search kwargs."""
+    filters = {"category": params.get('category') or None, "tags": None}
+    for name in ('min_price', 'max_price'):
+        try:
+            filters[name] = float(params[name]) if params.get(name) not in (None, '') else None
+        except ValueError:
+            filters[name] = None
+    tags = params.get('tags')
+    if tags:
+        filters["tags"] = [t.strip() for t in tags.split(',') if t.strip()]
+    return filters
+
+
+def _products_in_rank_order(pks):
+    """Fetch products for ``pks`` and return them in the same order."""
+    from bson import ObjectId
+    products = Product.objects.filter(_id__in=[ObjectId(pk) for pk in pks if ObjectId.is_valid(pk)])
+    by_pk = {str(p.pk): p for p in products}
+    return [by_pk[pk] for pk in pks if pk in by_pk]
+
+
+def _cached_search_results(kind, query, top_k, filters, search):
+    """Serialized products for ``search()`` (ranked pks), served from the result cache when possible.
+
+    By default only pks are cached and products are re-read on a hit, so edits
+    to price, images or category (from any process) show up at once.
+    """
+    cache = get_search_result_cache()
+    key = search_cache_key(kind, query, top_k, filters)
+    entry = cache.get(key)
+    if entry is not None:
+        api_logger.info(f"Search result cache hit: {kind} '{query}'")
+        if entry["payload"] is not None:
+            return entry["payload"]
+        return ProductSerializer(_products_in_rank_order(entry["pks"]), many=True).data
+
+    reset_search_degraded()
+    pks = search()
+    data = list(ProductSerializer(_products_in_rank_order(pks), many=True).data)
+    # Empty results are usually transient (e.g. index still building), don't pin
+    # them; neither are offline-index results once the embedding provider recovers
+    if pks and not search_degraded():
+        cache.set(key, pks, data if getattr(settings, 'RAG_SEARCH_CACHE_PAYLOADS', False) else None)
+    return data
+
+
 class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     
     def get_queryset(self):
         queryset = Product.objects.all()
-        api_logger.info(f"ProductViewSet: Total products in queryset: {queryset.count()}")
-        for product in queryset[:5]:  # Log first 5 products
-            api_logger.info(f"ProductViewSet: Product {product.pk} - {product.name}")
         category = self.request.query_params.get('category', None)
-        search = self.request.query_params.get('search', None)
         
         if category:
             queryset = queryset.filter(category=category)
         
-        if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) | 
-                Q(description__icontains=search) |
-                Q(tags__icontains=search)
-            )
-        
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """Product list; ``search`` is answered from the BM25 keyword index in rank order.
+
+        A search returns at most ``top_k`` products (default and upper bound
+        RAG_KEYWORD_SEARCH_LIMIT), without scanning the collection. Products
+        saved by other processes appear once this process's keyword index is
+        rebuilt (RAG_KEYWORD_INDEX_REFRESH_SECONDS).
+        """
+        search = request.query_params.get('search', None)
+        if not search:
+            return super().list(request, *args, **kwargs)
+        limit = getattr(settings, 'RAG_KEYWORD_SEARCH_LIMIT', 50)
+        try:
+            top_k = max(1, min(int(request.query_params.get('top_k', limit)), limit))
+        except ValueError:
+            top_k = limit
+
+        category = request.query_params.get('category', None)
+        pks, _ = keyword_search(search, top_k=top_k, category=category)
+        products = _products_in_rank_order(pks)
+        api_logger.info(f"ProductViewSet: keyword search '{search}' returned {len(products)} products")
+        return Response(self.get_serializer(products, many=True).data)
+
     @action(detail=False, methods=['get'], url_path='semantic_search')
     def semantic_search(self, request):
-        """Semantic search over products using embeddings."""
+        """Semantic search over products using embeddings.
+
+        Optional category, min_price, max_price and tags (comma-separated)
+        params filter candidates inside the index before ranking.
+        """
         query = request.query_params.get('q', '')
         try:
             top_k = int(request.query_params.get('top_k', 8))
@@ -73,14 +159,12 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
             api_logger.warning("Empty query provided to semantic search")
             return Response({"results": []}, status=status.HTTP_200_OK)
         try:
-            api_logger.info(f"Calling RAG semantic search")
-            pks = rag_semantic_search(query, top_k=top_k)
-            api_logger.info(f"RAG returned {len(pks)} product IDs: {pks}")
-            
-            products = Product.objects.filter(pk__in=pks)
-            api_logger.info(f"Found {len(products)} products in database")
-            
-            data = ProductSerializer(products, many=True).data
+            filters = _search_filter_params(request.query_params)
+            api_logger.info(f"Calling RAG semantic search with filters {filters}")
+            data = _cached_search_results(
+                'semantic', query, top_k, filters,
+                lambda: rag_semantic_search(query, top_k=top_k, **filters),
+            )
             api_logger.info(f"Serialized {len(data)} products for response")
             
             return Response({"results": data, "count": len(data)}, status=status.HTTP_200_OK)
@@ -88,30 +172,106 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
             api_logger.error(f"semantic_search error: {e}")
             return Response({"results": []}, status=status.HTTP_200_OK)
 
-    @action(detail=False, methods=['post'], url_path='index_embeddings')
+    @action(detail=False, methods=['post'], url_path='semantic_search_batch')
+    def semantic_search_batch(self, request):
+        """Semantic search for several queries at once, with scores."""
+        queries = request.data.get('queries')
+        if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+            return Response({"error": "queries must be a list of strings"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(queries) > SEMANTIC_SEARCH_BATCH_LIMIT:
+            return Response(
+                {"error": f"at most {SEMANTIC_SEARCH_BATCH_LIMIT} queries per request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            top_k = int(request.data.get('top_k', 8))
+        except (TypeError, ValueError):
+            top_k = 8
+
+        api_logger.info(f"Semantic search batch request: {len(queries)} queries, top_k={top_k}")
+        try:
+            ranked = semantic_search_many(queries, top_k=top_k)
+
+            # One product fetch for the union of all results
+            from bson import ObjectId
+            all_pks = {pk for pks, _ in ranked for pk in pks}
+            products = Product.objects.filter(_id__in=[ObjectId(pk) for pk in all_pks if ObjectId.is_valid(pk)])
+            serialized = {item['id']: item for item in ProductSerializer(products, many=True).data}
+
+            results = []
+            for query, (pks, scores) in zip(queries, ranked):
+                results.append({
+                    "query": query,
+                    "results": [
+                        {**serialized[pk], "score": score}
+                        for pk, score in zip(pks, scores) if pk in serialized
+                    ],
+                })
+            return Response({"results": results, "count": len(results)}, status=status.HTTP_200_OK)
+        except Exception as e:
+            api_logger.error(f"semantic_search_batch error: {e}")
+            return Response({"results": [], "count": 0}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get', 'post'], url_path='index_embeddings')
     def index_embeddings(self, request):
-        """Ensure embeddings exist for all products (on-demand)."""
+        """Report embedding indexing progress; POST also queues a full reconcile."""
         try:
-            created = ensure_embeddings_for_all_products()
-            return Response({"created": created}, status=status.HTTP_200_OK)
+            queued = False
+            if request.method == 'POST':
+                enqueue_reconcile()
+                queued = True
+            return Response({"queued": queued, **indexing_progress()}, status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f"index_embeddings error: {e}")
             return Response({"error": "failed"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['get'], url_path='rag_stats')
+    def rag_stats(self, request):
+        """Cache and index counters for the semantic search layer."""
+        return Response({
+            "query_embedding_cache": get_query_embedding_cache().stats(),
+            "embedding_index": get_embedding_index().stats(),
+            "mongo": {"health": check_health(), "pool": pool_stats()},
+            "search_result_cache": get_search_result_cache().stats(),
+            "response_cache": get_response_cache().stats(),
+            "api_keys": get_key_pool().stats(),
+            "openrouter": get_health_monitor().snapshot(getattr(settings, 'OPENROUTER_MODEL', None)),
+            "llm_hedging": get_hedged_client().stats() if getattr(settings, 'OPENROUTER_HEDGING', True) else None,
+        }, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=['get'], url_path='advanced_search')
     def advanced_search(self, request):
-        """Combination of filters: category, price range, tags, text query."""
+        """Combination of filters: category, price range, tags, text query.
+
+        ``q`` is ranked by ``mode``: ``hybrid`` (default) fuses BM25 and
+        vector rankings, ``semantic`` and ``keyword`` use one of them alone.
+        """
+        q = request.query_params.get('q')
+        if q:
+            try:
+                top_k = min(int(request.query_params.get('top_k', 50)), 50)
+            except ValueError:
+                top_k = 50
+            filters = _search_filter_params(request.query_params)
+            mode = request.query_params.get('mode', 'hybrid')
+            if mode == 'semantic':
+                search = lambda: rag_semantic_search(q, top_k=top_k, **filters)
+            elif mode == 'keyword':
+                search = lambda: keyword_search(q, top_k=top_k, **filters)[0]
+            else:
+                mode = 'hybrid'
+                search = lambda: hybrid_search(q, top_k=top_k, **filters)
+            data = _cached_search_results(mode, q, top_k, filters, search)
+            return Response({"results": data, "count": len(data)}, status=status.HTTP_200_OK)
+
         qs = Product.objects.all()
         category = request.query_params.get('category')
-        q = request.query_params.get('q')
         min_price = request.query_params.get('min_price')
         max_price = request.query_params.get('max_price')
         tags = request.query_params.get('tags')  # comma-separated
 
         if category:
             qs = qs.filter(category=category)
-        if q:
-            qs = qs.filter(Q(name__icontains=q) | Q(description__icontains=q) | Q(tags__icontains=q))
         try:
             if min_price is not None:
                 qs = qs.filter(price__gte=Decimal(str(min_price)))
@@ -228,6 +388,62 @@ class ChatSessionViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(session)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+
+def _product_card(pk):
+    """Serialized product for a recommended id, or None if it does not resolve."""
+    from bson import ObjectId
+    try:
+        product = Product.objects.filter(_id=ObjectId(pk)).first()
+    except Exception as e:
+        api_logger.warning(f"Skipping recommended product {pk!r}: {e}")
+        return None
+    return ProductSerializer(product).data if product is not None else None
+
+
+def _recommendation_events(ai_service, session, message, conversation_history):
+    """Server-Sent Events for a streamed recommendation.
+
+    Emits ``session``, ``delta`` (reply text), ``product`` (one card per
+    recommended product, as soon as its id is parsed) and ``done``. The AI
+    ChatMessage is saved when the stream closes, including when the client
+    disconnects early.
+    """
+    session_id = str(session.session_id)
+    text, products = [], []
+    final = None
+    try:
+        yield sse_event('session', {'session_id': session_id})
+        for kind, data in ai_service.stream_recommendation(message, conversation_history):
+            if kind == 'delta':
+                text.append(data)
+                yield sse_event('delta', {'text': data})
+            elif kind == 'product' and data not in products:
+                card = _product_card(data)
+                if card is not None:
+                    products.append(data)
+                    yield sse_event('product', card)
+            elif kind == 'done':
+                final = data
+        yield sse_event('done', {
+            'response': final['response'] if final else ''.join(text),
+            'products': products,
+            'session_id': session_id,
+        })
+    except Exception as e:
+        logger.error(f"Error in streamed recommendation: {str(e)}")
+        yield sse_event('error', {'error': 'Internal server error'})
+    finally:
+        try:
+            ChatMessage.objects.create(
+                session=session,
+                message_type='ai',
+                content=final['response'] if final else ''.join(text),
+                products=products
+            )
+        except Exception as e:
+            logger.error(f"Failed to save streamed AI message: {str(e)}")
+
+
 # Completely disable authentication and CSRF for this endpoint
 @api_view(['POST'])
 @authentication_classes([])
@@ -275,7 +491,17 @@ def recommend_products(request):
         )
         
         # Get AI recommendation with retrieved conversation history
-        ai_service = AIRecommendationService()
+        ai_service = get_recommendation_service()
+        if validated_data.get('stream'):
+            response = StreamingHttpResponse(
+                _recommendation_events(ai_service, session, message, conversation_history),
+                content_type='text/event-stream',
+            )
+            response['Cache-Control'] = 'no-cache'
+            # Stop nginx from buffering the event stream
+            response['X-Accel-Buffering'] = 'no'
+            return response
+        
         ai_response = ai_service.get_recommendation(message, conversation_history)
         
         # Get recommended products - convert string IDs to ObjectId for MongoDB
@@ -71,6 +71,15 @@ DATABASES = {
     }
 }
 
+# Pool settings for the shared pymongo client used outside the ORM (api/mongo.py)
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '50'))
+MONGODB_MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', '0'))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', '5000'))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS', '30000'))
+# Seconds a health-check ping result is reused
+MONGODB_HEALTH_CHECK_SECONDS = float(os.getenv('MONGODB_HEALTH_CHECK_SECONDS', '30'))
+
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
@@ -114,6 +123,121 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
 OPENROUTER_MODEL = os.getenv('OPENROUTER_MODEL', 'deepseek/deepseek-r1:free')
 OPENROUTER_EMBEDDING_MODEL = os.getenv('OPENROUTER_EMBEDDING_MODEL', 'openai/text-embedding-3-small')
+# Point at `manage.py run_llm_stub` (http://127.0.0.1:8765/api/v1) to work offline
+OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
+# API key pool: cooldown after a 429 without Retry-After, and keep-alive
+# connections kept per key
+OPENROUTER_KEY_COOLDOWN_SECONDS = float(os.getenv('OPENROUTER_KEY_COOLDOWN_SECONDS', '30'))
+OPENROUTER_HTTP_POOL_SIZE = int(os.getenv('OPENROUTER_HTTP_POOL_SIZE', '10'))
+# Seconds between background checks of OpenRouter reachability and model list
+OPENROUTER_HEALTH_CHECK_SECONDS = float(os.getenv('OPENROUTER_HEALTH_CHECK_SECONDS', '300'))
+# Skip LLM calls when OPENROUTER_MODEL is missing from the model list (by
+# default a missing model is only logged; only an unreachable API skips them)
+OPENROUTER_REQUIRE_LISTED_MODEL = os.getenv('OPENROUTER_REQUIRE_LISTED_MODEL', 'False').lower() == 'true'
+# Hedged chat requests: after the delay (0 = observed p95 latency) a second
+# attempt goes to another key, then to OPENROUTER_HEDGE_MODELS (comma list);
+# the budget caps hedges as a fraction of primary requests. Attempts that fail
+# with a transport or HTTP error are replaced at most MAX_FAILOVERS times
+OPENROUTER_HEDGING = os.getenv('OPENROUTER_HEDGING', 'true').lower() == 'true'
+OPENROUTER_HEDGE_DELAY_SECONDS = float(os.getenv('OPENROUTER_HEDGE_DELAY_SECONDS', '0'))
+OPENROUTER_HEDGE_BUDGET = float(os.getenv('OPENROUTER_HEDGE_BUDGET', '0.1'))
+OPENROUTER_HEDGE_MODELS = os.getenv('OPENROUTER_HEDGE_MODELS', '')
+OPENROUTER_HEDGE_MAX_FAILOVERS = int(os.getenv('OPENROUTER_HEDGE_MAX_FAILOVERS', '2'))
+
+# Semantic search (RAG) configuration
+# How new embeddings are written: 'binary' (packed float32) or 'array' (BSON doubles).
+# Readers accept both; convert old documents with `manage.py migrate_embedding_storage`.
+RAG_EMBEDDING_STORAGE = os.getenv('RAG_EMBEDDING_STORAGE', 'binary')
+# Minimum seconds between incremental refreshes of the in-memory embedding index
+RAG_INDEX_REFRESH_SECONDS = float(os.getenv('RAG_INDEX_REFRESH_SECONDS', '5'))
+# Seconds between comparisons of the indexed pks with the stored _id set, which
+# drop embeddings of deleted products from the in-memory index
+RAG_INDEX_DELETE_CHECK_SECONDS = float(os.getenv('RAG_INDEX_DELETE_CHECK_SECONDS', '60'))
+# 'exact' (brute-force cosine) or 'ivf' (approximate, inverted-file index)
+RAG_SEARCH_ENGINE = os.getenv('RAG_SEARCH_ENGINE', 'exact')
+# Number of IVF lists; 0 picks sqrt(catalog size)
+RAG_IVF_NLIST = int(os.getenv('RAG_IVF_NLIST', '0'))
+# IVF lists scanned per query: higher = better recall, slower queries
+RAG_IVF_NPROBE = int(os.getenv('RAG_IVF_NPROBE', '8'))
+# Catalogs smaller than this are always searched exactly
+RAG_ANN_MIN_ROWS = int(os.getenv('RAG_ANN_MIN_ROWS', '10000'))
+# Serve the index from memory-mapped snapshots in this directory (shared by all
+# worker processes) instead of loading it from Mongo; written by
+# `manage.py export_embedding_snapshot`. Empty disables snapshots.
+RAG_SNAPSHOT_DIR = os.getenv('RAG_SNAPSHOT_DIR', '')
+# Compressed scoring: 'none', 'int8' (4x smaller), 'pq' (RAG_PQ_SUBSPACES bytes
+# per vector), or reduced dimensionality: 'truncate' (Matryoshka prefix of
+# RAG_REDUCED_DIM dims, renormalized) or 'pca' (projection fitted on the
+# catalog). The best top_k * RAG_RESCORE_FACTOR candidates are rescored
+# exactly against full float32 rows kept on disk (snapshot, or a spill file in
+# RAG_FLOAT_STORE_DIR; empty means the system temp dir); 0 skips the rescore.
+# Compare settings with `manage.py quantization_report`.
+RAG_QUANTIZATION = os.getenv('RAG_QUANTIZATION', 'none')
+RAG_PQ_SUBSPACES = int(os.getenv('RAG_PQ_SUBSPACES', '64'))
+RAG_RESCORE_FACTOR = int(os.getenv('RAG_RESCORE_FACTOR', '4'))
+RAG_REDUCED_DIM = int(os.getenv('RAG_REDUCED_DIM', '256'))
+RAG_FLOAT_STORE_DIR = os.getenv('RAG_FLOAT_STORE_DIR', '')
+# Split unfiltered exact scans across this many worker processes (0 = one per
+# CPU core, 1 = off) once the catalog has RAG_SHARD_MIN_ROWS rows. Workers map
+# the snapshot file, or a copy of the matrix in RAG_FLOAT_STORE_DIR / /dev/shm.
+RAG_SEARCH_SHARDS = int(os.getenv('RAG_SEARCH_SHARDS', '1'))
+RAG_SHARD_MIN_ROWS = int(os.getenv('RAG_SHARD_MIN_ROWS', '50000'))
+# Query embedding cache: per-process LRU entries and bytes, and shared (Mongo) TTL.
+# Each vector takes dim * 4 bytes (6 KB at 1536 dims, 12 KB at 3072), so
+# 2048 entries need 12-24 MB; the byte cap bounds it whatever the model
+RAG_QUERY_CACHE_SIZE = int(os.getenv('RAG_QUERY_CACHE_SIZE', '2048'))
+RAG_QUERY_CACHE_MAX_BYTES = int(os.getenv('RAG_QUERY_CACHE_MAX_BYTES', str(16 * 2 ** 20)))
+RAG_QUERY_CACHE_TTL_SECONDS = int(os.getenv('RAG_QUERY_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+# Offline TF-IDF index used when query embeddings are unavailable
+RAG_LOCAL_EMBEDDING_DIM = int(os.getenv('RAG_LOCAL_EMBEDDING_DIM', '512'))
+RAG_LOCAL_INDEX_REFRESH_SECONDS = float(os.getenv('RAG_LOCAL_INDEX_REFRESH_SECONDS', '300'))
+# BM25 keyword index rebuild interval; local saves/deletes apply immediately
+RAG_KEYWORD_INDEX_REFRESH_SECONDS = float(os.getenv('RAG_KEYWORD_INDEX_REFRESH_SECONDS', '300'))
+# Most products returned by `?search=` on the product list (BM25 rank order,
+# also the upper bound of its top_k param); there is no further page
+RAG_KEYWORD_SEARCH_LIMIT = int(os.getenv('RAG_KEYWORD_SEARCH_LIMIT', '50'))
+# Hybrid search: candidates taken from each ranking, and the RRF smoothing constant
+RAG_HYBRID_CANDIDATES = int(os.getenv('RAG_HYBRID_CANDIDATES', '50'))
+RAG_HYBRID_RRF_K = int(os.getenv('RAG_HYBRID_RRF_K', '60'))
+# Token budget of the product table in the recommendation prompt; descriptions
+# are trimmed (at most RAG_PROMPT_DESCRIPTION_CHARS each) to fit it
+RAG_PROMPT_CONTEXT_TOKENS = int(os.getenv('RAG_PROMPT_CONTEXT_TOKENS', '800'))
+RAG_PROMPT_DESCRIPTION_CHARS = int(os.getenv('RAG_PROMPT_DESCRIPTION_CHARS', '160'))
+# Semantic response cache for first-turn recommendations: openers whose query
+# embedding has at least this cosine similarity to a cached one reuse its reply
+RAG_RESPONSE_CACHE = os.getenv('RAG_RESPONSE_CACHE', 'True').lower() == 'true'
+RAG_RESPONSE_CACHE_THRESHOLD = float(os.getenv('RAG_RESPONSE_CACHE_THRESHOLD', '0.92'))
+RAG_RESPONSE_CACHE_SIZE = int(os.getenv('RAG_RESPONSE_CACHE_SIZE', '512'))
+RAG_RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RAG_RESPONSE_CACHE_TTL_SECONDS', '3600'))
+# Search result cache (per process): entries, approximate bytes and TTL.
+# RAG_SEARCH_CACHE_PAYLOADS also keeps the serialized response, not only pks;
+# product edits not seen by this process's index are then served stale for the TTL.
+RAG_SEARCH_CACHE_SIZE = int(os.getenv('RAG_SEARCH_CACHE_SIZE', '1024'))
+RAG_SEARCH_CACHE_MAX_BYTES = int(os.getenv('RAG_SEARCH_CACHE_MAX_BYTES', str(32 * 2 ** 20)))
+RAG_SEARCH_CACHE_TTL_SECONDS = float(os.getenv('RAG_SEARCH_CACHE_TTL_SECONDS', '300'))
+RAG_SEARCH_CACHE_PAYLOADS = os.getenv('RAG_SEARCH_CACHE_PAYLOADS', 'False').lower() == 'true'
+# Start the OpenRouter health monitor and (in 'thread' mode) the indexer on a
+# process's first request; False leaves them to dedicated processes
+RAG_BACKGROUND_THREADS = os.getenv('RAG_BACKGROUND_THREADS', 'True').lower() == 'true'
+# Embedding indexer: 'thread' starts it in each server process, 'off' expects
+# a separate `manage.py run_indexer` process (recommended under gunicorn). Only
+# the holder of a lease renewed while it works (expiring after LEASE_SECONDS) runs it
+RAG_INDEXER_MODE = os.getenv('RAG_INDEXER_MODE', 'thread')
+RAG_INDEXER_POLL_SECONDS = float(os.getenv('RAG_INDEXER_POLL_SECONDS', '2'))
+RAG_INDEXER_LEASE_SECONDS = float(os.getenv('RAG_INDEXER_LEASE_SECONDS', '30'))
+# How often the whole catalog is rescanned for missing/stale embeddings
+RAG_INDEXER_RECONCILE_SECONDS = float(os.getenv('RAG_INDEXER_RECONCILE_SECONDS', '3600'))
+# Embedding backfill: batches are sized to a token budget (and item cap), run
+# RAG_EMBED_CONCURRENCY at a time, and retried with exponential backoff
+RAG_EMBED_BATCH_TOKENS = int(os.getenv('RAG_EMBED_BATCH_TOKENS', '16000'))
+RAG_EMBED_BATCH_MAX_ITEMS = int(os.getenv('RAG_EMBED_BATCH_MAX_ITEMS', '256'))
+RAG_EMBED_CONCURRENCY = int(os.getenv('RAG_EMBED_CONCURRENCY', '4'))
+RAG_EMBED_MAX_RETRIES = int(os.getenv('RAG_EMBED_MAX_RETRIES', '4'))
+RAG_EMBED_RETRY_BACKOFF_SECONDS = float(os.getenv('RAG_EMBED_RETRY_BACKOFF_SECONDS', '1'))
+# Write concern for embedding writes made by the indexer and backfills, e.g.
+# w=1 (default), w=majority for durability, j=True to wait for the journal
+RAG_INDEX_WRITE_CONCERN_W = os.getenv('RAG_INDEX_WRITE_CONCERN_W', '1')
+RAG_INDEX_WRITE_CONCERN_J = os.getenv('RAG_INDEX_WRITE_CONCERN_J', 'False').lower() == 'true'
 
 # Internationalization
 LANGUAGE_CODE = 'en-us'